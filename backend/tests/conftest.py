@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# Tests import the backend modules the way main.py does (utils.*, tools.*)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Config is read once at import: keep logs and caches out of the source tree and
+# give the Azure OpenAI client the settings it needs to be constructed
+_tmp = tempfile.mkdtemp(prefix="aiops-tests-")
+os.environ.setdefault("LOG_DIR", os.path.join(_tmp, "logs"))
+os.environ.setdefault("INVESTIGATION_STORE_PATH", os.path.join(_tmp, "investigations.sqlite"))
+os.environ.setdefault("KQL_CACHE_PATH", os.path.join(_tmp, "kql_cache.sqlite"))
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(_tmp, "llm_cache.sqlite"))
+os.environ.setdefault("LLM_RECORD_PATH", os.path.join(_tmp, "llm_recordings.sqlite"))
+os.environ.setdefault("ENVIRONMENT", "dev")
+os.environ.setdefault("AZURE_OPENAI_API_VERSION", "2024-06-01")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
@@ -0,0 +1,70 @@
+import asyncio
+import time
+import pytest
+from utils.azauth import AZ_LOGIN_COMMAND, AzureCliSession
+from utils.config import Config
+
+def _alive(pid: int) -> bool:
+    # A killed orphan may linger as a zombie until init reaps it
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+    except FileNotFoundError:
+        return False
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setenv("AZURE_CLIENT_ID", "client-1")
+    monkeypatch.setenv("AZURE_TENANT_ID", "tenant-1")
+    monkeypatch.setattr(Config, "az_resourcegroup", "rg-prod")
+    monkeypatch.setattr(Config, "az_aks_name", "aks-prod")
+    session = AzureCliSession()
+    session.logged_in_at = time.time()
+    session.credentials_output = ""
+    return session
+
+def test_session_auth_steps_are_skipped(session):
+    assert session.redundant_command(AZ_LOGIN_COMMAND) == ""
+    assert session.redundant_command("az aks get-credentials -g rg-prod -n aks-prod --overwrite-existing && kubectl get pods") == "kubectl get pods"
+    assert session.redundant_command("az aks get-credentials --resource-group=RG-PROD --name aks-prod") == ""
+    assert session.skipped_commands == 3
+
+@pytest.mark.parametrize("command", [
+    "az aks get-credentials -g rg-staging -n aks-prod",
+    "az aks get-credentials -g rg-prod -n aks-other",
+    "az aks get-credentials -g rg-prod -n aks-prod --subscription other",
+    "az aks get-credentials -g rg-prod -n aks-prod --admin",
+    "az login --service-principal -u someone-else -t tenant-1 --federated-token x",
+    "az login",
+    "kubectl get pods",
+])
+def test_other_targets_are_left_to_run(session, command):
+    assert session.redundant_command(command) is None
+
+def test_nothing_is_skipped_before_login(session):
+    session.logged_in_at = None
+    assert session.redundant_command(AZ_LOGIN_COMMAND) is None
+
+def test_failed_login_is_retried_on_a_short_backoff(session, monkeypatch):
+    monkeypatch.setattr(Config, "az_login_retry_interval", 30)
+    monkeypatch.setattr(Config, "az_login_refresh_interval", 100)
+    session.failures = 1
+    assert session._next_delay() == 30
+    session.failures = 2
+    assert session._next_delay() == 60
+    session.failures = 5
+    assert session._next_delay() == 100
+
+def test_timed_out_command_is_killed_and_reaped(session, monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "shell_timeout", 0.2)
+    marker = tmp_path / "child.pid"
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await session._run(f"sleep 30 & echo $! > {marker}; wait")
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+    assert time.monotonic() - started < 5
+    # The background child in the same process group is gone as well
+    assert not _alive(int(marker.read_text()))
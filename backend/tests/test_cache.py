@@ -0,0 +1,36 @@
+import time
+import pytest
+from utils.cache import TTLCache
+
+@pytest.fixture(params=["memory", "disk"])
+def backend(request, tmp_path):
+    return {"backend": request.param, "path": str(tmp_path / "cache.sqlite")}
+
+def test_entries_expire_after_their_ttl(backend):
+    cache = TTLCache(ttl=60, **backend)
+    cache.set("fresh", "a")
+    cache.set("stale", "b", ttl=-1)
+    assert cache.get("fresh") == "a"
+    assert cache.get("stale") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_least_recently_used_entry_is_evicted(backend):
+    cache = TTLCache(ttl=60, max_entries=2, **backend)
+    cache.set("a", "1")
+    time.sleep(0.01)
+    cache.set("b", "2")
+    time.sleep(0.01)
+    assert cache.get("a") == "1"
+    time.sleep(0.01)
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+def test_disk_entries_survive_a_new_instance(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    TTLCache(backend="disk", path=path, table="kql_cache").set("query", "rows")
+    assert TTLCache(backend="disk", path=path, table="kql_cache").get("query") == "rows"
@@ -0,0 +1,84 @@
+import asyncio
+import json
+from autogen_core import FunctionCall
+from autogen_core.models import (
+    AssistantMessage, CreateResult, FunctionExecutionResult, FunctionExecutionResultMessage, RequestUsage, SystemMessage,
+    UserMessage
+)
+from autogen_ext.models.replay import ReplayChatCompletionClient
+from utils.compaction import CompactingChatCompletionClient, compaction_stats, summarize_text
+from utils.modelclient import DelegatingChatCompletionClient
+
+MODEL_INFO = {"function_calling": True, "vision": False, "json_output": False, "family": "gpt-4o", "structured_output": False}
+
+class _Model(DelegatingChatCompletionClient):
+    """Counts four characters per token and keeps the messages of every call."""
+
+    def __init__(self):
+        super().__init__(ReplayChatCompletionClient([], model_info=MODEL_INFO))
+        self.calls = []
+
+    def count_tokens(self, messages, **kwargs) -> int:
+        return sum(len(json.dumps(message.model_dump(mode="json"))) for message in messages) // 4
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        self.calls.append(list(messages))
+        return CreateResult(finish_reason="stop", content="ok", cached=False, usage=RequestUsage(prompt_tokens=0, completion_tokens=0))
+
+def _logs(index: int, lines: int = 200) -> str:
+    rows = [f"2024-05-01T10:00:{i % 60:02d}Z GET /api/orders 200 in {i} ms" for i in range(lines)]
+    rows[lines // 2] = f"2024-05-01T10:01:00Z ERROR payments-db connection refused (call {index})"
+    return "\n".join(rows)
+
+def _history(tool_calls: int):
+    messages = [SystemMessage(content="You are the AKS specialist."), UserMessage(content="Why is checkout failing?", source="user")]
+    for index in range(tool_calls):
+        call_id = f"call-{index}"
+        messages.append(AssistantMessage(content=[FunctionCall(id=call_id, name="shell", arguments='{"command": "kubectl logs"}')], source="aks"))
+        messages.append(FunctionExecutionResultMessage(content=[FunctionExecutionResult(content=_logs(index), name="shell", call_id=call_id, is_error=False)]))
+    return messages
+
+def _client(**kwargs) -> CompactingChatCompletionClient:
+    return CompactingChatCompletionClient(_Model(), "aks", **kwargs)
+
+def test_summary_keeps_the_head_and_notable_lines():
+    summary = summarize_text(_logs(7), max_chars=600)
+    assert summary.startswith("2024-05-01T10:00:00Z GET /api/orders")
+    assert "10:01:00Z ERROR payments-db connection" in summary
+    assert len(summary) < 1200
+
+def test_short_history_is_sent_as_is():
+    client = _client(max_tokens=100_000, keep_recent=8)
+    messages = _history(2)
+    asyncio.run(client.create(messages))
+    assert client.inner.calls[0] == messages
+
+def test_old_tool_results_are_summarized_and_recent_ones_kept():
+    client = _client(max_tokens=100_000, keep_recent=4, max_chars=500)
+    messages = _history(6)
+
+    compacted = client.compact(messages)
+
+    assert compacted[:2] == messages[:2]
+    assert compacted[-4:] == messages[-4:]
+    old_result = compacted[3].content[0]
+    assert old_result.content.startswith("[compacted result of shell, call call-0]")
+    assert "ERROR payments-db connection" in old_result.content
+    assert len(compacted) == len(messages)
+
+def test_oldest_messages_are_dropped_to_fit_without_splitting_tool_calls():
+    client = _client(max_tokens=3000, keep_recent=4, max_chars=500)
+    messages = _history(30)
+    before = compaction_stats()["compacted_turns"]
+
+    asyncio.run(client.create(messages))
+
+    sent = client.inner.calls[0]
+    assert client.inner.count_tokens(sent) <= 3000
+    assert sent[:2] == messages[:2]
+    assert "earlier messages omitted" in sent[2].content
+    for previous, message in zip(sent, sent[1:]):
+        if isinstance(message, FunctionExecutionResultMessage):
+            assert isinstance(previous, AssistantMessage)
+            assert previous.content[0].id == message.content[0].call_id
+    assert compaction_stats()["compacted_turns"] == before + 1
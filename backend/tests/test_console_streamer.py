@@ -0,0 +1,114 @@
+import asyncio
+from utils.config import Config
+from utils.console_streamer import ConsoleStreamer, ReplayLog
+from utils.context import investigation_id_var
+
+class _Socket:
+    """Records frames and how many sends were ever in progress at once."""
+
+    def __init__(self):
+        self.frames = []
+        self.sending = 0
+        self.max_sending = 0
+
+    async def send_json(self, frame):
+        self.sending += 1
+        self.max_sending = max(self.max_sending, self.sending)
+        await asyncio.sleep(0.001)
+        self.frames.append(frame)
+        self.sending -= 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+def test_stream_frames_and_session_replies_share_the_send_lock():
+    async def scenario():
+        streamer = ConsoleStreamer(flush_interval=0.001)
+        socket, lock = _Socket(), asyncio.Lock()
+        streamer.add_websocket(socket, send_lock=lock)
+
+        async def reply(index: int):
+            async with lock:
+                await socket.send_json({"type": "pong", "ping": index})
+
+        for index in range(20):
+            streamer.enqueue("STDOUT", f"line {index}")
+            await streamer.flush()
+            await reply(index)
+        await asyncio.sleep(0.05)
+        await streamer.stop()
+        return socket
+
+    socket = asyncio.run(scenario())
+    assert socket.max_sending == 1
+    assert sum(frame.get("type") == "pong" for frame in socket.frames) == 20
+    assert sum(len(frame["messages"]) for frame in socket.frames if frame.get("type") == "batch") == 20
+
+def _emit(streamer: ConsoleStreamer, investigation_id, text: str):
+    token = investigation_id_var.set(investigation_id)
+    try:
+        streamer.enqueue("STDOUT", text)
+    finally:
+        investigation_id_var.reset(token)
+
+def test_replay_log_trims_the_oldest_events():
+    log = ReplayLog(max_events=3)
+    for seq in range(1, 6):
+        log.append({"seq": seq})
+    assert log.since(3) == ([{"seq": 4}, {"seq": 5}], False)
+    events, truncated = log.since(1)
+    assert [event["seq"] for event in events] == [3, 4, 5]
+    assert truncated
+
+def test_reconnecting_client_receives_only_what_it_missed():
+    async def scenario():
+        streamer = ConsoleStreamer()
+        for index in range(3):
+            _emit(streamer, "inv-a", f"a{index}")
+            _emit(streamer, "inv-b", f"b{index}")
+        await streamer.flush()
+
+        socket = _Socket()
+        streamer.add_websocket(socket)
+        replayed = streamer.replay(socket, last_seq=3)
+        await asyncio.sleep(0.01)
+        await streamer.stop()
+        return replayed, socket.frames
+
+    replayed, frames = asyncio.run(scenario())
+    assert replayed == 3
+    assert frames[0]["replay"] and not frames[0]["truncated"]
+    assert [message["text"] for message in frames[0]["messages"]] == ["b1", "a2", "b2"]
+
+def test_attached_client_only_sees_its_investigation():
+    async def scenario():
+        streamer = ConsoleStreamer()
+        _emit(streamer, "inv-a", "a0")
+        _emit(streamer, "inv-b", "b0")
+        await streamer.flush()
+
+        socket = _Socket()
+        streamer.add_websocket(socket)
+        streamer.replay(socket, investigation_id="inv-a")
+        _emit(streamer, "inv-b", "b1")
+        _emit(streamer, "inv-a", "a1")
+        await streamer.flush()
+        await asyncio.sleep(0.01)
+        await streamer.stop()
+        return socket.frames
+
+    frames = asyncio.run(scenario())
+    texts = [message["text"] for frame in frames for message in frame["messages"]]
+    assert texts == ["a0", "a1"]
+
+def test_quiet_investigations_are_forgotten_first(monkeypatch):
+    monkeypatch.setattr(Config, "stream_replay_investigations", 2)
+
+    async def scenario():
+        streamer = ConsoleStreamer()
+        for investigation_id in ("inv-a", "inv-b", "inv-a", "inv-c"):
+            _emit(streamer, investigation_id, investigation_id)
+            await streamer.flush()
+        return [entry["investigation_id"] for entry in streamer.investigations()]
+
+    assert asyncio.run(scenario()) == ["inv-c", "inv-a"]
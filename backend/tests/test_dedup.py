@@ -0,0 +1,110 @@
+import asyncio
+from utils.dedup import COALESCED, DUPLICATE, NEW, AlertDeduplicator, alert_keys
+from utils.scheduler import AlertQueueFullError, AlertScheduler
+
+def _alert(workload: str, problem: str, namespace: str = "shop") -> dict:
+    return {"problemId": problem, "k8s.namespace.name": namespace, "k8s.workload.name": workload, "timestamp": problem}
+
+class _Pipeline:
+    """A scheduler with one stuck worker, fed by a deduplicator the way the API wires them."""
+
+    def __init__(self, queue_size: int, coalesce_window: float):
+        self.jobs = []
+        self.scheduler = AlertScheduler(max_queue_size=queue_size, workers=1)
+        self.scheduler.start(self._handle)
+        self.deduplicator = AlertDeduplicator(
+            dispatch=lambda group: self.scheduler.submit(group.event(), priority=group.priority, alert_id=group.group_id, reserved=True),
+            admit=self.scheduler.reserve,
+            coalesce_window=coalesce_window,
+        )
+
+    async def _handle(self, job):
+        self.jobs.append(job)
+        await asyncio.Event().wait()
+
+    async def stop(self):
+        await self.scheduler.stop(drain=False)
+
+def test_alert_keys_ignore_volatile_fields():
+    first, key = alert_keys({**_alert("checkout", "P-1"), "timestamp": "10:00"})
+    again, _ = alert_keys({**_alert("checkout", "P-1"), "timestamp": "10:05"})
+    other, other_key = alert_keys(_alert("checkout", "P-2"))
+    assert first == again
+    assert first != other
+    assert key == other_key == "|shop|checkout"
+
+def test_repeats_and_correlated_alerts_join_one_investigation():
+    async def scenario():
+        pipeline = _Pipeline(queue_size=5, coalesce_window=0.05)
+        group, outcome = pipeline.deduplicator.submit(_alert("checkout", "P-1"), priority=2)
+        repeat, repeat_outcome = pipeline.deduplicator.submit(_alert("checkout", "P-1"), priority=2)
+        merged, merged_outcome = pipeline.deduplicator.submit(_alert("checkout", "P-2"), priority=0)
+        await asyncio.sleep(0.1)
+        job = pipeline.jobs[0]
+        await pipeline.stop()
+        return group, (outcome, repeat_outcome, merged_outcome), (repeat, merged), job
+
+    group, outcomes, others, job = asyncio.run(scenario())
+    assert outcomes == (NEW, DUPLICATE, COALESCED)
+    assert all(other is group for other in others)
+    assert group.dispatched
+    assert job.alert_id == group.group_id
+    assert job.priority == 0
+    assert "correlated_alerts" in job.event
+
+def test_burst_is_rejected_up_front_while_groups_collect():
+    async def scenario():
+        pipeline = _Pipeline(queue_size=5, coalesce_window=0.05)
+        accepted, rejected = [], 0
+        for index in range(20):
+            try:
+                accepted.append(pipeline.deduplicator.submit(_alert(f"app-{index}", f"P-{index}"), priority=3)[0])
+            except AlertQueueFullError:
+                rejected += 1
+        await asyncio.sleep(0.1)
+        queued = pipeline.scheduler.submitted
+        await pipeline.stop()
+        return accepted, rejected, queued
+
+    accepted, rejected, queued = asyncio.run(scenario())
+    # Every acknowledged alert ends up queued
+    assert len(accepted) == 5
+    assert rejected == 15
+    assert queued == 5
+    assert all(group.dispatched for group in accepted)
+
+def test_flush_dispatches_collecting_groups_once():
+    async def scenario():
+        pipeline = _Pipeline(queue_size=5, coalesce_window=0.05)
+        group, _ = pipeline.deduplicator.submit(_alert("checkout", "P-1"), priority=3)
+        pipeline.deduplicator.flush()
+        flushed = pipeline.scheduler.submitted
+        await asyncio.sleep(0.1)
+        queued = pipeline.scheduler.submitted
+        await pipeline.stop()
+        return group, flushed, queued, pipeline.scheduler.reserved
+
+    group, flushed, queued, reserved = asyncio.run(scenario())
+    assert group.dispatched
+    assert flushed == queued == 1
+    assert reserved == 0
+
+def test_repeat_is_suppressed_until_the_window_expires():
+    async def scenario():
+        pipeline = _Pipeline(queue_size=5, coalesce_window=0)
+        pipeline.deduplicator.window = 0.05
+        group, _ = pipeline.deduplicator.submit(_alert("checkout", "P-1"), priority=3)
+        pipeline.deduplicator.complete(group.group_id)
+        _, during = pipeline.deduplicator.submit(_alert("checkout", "P-1"), priority=3)
+        await asyncio.sleep(0.1)
+        _, after = pipeline.deduplicator.submit(_alert("checkout", "P-1"), priority=3)
+        await pipeline.stop()
+        return during, after
+
+    assert asyncio.run(scenario()) == (DUPLICATE, NEW)
+
+def test_unknown_payload_falls_back_to_its_content():
+    first, key = alert_keys({"title": "disk full", "timestamp": 1})
+    again, _ = alert_keys({"title": "disk full", "timestamp": 2})
+    assert first == again
+    assert key is None
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import ToolCallSummaryMessage
+from autogen_core import FunctionCall
+from autogen_core.models import CreateResult, RequestUsage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+from utils.fanout import FanOutTeam, parse_plan, resolve_team_mode
+
+MODEL_INFO = {"function_calling": True, "vision": False, "json_output": False, "family": "gpt-4o", "structured_output": False}
+
+async def get_pod_status(namespace: str) -> str:
+    """Returns the status of the pods in a namespace."""
+    return f"{namespace}/checkout-7d9f: CrashLoopBackOff (OOMKilled)"
+
+def _tool_call(name: str, arguments: dict) -> CreateResult:
+    return CreateResult(
+        finish_reason="function_calls",
+        content=[FunctionCall(id="call-1", name=name, arguments=json.dumps(arguments))],
+        usage=RequestUsage(prompt_tokens=10, completion_tokens=5),
+        cached=False,
+    )
+
+def _specialist() -> AssistantAgent:
+    return AssistantAgent(
+        "aks_specialist",
+        model_client=ReplayChatCompletionClient([_tool_call("get_pod_status", {"namespace": "shop"})], model_info=MODEL_INFO),
+        tools=[get_pod_status],
+        description="Checks the AKS cluster",
+        reflect_on_tool_use=False,
+    )
+
+def _run(team: FanOutTeam, task: str) -> TaskResult:
+    return asyncio.run(team.run(task=task))
+
+def test_tool_calling_specialist_answer_reaches_the_planner():
+    planner = ReplayChatCompletionClient([
+        json.dumps({"done": False, "subtasks": [{"agent": "aks_specialist", "task": "check the shop pods"}]}),
+        json.dumps({"done": True, "final_answer": "checkout is OOMKilled"}),
+    ], model_info=MODEL_INFO)
+    team = FanOutTeam([_specialist()], planner, max_rounds=2)
+
+    result = _run(team, "checkout is failing")
+
+    assert any(isinstance(message, ToolCallSummaryMessage) for message in result.messages)
+    # The second planning step sees the tool output as the specialist's finding
+    context = planner.create_calls[-1]["messages"][-1].content
+    assert "CrashLoopBackOff (OOMKilled)" in context
+    assert "(sem resposta)" not in context
+    assert result.messages[-1].source == "fanout_planner"
+    assert result.messages[-1].content == "checkout is OOMKilled"
+    assert result.stop_reason == "Planner finished"
+
+def test_structured_final_answer_is_serialized():
+    planner = ReplayChatCompletionClient([
+        json.dumps({"done": True, "final_answer": {"root_cause": "OOMKilled", "pods": 2}}),
+    ], model_info=MODEL_INFO)
+    team = FanOutTeam([_specialist()], planner, max_rounds=1)
+
+    result = _run(team, "checkout is failing")
+
+    assert json.loads(result.messages[-1].content) == {"root_cause": "OOMKilled", "pods": 2}
+
+def test_unknown_agents_are_ignored_and_the_planner_is_asked_to_finish():
+    planner = ReplayChatCompletionClient([
+        json.dumps({"done": False, "subtasks": [{"agent": "nobody", "task": "x"}]}),
+    ], model_info=MODEL_INFO)
+    team = FanOutTeam([_specialist()], planner, max_rounds=1)
+
+    result = _run(team, "checkout is failing")
+
+    assert len(result.messages) == 2
+    assert json.loads(result.messages[-1].content)["subtasks"][0]["agent"] == "nobody"
+
+def test_parse_plan_and_team_mode():
+    assert parse_plan('Plan:\n{"done": false, "subtasks": []}') == {"done": False, "subtasks": []}
+    assert parse_plan("no json here") == {"done": True, "final_answer": "no json here"}
+    assert resolve_team_mode("FanOut") == "fanout"
@@ -0,0 +1,81 @@
+import asyncio
+import json
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import TextMessage
+from utils.investigations import InvestigationRecorder, InvestigationStore, alert_signature
+
+def _alert(problem: str, workload: str = "checkout", title: str = "Memory saturation", **extra) -> str:
+    return json.dumps({
+        "problemId": problem, "problemTitle": title, "k8s.cluster.name": "aks-prod",
+        "k8s.namespace.name": "shop", "k8s.workload.name": workload, **extra,
+    })
+
+def _recorder(diagnosis: str = "checkout is OOMKilled") -> InvestigationRecorder:
+    recorder = InvestigationRecorder()
+    recorder.observe(TextMessage(source="user", content="the alert"))
+    recorder.observe(TextMessage(source="MagenticOneOrchestrator", content=diagnosis))
+    recorder.observe(TaskResult(messages=[], stop_reason="done"))
+    return recorder
+
+def _store(tmp_path, **kwargs) -> InvestigationStore:
+    return InvestigationStore(path=str(tmp_path / "investigations.sqlite"), **kwargs)
+
+def test_signature_ignores_volatile_fields_and_masks_timestamps():
+    first = alert_signature(_alert("P-1", startTime="2024-05-01T10:00:00Z", problemDetails="since 2024-05-01T10:00:00Z"))
+    again = alert_signature(_alert("P-1", startTime="2024-05-02T11:00:00Z", problemDetails="since 2024-05-02T11:00:00Z"))
+    assert first == again
+    assert "checkout" in first
+
+def test_same_problem_is_matched_by_fingerprint(tmp_path):
+    async def scenario():
+        store = _store(tmp_path, threshold=0.97)
+        await store.save("inv-1", _alert("P-1", startTime="10:00"), _recorder())
+        return await store.lookup(_alert("P-1", startTime="10:05"))
+
+    match = asyncio.run(scenario())
+    assert match["investigation_id"] == "inv-1"
+    assert match["matched_by"] == "fingerprint"
+    assert match["diagnosis"] == "checkout is OOMKilled"
+
+def test_similar_alert_matches_only_for_the_same_resource(tmp_path):
+    async def scenario():
+        store = _store(tmp_path, threshold=0.8)
+        await store.save("inv-1", _alert("P-1"), _recorder())
+        same_resource = await store.lookup(_alert("P-2"))
+        other_workload = await store.lookup(_alert("P-3", workload="payments"))
+        return same_resource, other_workload, store.stats()
+
+    same_resource, other_workload, stats = asyncio.run(scenario())
+    assert same_resource["matched_by"] == "ngram"
+    assert 0.8 <= same_resource["similarity"] < 1
+    assert other_workload is None
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+def test_alert_without_a_resource_is_never_matched_by_similarity(tmp_path):
+    async def scenario():
+        store = _store(tmp_path, threshold=0.1)
+        await store.save("inv-1", json.dumps({"title": "disk full on build agent"}), _recorder())
+        return await store.lookup(json.dumps({"title": "disk full on build agent 2"}))
+
+    assert asyncio.run(scenario()) is None
+
+def test_old_and_undiagnosed_investigations_are_not_used(tmp_path):
+    async def scenario():
+        store = _store(tmp_path, max_age=0)
+        await store.save("inv-1", _alert("P-1"), _recorder())
+        expired = await store.lookup(_alert("P-1"))
+
+        fresh = _store(tmp_path / "other")
+        await fresh.save("inv-2", _alert("P-1"), InvestigationRecorder())
+        return expired, fresh.stats()["saves"]
+
+    expired, saves = asyncio.run(scenario())
+    assert expired is None
+    assert saves == 0
+
+def test_store_is_reloaded_from_disk(tmp_path):
+    async def scenario():
+        await _store(tmp_path).save("inv-1", _alert("P-1"), _recorder())
+        return await _store(tmp_path).lookup(_alert("P-1"))
+
+    assert asyncio.run(scenario())["investigation_id"] == "inv-1"
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import stat
+import pytest
+from tools.kubestate import KubeStateCache
+from utils.config import Config
+
+def _alive(pid: int) -> bool:
+    # A killed orphan may linger as a zombie until init reaps it
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            return stat_file.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+    except FileNotFoundError:
+        return False
+
+@pytest.fixture
+def hanging_kubectl(monkeypatch, tmp_path):
+    # A kubectl that never answers and has a child of its own
+    marker = tmp_path / "child.pid"
+    kubectl = tmp_path / "kubectl"
+    kubectl.write_text(f"#!/bin/sh\nsleep 30 &\necho $! > {marker}\nwait\n")
+    kubectl.chmod(kubectl.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return marker
+
+async def _child(marker) -> int:
+    while not marker.exists() or not marker.read_text().strip():
+        await asyncio.sleep(0.01)
+    return int(marker.read_text())
+
+def test_timed_out_refresh_kills_kubectl(hanging_kubectl, monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "shell_timeout", 0.3)
+    cache = KubeStateCache(path=str(tmp_path / "state.json"))
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await cache.refresh()
+        return await _child(hanging_kubectl)
+
+    assert not _alive(asyncio.run(scenario()))
+
+def test_cancelled_refresh_kills_kubectl(hanging_kubectl, tmp_path):
+    cache = KubeStateCache(path=str(tmp_path / "state.json"))
+
+    async def scenario():
+        task = asyncio.create_task(cache.refresh())
+        child = await _child(hanging_kubectl)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return child
+
+    assert not _alive(asyncio.run(scenario()))
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+from autogen_core import CancellationToken
+from autogen_core.models import UserMessage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+from utils.config import Config
+from utils.modelclient import (
+    CachingChatCompletionClient, DelegatingChatCompletionClient, LLMReplayMissError, client_stats, wrap_model_client
+)
+
+MODEL_INFO = {"function_calling": True, "vision": False, "json_output": False, "family": "gpt-4o", "structured_output": False}
+
+class _GatedClient(DelegatingChatCompletionClient):
+    """Scripted model whose calls wait until the gate is opened."""
+
+    def __init__(self, *replies):
+        super().__init__(ReplayChatCompletionClient(list(replies), model_info=MODEL_INFO))
+        self.gate = asyncio.Event()
+        self.calls = 0
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        await self.gate.wait()
+        # The replay client marks its answers as cached; a real call is not
+        result = await self.inner.create(messages)
+        return result.model_copy(update={"cached": False})
+
+def _messages(text: str = "Investigate the checkout alert"):
+    return [UserMessage(content=text, source="user")]
+
+def test_cache_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(Config, "llm_rate_limit_tpm", 0)
+    monkeypatch.setattr(Config, "llm_rate_limit_rpm", 0)
+    client = ReplayChatCompletionClient(["a"], model_info=MODEL_INFO)
+    assert Config.llm_cache_mode == "off"
+    assert wrap_model_client(client) is client
+
+def test_repeated_request_is_served_from_the_cache():
+    async def scenario():
+        inner = _GatedClient("first", "second")
+        inner.gate.set()
+        client = CachingChatCompletionClient(inner, mode="cache")
+        first = await client.create(_messages())
+        again = await client.create(_messages())
+        other = await client.create(_messages("Something else"))
+        return inner, client, first, again, other
+
+    inner, client, first, again, other = asyncio.run(scenario())
+    assert (first.content, first.cached) == ("first", False)
+    assert (again.content, again.cached) == ("first", True)
+    assert other.content == "second"
+    assert inner.calls == 2
+    assert client_stats(client)["llm_cache"]["hits"] == 1
+
+def test_identical_requests_in_flight_share_one_call():
+    async def scenario():
+        inner = _GatedClient("only")
+        client = CachingChatCompletionClient(inner, mode="cache")
+        calls = [asyncio.create_task(client.create(_messages())) for _ in range(3)]
+        await asyncio.sleep(0)
+        inner.gate.set()
+        return inner, client, await asyncio.gather(*calls)
+
+    inner, client, results = asyncio.run(scenario())
+    assert inner.calls == 1
+    assert [result.content for result in results] == ["only"] * 3
+    assert [result.cached for result in results] == [False, True, True]
+    assert client.coalesced == 2
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def scenario():
+        inner = _GatedClient("only")
+        client = CachingChatCompletionClient(inner, mode="cache")
+        token = CancellationToken()
+        leader = asyncio.create_task(client.create(_messages(), cancellation_token=token))
+        follower = asyncio.create_task(client.create(_messages()))
+        await asyncio.sleep(0)
+        token.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        inner.gate.set()
+        return inner, client, await follower
+
+    inner, client, result = asyncio.run(scenario())
+    assert result.content == "only"
+    assert inner.calls == 1
+    assert client.inflight == {}
+
+def test_last_cancelled_caller_cancels_the_call():
+    async def scenario():
+        inner = _GatedClient("only")
+        client = CachingChatCompletionClient(inner, mode="cache")
+        call = asyncio.create_task(client.create(_messages()))
+        await asyncio.sleep(0)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+        return client
+
+    client = asyncio.run(scenario())
+    assert client.inflight == {}
+    assert client.cache.stats()["entries"] == 0
+
+def test_recorded_completions_are_replayed(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "llm_record_path", str(tmp_path / "recordings.sqlite"))
+
+    async def scenario():
+        recorder = _GatedClient("recorded")
+        recorder.gate.set()
+        await CachingChatCompletionClient(recorder, mode="record").create(_messages())
+
+        player = _GatedClient()
+        replay = CachingChatCompletionClient(player, mode="replay")
+        result = await replay.create(_messages())
+        with pytest.raises(LLMReplayMissError):
+            await replay.create(_messages("Never recorded"))
+        return player, result
+
+    player, result = asyncio.run(scenario())
+    assert (result.content, result.cached) == ("recorded", True)
+    assert player.calls == 0
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        CachingChatCompletionClient(ReplayChatCompletionClient([], model_info=MODEL_INFO), mode="sometimes")
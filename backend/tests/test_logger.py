@@ -0,0 +1,46 @@
+import json
+import logging
+import os
+import time
+from utils.config import Config
+from utils.console_streamer import WebSocketLogHandler
+from utils.logger import setup_logger
+
+class _Streamer:
+    def __init__(self):
+        self.lines = []
+
+    def enqueue(self, sender, message):
+        self.lines.append((sender, message))
+
+def _written(marker: str, timeout: float = 2.0) -> list:
+    # The listener thread writes asynchronously
+    path = os.path.join(Config.log_dir, "app.log")
+    deadline = time.monotonic() + timeout
+    entries = []
+    while time.monotonic() < deadline:
+        with open(path) as log_file:
+            entries = [json.loads(line) for line in log_file if marker in line]
+        if entries:
+            time.sleep(0.1)
+            with open(path) as log_file:
+                return [json.loads(line) for line in log_file if marker in line]
+        time.sleep(0.02)
+    return entries
+
+def test_records_are_written_once_and_streamed():
+    setup_logger("utils.logtest")
+    child = setup_logger("utils.logtest.child")
+    setup_logger("utils.logtest.child")
+    streamer = _Streamer()
+    handler = WebSocketLogHandler(streamer)
+    logging.getLogger().addHandler(handler)
+    try:
+        child.info("marker-%s", "0f3a")
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    entries = _written("marker-0f3a")
+    assert len(entries) == 1
+    assert entries[0]["logger"] == "utils.logtest.child"
+    assert streamer.lines == [("LOG_INFO", "marker-0f3a")]
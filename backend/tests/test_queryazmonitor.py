@@ -0,0 +1,92 @@
+import asyncio
+import json
+from datetime import timedelta
+import pytest
+from azure.monitor.query import LogsQueryError, LogsQueryPartialResult, LogsQueryResult, LogsTable
+import tools.queryazmonitor as queryazmonitor
+from tools.queryazmonitor import KqlQueryCache, query_azure_monitor, query_azure_monitor_batch
+
+def _table(*messages) -> LogsTable:
+    return LogsTable(name="PrimaryResult", columns=["TimeGenerated", "Message"], columns_types=["string", "string"],
+                     rows=[["2024-05-01T10:00:00Z", message] for message in messages])
+
+def _partial(*messages) -> LogsQueryPartialResult:
+    return LogsQueryPartialResult(partial_data=[_table(*messages)],
+                                  partial_error=LogsQueryError(code="PartialError", message="query exceeded the row limit"))
+
+class _Client:
+    """Answers each query with the next scripted response, for query_workspace and query_batch alike."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.queries = 0
+
+    async def query_workspace(self, workspace_id, query, timespan):
+        self.queries += 1
+        return self.responses.pop(0)
+
+    async def query_batch(self, queries):
+        self.queries += len(queries)
+        return [self.responses.pop(0) for _ in queries]
+
+@pytest.fixture
+def client(monkeypatch):
+    holder = {}
+
+    async def get_client():
+        return holder["client"]
+
+    monkeypatch.setattr(queryazmonitor, "kql_cache", KqlQueryCache())
+    monkeypatch.setattr(queryazmonitor.azure_monitor_client, "get_client", get_client)
+
+    def use(*responses) -> _Client:
+        holder["client"] = _Client(*responses)
+        return holder["client"]
+    return use
+
+def _query(query: str) -> dict:
+    return json.loads(asyncio.run(query_azure_monitor(query, timedelta(hours=1))))
+
+def test_successful_result_is_cached(client):
+    fake = client(LogsQueryResult(tables=[_table("pod restarted")]))
+    first = _query("ContainerLogV2 | take 10")
+    second = _query("// same query\nContainerLogV2\n| take 10;")
+    assert first["status"] == "success"
+    assert first["logs"][0]["Message"] == "pod restarted"
+    assert second == first
+    assert fake.queries == 1
+
+def test_partial_result_is_reported_and_not_cached(client):
+    fake = client(_partial("pod restarted"), LogsQueryResult(tables=[_table("pod restarted", "oom")]))
+    first = _query("ContainerLogV2 | take 10")
+    second = _query("ContainerLogV2 | take 10")
+    assert first["status"] == "partial"
+    assert first["message"] == "query exceeded the row limit"
+    assert first["logs"][0]["Message"] == "pod restarted"
+    assert second["status"] == "success"
+    assert fake.queries == 2
+
+def test_batch_reports_partial_results_without_caching_them(client):
+    queries = ["ContainerLogV2 | take 10", "KubeEvents | take 10", "Perf | take 10"]
+    fake = client(
+        LogsQueryResult(tables=[_table("ok")]),
+        _partial("truncated"),
+        LogsQueryError(code="BadArgument", message="syntax error"),
+    )
+    first = json.loads(asyncio.run(query_azure_monitor_batch(queries, timedelta(hours=1))))
+    assert first["status"] == "partial"
+    assert [result["status"] for result in first["results"]] == ["success", "partial", "error"]
+    assert first["results"][1]["message"] == "query exceeded the row limit"
+
+    # Only the complete result comes from the cache the second time
+    fake.responses = [_partial("truncated"), LogsQueryResult(tables=[_table("fixed")])]
+    second = json.loads(asyncio.run(query_azure_monitor_batch(queries, timedelta(hours=1))))
+    assert [result["cached"] for result in second["results"]] == [True, False, False]
+    assert fake.queries == 5
+
+def test_cache_key_ignores_comments_and_whitespace():
+    cache = KqlQueryCache()
+    key = cache.key("ContainerLogV2 | where Message has 'http://x'", "ws", timedelta(hours=1))
+    assert cache.key("// logs\nContainerLogV2\n  | where Message has 'http://x';", "ws", timedelta(hours=1)) == key
+    assert cache.key("ContainerLogV2 | where Message has 'http://x'", "other", timedelta(hours=1)) != key
+    assert cache.key("ContainerLogV2 | where Message has 'http://x'", "ws", timedelta(hours=2)) != key
@@ -0,0 +1,114 @@
+import asyncio
+import time
+import pytest
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+from utils.context import investigation_id_var
+from utils.modelclient import (
+    DelegatingChatCompletionClient, RateLimitedChatCompletionClient, TokenBucket, client_stats, request_priority_var
+)
+
+MODEL_INFO = {"function_calling": True, "vision": False, "json_output": False, "family": "gpt-4o", "structured_output": False}
+
+class _Model(DelegatingChatCompletionClient):
+    """Counts every prompt as prompt_tokens and answers with completion_tokens, recording who was served."""
+
+    def __init__(self, prompt_tokens: int = 100, completion_tokens: int = 0, error: Exception = None):
+        super().__init__(ReplayChatCompletionClient([], model_info=MODEL_INFO))
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.error = error
+        self.served = []
+
+    def count_tokens(self, messages, **kwargs) -> int:
+        return self.prompt_tokens
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        if self.error is not None:
+            raise self.error
+        self.served.append(messages[0].content)
+        return CreateResult(finish_reason="stop", content="ok", cached=False,
+                            usage=RequestUsage(prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens))
+
+class _Throttled(Exception):
+    status_code = 429
+
+async def _call(client, name: str, priority: str = "specialist", investigation_id: str = None):
+    request_priority_var.set(priority)
+    investigation_id_var.set(investigation_id)
+    return await client.create([UserMessage(content=name, source="user")])
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(per_minute=600)
+    bucket.available = 0
+    assert bucket.wait_time(100) == pytest.approx(10, abs=0.1)
+    assert bucket.wait_time(10_000) == pytest.approx(60, abs=0.1)
+
+def test_requests_within_quota_are_not_queued():
+    async def scenario():
+        client = RateLimitedChatCompletionClient(_Model(), tpm=100_000, rpm=100, completion_tokens=0)
+        await asyncio.gather(*(_call(client, f"r{index}") for index in range(5)))
+        return client_stats(client)["rate_limit"]
+
+    stats = asyncio.run(scenario())
+    assert stats["requests"] == 5
+    assert stats["queued"] == 0
+    assert stats["tokens_last_minute"] == 500
+
+def test_reservation_is_corrected_with_actual_usage():
+    async def scenario():
+        client = RateLimitedChatCompletionClient(_Model(completion_tokens=100), tpm=6000, completion_tokens=1000)
+        await _call(client, "r")
+        return client.token_bucket.available
+
+    # 1100 tokens reserved, 200 used
+    assert asyncio.run(scenario()) >= 5800
+
+def test_waiting_requests_are_served_by_priority_then_round_robin():
+    async def scenario():
+        model = _Model(prompt_tokens=100)
+        # 10,000 tokens per second: each request waits about 10ms for its quota
+        client = RateLimitedChatCompletionClient(model, tpm=600_000, completion_tokens=0)
+        client.token_bucket.available = 0
+        client.token_bucket.updated = time.monotonic()
+        calls = [
+            _call(client, "a1", investigation_id="inv-a"),
+            _call(client, "a2", investigation_id="inv-a"),
+            _call(client, "b1", investigation_id="inv-b"),
+            _call(client, "orchestrator", priority="orchestrator", investigation_id="inv-c"),
+        ]
+        await asyncio.gather(*calls)
+        return model.served, client_stats(client)["rate_limit"]
+
+    served, stats = asyncio.run(scenario())
+    assert served == ["orchestrator", "a1", "b1", "a2"]
+    assert stats["queued"] == 4
+    assert stats["max_wait_seconds"] > 0
+
+def test_cancelled_waiter_gives_up_its_turn():
+    async def scenario():
+        model = _Model(prompt_tokens=100)
+        client = RateLimitedChatCompletionClient(model, tpm=600_000, completion_tokens=0)
+        client.token_bucket.available = 0
+        client.token_bucket.updated = time.monotonic()
+        cancelled = asyncio.create_task(_call(client, "cancelled"))
+        kept = asyncio.create_task(_call(client, "kept"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, kept, return_exceptions=True)
+        return model.served, client.waiters
+
+    served, waiters = asyncio.run(scenario())
+    assert served == ["kept"]
+    assert waiters == {}
+
+def test_throttled_answer_holds_the_quota():
+    async def scenario():
+        client = RateLimitedChatCompletionClient(_Model(error=_Throttled("429")), tpm=6000, completion_tokens=0)
+        with pytest.raises(_Throttled):
+            await _call(client, "r")
+        return client
+
+    client = asyncio.run(scenario())
+    assert client.throttled == 1
+    assert client.token_bucket.available <= 100
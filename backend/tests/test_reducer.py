@@ -0,0 +1,51 @@
+from utils.reducer import ToolOutputReducer, estimate_tokens, log_template
+
+def test_log_template_masks_variable_parts():
+    line = "2024-05-01T10:00:00.123Z pod checkout-7d9f8b6c5d-x2k4p at 10.0.0.12:8080 failed after 3 retries"
+    assert log_template(line) == "<ts> pod checkout-<pod> at <ip> failed after <num> retries"
+
+def test_output_under_budget_is_unchanged():
+    records = [{"Message": "pod started"}, {"Message": "pod started"}]
+    kept, report = ToolOutputReducer(token_budget=1000).reduce(records)
+    assert kept == records
+    assert report["duplicate_rows_merged"] == 0
+
+def test_repeated_log_lines_are_merged_and_errors_kept_first():
+    records = [{"TimeGenerated": f"t{i}", "Message": f"GET /health 200 in {i} ms"} for i in range(200)]
+    records.insert(50, {"TimeGenerated": "t-err", "Message": "ERROR connection refused by payments-db"})
+    records.append({"TimeGenerated": "t-last", "Message": "worker started"})
+
+    kept, report = ToolOutputReducer(token_budget=120, top_n=10).reduce(records)
+
+    messages = [record["Message"] for record in kept]
+    assert "ERROR connection refused by payments-db" in messages
+    health = next(record for record in kept if record["Message"].startswith("GET /health"))
+    assert health["_count"] == 200
+    assert report["duplicate_rows_merged"] == 199
+    assert report["estimated_tokens_after"] <= 120
+
+def test_structured_rows_keep_their_values():
+    rows = [{"bucket": i, "requests": 100 + i, "failures": i % 7} for i in range(500)]
+
+    kept, report = ToolOutputReducer(token_budget=400, top_n=50).reduce(rows)
+
+    # Distinct rows are never merged, only sampled, first and last included
+    assert report["duplicate_rows_merged"] == 0
+    assert report["sampled"]
+    assert all("_count" not in row and "_template" not in row for row in kept)
+    assert kept[0] == rows[0] and kept[-1] == rows[-1]
+    assert all(row in rows for row in kept)
+    assert [row["bucket"] for row in kept] == sorted(row["bucket"] for row in kept)
+    assert estimate_tokens(kept) <= 400
+
+def test_identical_structured_rows_are_merged():
+    rows = [{"node": "aks-1", "ready": True}] * 300 + [{"node": "aks-2", "ready": False}]
+    kept, report = ToolOutputReducer(token_budget=100).reduce(rows)
+    assert kept == [{"node": "aks-1", "ready": True, "_count": 300}, {"node": "aks-2", "ready": False}]
+    assert report["duplicate_rows_merged"] == 299
+
+def test_long_fields_are_truncated():
+    records = [{"Message": "Exception: " + "x" * 5000}, {"Message": "other " + "y" * 5000}]
+    kept, report = ToolOutputReducer(token_budget=300, max_field_chars=100).reduce(records)
+    assert report["fields_truncated"] >= 1
+    assert all(len(record["Message"]) < 200 for record in kept)
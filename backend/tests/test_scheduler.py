@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from utils.scheduler import (
+    DEFAULT_PRIORITY, AlertQueueFullError, AlertScheduler, SchedulerUnavailableError, get_alert_priority
+)
+
+def test_alert_priority_from_severity():
+    assert get_alert_priority({"data": {"essentials": {"severity": "Sev1"}}}) == 1
+    assert get_alert_priority({"severity": "Sev9"}) == 4
+    assert get_alert_priority({"ProblemSeverity": "AVAILABILITY"}) == 0
+    assert get_alert_priority({"severityLevel": "performance"}) == 2
+    assert get_alert_priority({"title": "no severity"}) == DEFAULT_PRIORITY
+    assert get_alert_priority(["not", "a", "dict"]) == DEFAULT_PRIORITY
+
+def test_most_severe_alerts_run_first():
+    async def scenario():
+        order = []
+        scheduler = AlertScheduler(max_queue_size=10, workers=1)
+        gate = asyncio.Event()
+
+        async def handle(job):
+            await gate.wait()
+            order.append(job.event)
+
+        scheduler.start(handle)
+        scheduler.submit("first", priority=3)
+        await asyncio.sleep(0)
+        for event, priority in (("low", 4), ("urgent", 0), ("medium", 2), ("urgent again", 0)):
+            scheduler.submit(event, priority=priority)
+        gate.set()
+        await scheduler.stop(drain=True)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["first", "urgent", "urgent again", "medium", "low"]
+    assert stats["completed"] == 5
+    assert stats["queue_depth"] == 0
+
+def test_full_queue_rejects_new_alerts():
+    async def scenario():
+        scheduler = AlertScheduler(max_queue_size=2, workers=1)
+        gate = asyncio.Event()
+        scheduler.start(lambda job: gate.wait())
+        scheduler.submit("running")
+        await asyncio.sleep(0)
+        scheduler.submit("queued 1")
+        scheduler.submit("queued 2")
+        with pytest.raises(AlertQueueFullError):
+            scheduler.submit("rejected")
+        assert scheduler.is_full()
+        gate.set()
+        await scheduler.stop(drain=True)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 3
+
+def test_reserved_slots_count_against_capacity():
+    async def scenario():
+        scheduler = AlertScheduler(max_queue_size=2, workers=1)
+        gate = asyncio.Event()
+        scheduler.start(lambda job: gate.wait())
+        scheduler.reserve()
+        scheduler.reserve()
+        with pytest.raises(AlertQueueFullError):
+            scheduler.reserve()
+        with pytest.raises(AlertQueueFullError):
+            scheduler.submit("unreserved")
+        scheduler.submit("reserved", reserved=True)
+        reserved = scheduler.reserved
+        gate.set()
+        await scheduler.stop(drain=False)
+        return reserved
+
+    assert asyncio.run(scenario()) == 1
+
+def test_failed_alert_does_not_stop_the_worker():
+    async def scenario():
+        done = []
+        scheduler = AlertScheduler(max_queue_size=5, workers=1)
+
+        async def handle(job):
+            if job.event == "broken":
+                raise RuntimeError("boom")
+            done.append(job.event)
+
+        scheduler.start(handle)
+        scheduler.submit("broken")
+        scheduler.submit("fine")
+        await scheduler.stop(drain=True)
+        return done, scheduler.stats()
+
+    done, stats = asyncio.run(scenario())
+    assert done == ["fine"]
+    assert (stats["failed"], stats["completed"]) == (1, 1)
+
+def test_stopped_scheduler_rejects_alerts():
+    async def scenario():
+        scheduler = AlertScheduler(max_queue_size=5, workers=1)
+        with pytest.raises(SchedulerUnavailableError):
+            scheduler.submit("too early")
+        scheduler.start(lambda job: asyncio.sleep(0))
+        await scheduler.stop()
+        with pytest.raises(SchedulerUnavailableError):
+            scheduler.reserve()
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from autogen_agentchat.messages import TextMessage
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+import utils.tracing as tracing
+from utils.context import investigation_id_var
+from utils.modelclient import DelegatingChatCompletionClient
+from utils.tracing import InMemorySpanExporter, Tracer, TurnTracer, traced_tool, with_tracing
+
+MODEL_INFO = {"function_calling": True, "vision": False, "json_output": False, "family": "gpt-4o", "structured_output": False}
+
+class _Model(DelegatingChatCompletionClient):
+    def __init__(self):
+        super().__init__(ReplayChatCompletionClient([], model_info=MODEL_INFO))
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        await asyncio.sleep(0.01)
+        return CreateResult(finish_reason="stop", content="pods are fine", cached=False,
+                            usage=RequestUsage(prompt_tokens=120, completion_tokens=30))
+
+@traced_tool
+async def lookup_pods(namespace: str) -> str:
+    """Lists the pods of a namespace."""
+    if namespace == "missing":
+        raise LookupError("namespace not found")
+    return f"{namespace}: 3 pods"
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer(InMemorySpanExporter(max_traces=2, max_spans=50))
+    monkeypatch.setattr(tracing, "tracer", tracer)
+    return tracer
+
+def _in_investigation(investigation_id: str, coroutine_function):
+    async def run():
+        investigation_id_var.set(investigation_id)
+        return await coroutine_function()
+    return asyncio.run(run())
+
+def test_nothing_is_recorded_outside_an_investigation(tracer):
+    with tracer.span("orphan", "tool") as span:
+        assert span is None
+    assert tracer.stats()["exported"] == 0
+
+def test_investigation_waterfall(tracer):
+    async def investigation():
+        with tracer.span("investigation", "investigation"):
+            turns = TurnTracer()
+            await with_tracing(_Model(), "aks_specialist").create([UserMessage(content="check pods", source="user")])
+            await lookup_pods(namespace="shop")
+            with pytest.raises(LookupError):
+                await lookup_pods(namespace="missing")
+            turns.observe(TextMessage(source="aks_specialist", content="pods are fine"))
+
+    _in_investigation("inv-1", investigation)
+    waterfall = tracer.waterfall("inv-1")
+
+    spans = {(span["name"], span["status"]): span for span in waterfall["spans"]}
+    root = spans[("investigation", "ok")]
+    model = spans[("aks_specialist model call", "ok")]
+    failed = spans[("lookup_pods", "error")]
+    assert root["depth"] == 0 and root["offset_ms"] == 0
+    assert model["depth"] == 1 and model["parent_id"] == root["span_id"]
+    assert model["attributes"]["prompt_tokens"] == 120
+    assert spans[("lookup_pods", "ok")]["attributes"]["result_chars"] == len("shop: 3 pods")
+    assert failed["error"] == "LookupError: namespace not found"
+    assert spans[("aks_specialist turn", "ok")]["kind"] == "turn"
+    assert waterfall["totals"]["model"] == {"count": 1, "duration_ms": model["duration_ms"], "errors": 0,
+                                            "prompt_tokens": 120, "completion_tokens": 30}
+    assert waterfall["totals"]["tool"]["errors"] == 1
+
+def test_traced_tool_keeps_the_tool_signature():
+    assert lookup_pods.__name__ == "lookup_pods"
+    assert lookup_pods.__doc__ == "Lists the pods of a namespace."
+
+def test_exporter_keeps_the_latest_investigations_within_limits(tracer):
+    tracer.exporter.max_spans = 3
+
+    async def investigation():
+        for index in range(5):
+            with tracer.span(f"step {index}", "tool"):
+                pass
+
+    for investigation_id in ("inv-1", "inv-2", "inv-3"):
+        _in_investigation(investigation_id, investigation)
+
+    assert tracer.waterfall("inv-1") is None
+    assert len(tracer.waterfall("inv-3")["spans"]) == 3
+    assert tracer.stats() == {"traces": 2, "exported": 9, "dropped": 6}
@@ -1,16 +1,19 @@
 import os
-import requests
-from typing import Dict, Any, Optional, Union
+import time
+import asyncio
+from typing import Dict, Any, Optional, Union, Callable, Awaitable, AsyncIterator
 from datetime import datetime, timedelta
 import json
 from dotenv import load_dotenv
-from utils.httpclient import HttpClient
+from utils.httpclient import HttpClient, HttpResponse
 from autogen_core import CancellationToken
 from autogen_core.tools import FunctionTool
 from typing_extensions import Annotated
 from utils.config import Config
 import urllib.parse
 from utils.logger import setup_logger
+from utils.reducer import reduce_records
+from utils.tracing import traced_tool
 
 load_dotenv()
 
@@ -25,61 +28,266 @@ class DynatraceQueryError(Exception):
     """Exception raised for Dynatrace query errors"""
     pass
 
-def get_dynatrace_token() -> str:
+# Dynatrace SSO endpoint used to obtain OAuth tokens
+DYNATRACE_SSO_URL = "https://sso.dynatrace.com"
+
+class DynatraceTokenCache:
+    """
+    Caches the Dynatrace access token until it expires.
+    The token is refreshed in the background once it gets close to expiring, and concurrent callers
+    that find no valid token share a single token request instead of each asking the SSO for one.
+    """
+
+    def __init__(self, request_token: Callable[[], Awaitable[Dict[str, Any]]], refresh_margin: int = None):
+        """
+        Args:
+            request_token (callable): Coroutine function returning a token response with access_token and expires_in.
+            refresh_margin (int, optional): Seconds before expiry at which the token is refreshed.
+        """
+        self.request_token = request_token
+        self.refresh_margin = Config.dynatrace_token_refresh_margin if refresh_margin is None else refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def get_token(self) -> str:
+        """
+        Return a valid access token, requesting one only when the cached token has expired.
+        """
+        now = time.monotonic()
+        if self._token and now < self._expires_at - self.refresh_margin:
+            return self._token
+
+        if self._token and now < self._expires_at:
+            # Still valid: hand it out and refresh it ahead of expiry
+            self._refresh_in_background()
+            return self._token
+
+        # Single flight: the first caller fetches, the others wait and reuse its token
+        async with self._lock:
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            return await self._refresh()
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the API rejected it."""
+        self._token = None
+        self._expires_at = 0.0
+
+    async def _refresh(self) -> str:
+        response_json = await self.request_token()
+        expires_in = int(response_json.get("expires_in", 300))
+        self._token = response_json["access_token"]
+        self._expires_at = time.monotonic() + expires_in
+        logger.info(f"Dynatrace token cached for {expires_in}s")
+        return self._token
+
+    def _refresh_in_background(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            async with self._lock:
+                # Another caller may have refreshed it in the meantime
+                if time.monotonic() >= self._expires_at - self.refresh_margin:
+                    await self._refresh()
+        except Exception as e:
+            logger.warning(f"Background Dynatrace token refresh failed: {str(e)}")
+
+class DynatraceClient:
+    """
+    Async Dynatrace API client.
+    Keeps one connection pool for the SSO and one for the environment API, and a cached OAuth token,
+    shared by all Dynatrace tool invocations.
+    """
+
+    def __init__(self):
+        self._sso: Optional[HttpClient] = None
+        self._api: Optional[HttpClient] = None
+        self.token_cache = DynatraceTokenCache(self.request_token)
+
+    @property
+    def sso(self) -> HttpClient:
+        if self._sso is None:
+            self._sso = HttpClient(DYNATRACE_SSO_URL, timeout=Config.dynatrace_timeout)
+        return self._sso
+
+    @property
+    def api(self) -> HttpClient:
+        if self._api is None:
+            self._api = HttpClient(Config.dynatrace_api_endpoint, timeout=Config.dynatrace_timeout)
+        return self._api
+
+    async def request_token(self) -> Dict[str, Any]:
+        """
+        Request a new token from Dynatrace using client credentials.
+        Returns:
+            dict: The token response, with the access token and its lifetime in seconds (expires_in).
+        """
+        try:
+            # Prepare the data payload for the authentication request
+            data = {
+                "grant_type": "client_credentials",  # Specify the grant type for client credentials
+                "client_id": Config.dynatrace_client_id,  # Client ID from the configuration
+                "client_secret": Config.dynatrace_client_secret,  # Client secret from the configuration
+                "resource": Config.dynatrace_account_urn,  # Dynatrace account URN
+                "scope": "storage:logs:read storage:buckets:read"  # Scopes for the requested permissions
+            }
+            
+            # Make a POST request to the authentication URL; the body is sent form-encoded
+            response = await self.sso.request("POST", "/sso/oauth2/token", data=data)
+            
+            # Check if the response status code indicates an error
+            if response.status != 200:
+                # Log the error details
+                logger.error(f"Authentication failed: {response.status} - {response.text}")
+                # Raise an exception with the error details
+                raise DynatraceAuthError(f"Authentication failed: {response.status} - {response.text}")
+            
+            # Parse the JSON response from the authentication request
+            response_json = response.json()
+            
+            # Check if the access token is present in the response
+            if "access_token" not in response_json:
+                # Log an error if the access token is missing
+                logger.error("No access token in response")
+                # Raise an exception indicating the missing token
+                raise DynatraceAuthError("No access token in response")
+            
+            # Return the token response
+            return response_json
+            
+        except Exception as e:
+            # Raise an exception with the error details if any error occurs
+            raise DynatraceAuthError(f"Error getting token: {str(e)}")
+
+    async def search_logs(self, params: Dict[str, Any]) -> HttpResponse:
+        """
+        Call the logs search endpoint with the cached token.
+        A 401 means the cached token was revoked: a new one is requested and the call is retried once.
+        """
+        token = await self.token_cache.get_token()
+        response = await self.api.request("GET", "/api/v2/logs/search", params=params, headers={"Authorization": f"Bearer {token}"})
+
+        if response.status == 401:
+            logger.warning("Dynatrace rejected the cached token, requesting a new one")
+            self.token_cache.invalidate()
+            token = await self.token_cache.get_token()
+            response = await self.api.request("GET", "/api/v2/logs/search", params=params, headers={"Authorization": f"Bearer {token}"})
+
+        return response
+
+    def paginate_logs(self, query: Optional[str], start_time: Optional[str] = None, end_time: Optional[str] = None,
+                      page_size: int = None, max_records: int = None, max_bytes: int = None,
+                      predicate: Callable[[Dict[str, Any]], bool] = None) -> "DynatraceLogPager":
+        """
+        Return a pager over the log search results. See DynatraceLogPager.
+        """
+        return DynatraceLogPager(self, query, start_time, end_time, page_size, max_records, max_bytes, predicate)
+
+    async def close(self):
+        """Close the connection pools."""
+        for client in (self._sso, self._api):
+            if client is not None:
+                await client.close()
+
+class DynatraceLogPager:
+    """
+    Walks the log search results slice by slice, following nextSliceKey.
+    Records are yielded as they arrive, so only one slice is held in memory at a time. Iteration stops
+    early once max_records matching records were yielded or max_bytes of records were read.
+    After iteration, pages, records_scanned, bytes_read and stop_reason describe what was fetched.
+    """
+
+    def __init__(self, client: DynatraceClient, query: Optional[str], start_time: Optional[str], end_time: Optional[str],
+                 page_size: int = None, max_records: int = None, max_bytes: int = None,
+                 predicate: Callable[[Dict[str, Any]], bool] = None):
+        self.client = client
+        self.query = query
+        self.start_time = start_time
+        self.end_time = end_time
+        self.page_size = page_size or Config.dynatrace_page_size
+        self.max_records = max_records
+        self.max_bytes = max_bytes or Config.dynatrace_max_bytes
+        self.predicate = predicate
+        self.pages = 0
+        self.records_scanned = 0
+        self.records_matched = 0
+        self.bytes_read = 0
+        self.stop_reason = None
+
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        return self.records()
+
+    async def records(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield matching log records.
+
+        Raises:
+            DynatraceQueryError: If a slice request fails.
+        """
+        page_size = min(self.page_size, self.max_records) if self.max_records else self.page_size
+        params = {
+            "query": self.query,  # The DQL query string
+            "from": self.start_time,  # Start time for the logs
+            "to": self.end_time,  # End time for the logs
+            "limit": page_size  # Records per slice
+        }
+
+        while True:
+            response = await self.client.search_logs(params)
+            if response.status != 200:
+                raise DynatraceQueryError(f"Log search failed: {response.status} - {response.text}")
+
+            self.pages += 1
+            body = response.json()
+            for record in body.get("results", []):
+                self.records_scanned += 1
+                self.bytes_read += len(json.dumps(record, default=str))
+                if self.bytes_read > self.max_bytes:
+                    self.stop_reason = "byte_budget"
+                    return
+
+                if self.predicate is not None and not self.predicate(record):
+                    continue
+
+                self.records_matched += 1
+                yield record
+                if self.max_records and self.records_matched >= self.max_records:
+                    self.stop_reason = "limit"
+                    return
+
+            # Follow the cursor; the other parameters are ignored when nextSliceKey is set
+            next_slice_key = body.get("nextSliceKey")
+            if not next_slice_key or not body.get("results"):
+                self.stop_reason = "exhausted"
+                return
+            params = {"nextSliceKey": next_slice_key}
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "pages": self.pages,
+            "records_scanned": self.records_scanned,
+            "records_returned": self.records_matched,
+            "bytes_read": self.bytes_read,
+            "stop_reason": self.stop_reason,
+            "truncated": self.stop_reason in ("limit", "byte_budget"),
+        }
+
+# Global instance shared by all Dynatrace tool invocations
+dynatrace_client = DynatraceClient()
+
+async def get_dynatrace_token() -> str:
     """
     Get a token from Dynatrace using client credentials.
+    The token is cached and reused until it is about to expire.
     Returns:
         str: The access token for authentication.
     """
-    try:
-        # Define the authentication URL for Dynatrace
-        auth_url = "https://sso.dynatrace.com/sso/oauth2/token"
-        
-        # Prepare the data payload for the authentication request
-        data = {
-            "grant_type": "client_credentials",  # Specify the grant type for client credentials
-            "client_id": Config.dynatrace_client_id,  # Client ID from the configuration
-            "client_secret": Config.dynatrace_client_secret,  # Client secret from the configuration
-            "resource": Config.dynatrace_account_urn,  # Dynatrace account URN
-            "scope": "storage:logs:read storage:buckets:read"  # Scopes for the requested permissions
-        }
-        
-        # Set the headers for the authentication request
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded"  # Specify the content type for form data
-        }
-        
-        # Make a POST request to the authentication URL with the data and headers
-        response = requests.post(auth_url, data=data, headers=headers)
-        
-        # Check if the response status code indicates an error
-        if response.status_code != 200:
-            # Log the error details
-            logger.error(f"Authentication failed: {response.status_code} - {response.text}")
-            # Raise an exception with the error details
-            raise Exception(f"Authentication failed: {response.status_code} - {response.text}")
-        
-        # Parse the JSON response from the authentication request
-        response_json = response.json()
-        
-        # Check if the access token is present in the response
-        if "access_token" not in response_json:
-            # Log an error if the access token is missing
-            logger.error("No access token in response")
-            # Raise an exception indicating the missing token
-            raise Exception("No access token in response")
-        
-        # Extract the access token from the response
-        token = response_json["access_token"]
-        # Print a debug message indicating successful token extraction
-        print(f"Debug - Token extraído com sucesso")
-        
-        # Return the extracted access token
-        return token
-        
-    except Exception as e:
-        # Raise an exception with the error details if any error occurs
-        raise Exception(f"Error getting token: {str(e)}")
+    return await dynatrace_client.token_cache.get_token()
 
 # def build_query_from_problem(problem_json: Dict[Any, Any]) -> str:
 #     """Build a Dynatrace logs query based on the problem details"""
@@ -113,27 +321,31 @@ def get_dynatrace_token() -> str:
 #     except Exception as e:
 #         raise DynatraceQueryError(f"Error building query from problem JSON: {str(e)}")
 
-def get_dynatrace_logs(
+@traced_tool
+async def get_dynatrace_logs(
     problem_json: Optional[Dict[Any, Any]] = None,
     query: Optional[str] = None,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    match: Optional[str] = None
 ) -> Dict[Any, Any]:
     """
     Get logs from Dynatrace using DQL sintax.
+    Results are fetched slice by slice and the search stops as soon as enough records were found.
     Args:
         problem_json (dict): JSON object containing problem details in the Dyna Trace problem schema.
         query (str): Custom query string using DQL syntax.
         start_time (str): Start time for the logs in iso8601 format.
         end_time (str): End time for the logs in iso8601 format.
         limit (int): Number of logs to retrieve.
+        match (str): Optional text the log content must contain (case insensitive) to be returned.
     """
     try:
         # Attempt to retrieve the Dynatrace token
         try:
             logger.info("Attempting to get Dynatrace token")  # Log the start of the token retrieval process
-            token = get_dynatrace_token()  # Call the function to get the Dynatrace token
+            await get_dynatrace_token()  # Make sure a valid token is cached before searching
             logger.info("Token obtained successfully")  # Log success after obtaining the token
         except Exception as e:
             # Handle any exceptions that occur during token retrieval
@@ -180,48 +392,45 @@ def get_dynatrace_logs(
         # # Codificar a query
         # encoded_query = urllib.parse.quote(final_query)
         
-        # Construct the URL for the Dynatrace logs query endpoint
-        url = Config.dynatrace_api_endpoint + "/api/v2/logs/search"
+        # Only keep records whose content contains the requested text
+        predicate = None
+        if match:
+            predicate = lambda record: match.lower() in str(record.get("content", "")).lower()
         
-        # Define the query parameters for the API request
-        params = {
-            "query": query,  # The DQL query string
-            "from": start_time,  # Start time for the logs
-            "to": end_time,  # End time for the logs
-            "limit": limit  # Maximum number of logs to retrieve
-        }
-        
-        # Set up the headers for the API request, including the authorization token
-        headers = {
-            "Authorization": f"Bearer {token}"  # Bearer token for authentication
-        }
+        # Walk the result slices until the limit or the byte budget is reached
+        pager = dynatrace_client.paginate_logs(query, start_time, end_time, max_records=limit, predicate=predicate)
+        records = []
         
         # Log the request details for debugging purposes
-        logger.info(f"Debug - Making request to {url} with params: {params}")
-        
-        # Make the GET request to the Dynatrace API
-        response = requests.get(url, params=params, headers=headers)
+        logger.info(f"Debug - Searching logs with query: {query}, from: {start_time}, to: {end_time}, limit: {limit}")
         
-        # Check if the response status code indicates an error
-        if response.status_code != 200:
+        try:
+            async for record in pager:
+                records.append(record)
+        except DynatraceQueryError as e:
             # Log the error details
-            logger.error(f"Log search failed: {response.status_code} - {response.text}")
+            logger.error(str(e))
             # Return an error response with details
             return {
-            "error": f"Log search failed: {response.status_code} - {response.text}",
+            "error": str(e),
             "status": "error",
             "query_used": query  # Include the query used in the response
             }
         
+        # Merge repeated log lines and keep the most relevant ones within the token budget
+        records, reduction = reduce_records(records)
+        
         # Log a success message if the request was successful
-        logger.info("Log search completed successfully")
+        logger.info(f"Log search completed successfully: {pager.summary()}")
         
         # Return the successful response with the query results
         return {
             "status": "success",  # Indicate success
             "query_used": query,  # Include the query used
             "time_window": {"from": start_time, "to": end_time},  # Include the time window
-            "results": response.json()  # Include the JSON response from the API
+            "results": {"results": records},  # Include the records found
+            "pagination": pager.summary(),  # Include how much was read and why the search stopped
+            "reduction": reduction  # Include how much was merged, truncated and dropped
         }
         
     except Exception as e:
@@ -237,4 +446,11 @@ def get_dynatrace_logs(
             "end_time": end_time if 'end_time' in locals() else None,
             "limit": limit
             }
-        }
\ No newline at end of file
+        }
+
+# Tool exposing the async log search to the agents
+get_dynatrace_logs_tool = FunctionTool(
+    get_dynatrace_logs,
+    name="get_dynatrace_logs",
+    description="Get logs from Dynatrace using a DQL query, a time window (iso8601 start_time/end_time) and a result limit."
+)
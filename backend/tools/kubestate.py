@@ -0,0 +1,346 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from utils.config import Config
+from utils.process import communicate
+from utils.logger import setup_logger
+from utils.reducer import reduce_records
+from utils.tracing import traced_tool
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Kinds kept in the snapshot, listed with a single kubectl call
+KINDS = ["pods", "deployments", "replicasets", "statefulsets", "daemonsets", "services", "nodes", "events"]
+
+# Accepted spellings of each kind in queries
+KIND_ALIASES = {
+    "pod": "pods", "po": "pods",
+    "deployment": "deployments", "deploy": "deployments",
+    "replicaset": "replicasets", "rs": "replicasets",
+    "statefulset": "statefulsets", "sts": "statefulsets",
+    "daemonset": "daemonsets", "ds": "daemonsets",
+    "service": "services", "svc": "services",
+    "node": "nodes", "no": "nodes",
+    "event": "events", "ev": "events",
+}
+
+def _owner(metadata: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    owners = metadata.get("ownerReferences") or []
+    if not owners:
+        return None
+    return {"kind": owners[0].get("kind"), "name": owners[0].get("name")}
+
+def _compact_pod(item: Dict[str, Any]) -> Dict[str, Any]:
+    status = item.get("status", {})
+    containers = []
+    for container in status.get("containerStatuses", []) or []:
+        state = container.get("state", {})
+        state_name = next(iter(state), None)
+        last_state = container.get("lastState", {}).get("terminated") or {}
+        containers.append({
+            "name": container.get("name"),
+            "ready": container.get("ready"),
+            "restarts": container.get("restartCount", 0),
+            "state": state_name,
+            "reason": (state.get(state_name) or {}).get("reason") if state_name else None,
+            "last_termination_reason": last_state.get("reason"),
+        })
+    return {
+        "phase": status.get("phase"),
+        "reason": status.get("reason"),
+        "node": item.get("spec", {}).get("nodeName"),
+        "restarts": sum(container["restarts"] for container in containers),
+        "containers": containers,
+        "not_ready_conditions": [
+            {"type": condition.get("type"), "reason": condition.get("reason"), "message": condition.get("message")}
+            for condition in status.get("conditions", []) or [] if condition.get("status") != "True"
+        ],
+    }
+
+def _compact_workload(item: Dict[str, Any]) -> Dict[str, Any]:
+    spec = item.get("spec", {})
+    status = item.get("status", {})
+    containers = spec.get("template", {}).get("spec", {}).get("containers", [])
+    return {
+        "desired": spec.get("replicas", status.get("desiredNumberScheduled")),
+        "ready": status.get("readyReplicas", status.get("numberReady", 0)),
+        "available": status.get("availableReplicas", status.get("numberAvailable", 0)),
+        "updated": status.get("updatedReplicas", status.get("updatedNumberScheduled", 0)),
+        "images": [container.get("image") for container in containers],
+    }
+
+def _compact_service(item: Dict[str, Any]) -> Dict[str, Any]:
+    spec = item.get("spec", {})
+    return {
+        "type": spec.get("type"),
+        "cluster_ip": spec.get("clusterIP"),
+        "selector": spec.get("selector"),
+        "ports": [f"{port.get('port')}/{port.get('protocol')}" for port in spec.get("ports", []) or []],
+    }
+
+def _compact_node(item: Dict[str, Any]) -> Dict[str, Any]:
+    status = item.get("status", {})
+    return {
+        "conditions": {condition.get("type"): condition.get("status") for condition in status.get("conditions", []) or []},
+        "allocatable": {key: status.get("allocatable", {}).get(key) for key in ("cpu", "memory", "pods")},
+        "kubelet_version": status.get("nodeInfo", {}).get("kubeletVersion"),
+        "unschedulable": item.get("spec", {}).get("unschedulable", False),
+        "taints": [f"{taint.get('key')}:{taint.get('effect')}" for taint in item.get("spec", {}).get("taints", []) or []],
+    }
+
+def _compact_event(item: Dict[str, Any]) -> Dict[str, Any]:
+    involved = item.get("involvedObject", {})
+    return {
+        "type": item.get("type"),
+        "reason": item.get("reason"),
+        "message": item.get("message"),
+        "object": f"{involved.get('kind')}/{involved.get('name')}",
+        "count": item.get("count") or 1,
+        "last_seen": item.get("lastTimestamp") or item.get("eventTime") or item.get("metadata", {}).get("creationTimestamp"),
+    }
+
+COMPACTORS = {
+    "Pod": _compact_pod,
+    "Deployment": _compact_workload,
+    "ReplicaSet": _compact_workload,
+    "StatefulSet": _compact_workload,
+    "DaemonSet": _compact_workload,
+    "Service": _compact_service,
+    "Node": _compact_node,
+    "Event": _compact_event,
+}
+
+def _plural(item: Dict[str, Any]) -> str:
+    return item["kind"].lower() + "s"
+
+def compact(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce a Kubernetes object to the fields useful for an investigation.
+    """
+    metadata = item.get("metadata", {})
+    kind = item.get("kind")
+    result = {
+        "kind": kind,
+        "name": metadata.get("name"),
+        "namespace": metadata.get("namespace"),
+        "labels": metadata.get("labels") or {},
+        "owner": _owner(metadata),
+        "created": metadata.get("creationTimestamp"),
+    }
+    compactor = COMPACTORS.get(kind)
+    if compactor is not None:
+        result.update(compactor(item))
+    return result
+
+class KubeStateCache:
+    """
+    Indexed, in-memory snapshot of the cluster's pods, workloads, services, nodes and events.
+
+    The snapshot is refreshed by listing every kind with one `kubectl get -A -o json` call on a fixed
+    interval, and persisted to a JSON file so a restarted backend can answer from the last snapshot
+    right away. A periodic list is used instead of a watch: the agents only need a recent view, and
+    a list every KUBE_STATE_REFRESH_INTERVAL seconds costs one API call regardless of how many investigations run.
+    """
+
+    def __init__(self, path: str = None, refresh_interval: int = None):
+        self.path = path or Config.kube_state_file
+        self.refresh_interval = refresh_interval or Config.kube_state_refresh_interval
+        self.items: List[Dict[str, Any]] = []
+        self.refreshed_at: Optional[float] = None
+        self.by_kind: Dict[str, List[Dict[str, Any]]] = {}
+        self.by_namespace: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.by_workload: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.by_label: Dict[tuple, List[Dict[str, Any]]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def _index(self, items: List[Dict[str, Any]]):
+        # Resolve the workload of every object: pod -> replicaset -> deployment
+        replicaset_owners = {
+            (item["namespace"], item["name"]): item["owner"]
+            for item in items if item["kind"] == "ReplicaSet" and item["owner"]
+        }
+        for item in items:
+            owner = item.get("owner")
+            if item["kind"] in ("Deployment", "StatefulSet", "DaemonSet"):
+                item["workload"] = item["name"]
+            elif owner and owner["kind"] == "ReplicaSet":
+                parent = replicaset_owners.get((item["namespace"], owner["name"]))
+                item["workload"] = parent["name"] if parent else owner["name"]
+            elif owner:
+                item["workload"] = owner["name"]
+            elif item["kind"] == "ReplicaSet":
+                item["workload"] = item["name"]
+
+        by_kind, by_namespace, by_workload, by_label = {}, {}, {}, {}
+        for item in items:
+            kind = _plural(item)
+            by_kind.setdefault(kind, []).append(item)
+            by_namespace.setdefault((kind, item.get("namespace")), []).append(item)
+            if item.get("workload"):
+                by_workload.setdefault((item.get("namespace"), item["workload"]), []).append(item)
+            for label in item.get("labels", {}).items():
+                by_label.setdefault(label, []).append(item)
+
+        self.items = items
+        self.by_kind = by_kind
+        self.by_namespace = by_namespace
+        self.by_workload = by_workload
+        self.by_label = by_label
+
+    def load(self) -> bool:
+        """
+        Load the last persisted snapshot. Returns False when there is none.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            self._index(data["items"])
+            self.refreshed_at = data["refreshed_at"]
+            logger.info(f"Loaded kube-state snapshot with {len(self.items)} objects from {self.path}")
+            return True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.info(f"No kube-state snapshot loaded from {self.path}: {str(e)}")
+            return False
+
+    def _persist(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"refreshed_at": self.refreshed_at, "items": self.items}, file)
+        os.replace(temporary, self.path)
+
+    async def refresh(self):
+        """
+        List every kind from the API server and replace the snapshot.
+        """
+        process = await asyncio.create_subprocess_exec(
+            "kubectl", "get", ",".join(KINDS), "--all-namespaces", "-o", "json",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+        stdout, stderr = await communicate(process, Config.shell_timeout)
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode("utf-8", errors="replace").strip())
+
+        items = [compact(item) for item in json.loads(stdout).get("items", [])]
+
+        # Keep only the most recent events
+        events = sorted((item for item in items if item["kind"] == "Event"), key=lambda item: item.get("last_seen") or "")
+        items = [item for item in items if item["kind"] != "Event"] + events[-Config.kube_state_max_events:]
+
+        self._index(items)
+        self.refreshed_at = time.time()
+        self.refreshes += 1
+        await asyncio.to_thread(self._persist)
+        logger.info(f"Refreshed kube-state snapshot: {len(items)} objects")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"kube-state refresh failed: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """Load the persisted snapshot and start refreshing in the background."""
+        if self.task is None:
+            self.load()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def age(self) -> Optional[float]:
+        return time.time() - self.refreshed_at if self.refreshed_at else None
+
+    def query(self, kind: str, namespace: Optional[str] = None, name: Optional[str] = None,
+              workload: Optional[str] = None, label_selector: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Return the objects of a kind matching every given filter.
+        """
+        kind = KIND_ALIASES.get(kind.lower(), kind.lower())
+        if workload:
+            if namespace:
+                candidates = self.by_workload.get((namespace, workload), [])
+            else:
+                candidates = [item for (_, item_workload), items in self.by_workload.items() if item_workload == workload for item in items]
+            candidates = [item for item in candidates if _plural(item) == kind]
+        elif namespace:
+            candidates = self.by_namespace.get((kind, namespace), [])
+        else:
+            candidates = self.by_kind.get(kind, [])
+
+        if label_selector:
+            for requirement in label_selector.split(","):
+                key, _, value = requirement.partition("=")
+                labelled = {id(item) for item in self.by_label.get((key.strip(), value.strip()), [])}
+                candidates = [item for item in candidates if id(item) in labelled]
+
+        if name:
+            candidates = [item for item in candidates if item["name"] == name]
+        return candidates
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            "objects": len(self.items),
+            "age_seconds": round(age, 1) if age is not None else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+# Global instance shared by all investigations
+kube_state = KubeStateCache()
+
+@traced_tool
+async def query_kube_state(
+    kind: str,
+    namespace: Optional[str] = None,
+    name: Optional[str] = None,
+    workload: Optional[str] = None,
+    label_selector: Optional[str] = None
+) -> str:
+    """
+    Consulta somente de leitura a um snapshot do cluster, sem executar kubectl.
+
+    Parâmetros:
+    - kind (str): Tipo do objeto: pods, deployments, replicasets, statefulsets, daemonsets, services, nodes ou events.
+    - namespace (str): Namespace. Opcional.
+    - name (str): Nome do objeto. Opcional.
+    - workload (str): Nome do deployment/statefulset/daemonset dono dos objetos. Opcional.
+    - label_selector (str): Labels no formato "app=cart,tier=web". Opcional.
+
+    Retorno:
+    - json: Objetos encontrados e a idade do snapshot em segundos.
+    """
+    if kube_state.refreshed_at is None:
+        return json.dumps({"status": "unavailable", "message": "Snapshot do cluster indisponível, use a função shell."})
+
+    items = kube_state.query(kind, namespace, name, workload, label_selector)
+    total = len(items)
+    if KIND_ALIASES.get(kind.lower(), kind.lower()) == "events":
+        # Repeated events are merged into one entry with a count
+        items, _ = reduce_records(items)
+    else:
+        items = items[:Config.tool_output_top_n]
+
+    return json.dumps({
+        "status": "success",
+        "snapshot_time": datetime.fromtimestamp(kube_state.refreshed_at, tz=timezone.utc).isoformat(),
+        "age_seconds": round(kube_state.age(), 1),
+        "total": total,
+        "items": items,
+    })
@@ -1,15 +1,28 @@
 from azure.identity.aio import DefaultAzureCredential
 from azure.monitor.query.aio import LogsQueryClient
+from azure.monitor.query import LogsBatchQuery, LogsQueryError, LogsQueryStatus
 from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import asyncio
+import hashlib
 import json
 import os
+import re
+import time
 from dotenv import load_dotenv
 import aiohttp
 from autogen_agentchat.ui import Console
 from utils.config import Config
+from utils.reducer import reduce_records
+from utils.cache import TTLCache
+from utils.tracing import traced_tool
+from utils.logger import setup_logger
 
 load_dotenv()
 
+# Set up logging
+logger = setup_logger(__name__)
+
 class DateTimeEncoder(json.JSONEncoder):
     """
     Classe para serializar objetos datetime em JSON.
@@ -19,7 +32,115 @@ class DateTimeEncoder(json.JSONEncoder):
             return obj.isoformat()
         return super().default(obj)
 
+class AzureMonitorClient:
+    """
+    Mantém um único DefaultAzureCredential e LogsQueryClient para todas as queries.
+    Os dois são criados na primeira query e reutilizados até o shutdown da aplicação, então a descoberta
+    da cadeia de credenciais, o token do AAD (guardado pela policy de autenticação do cliente) e a conexão
+    TLS são pagos uma única vez em vez de a cada query.
+    """
+
+    def __init__(self):
+        self.credential = None
+        self.client = None
+        self._lock = asyncio.Lock()
+
+    async def get_client(self) -> LogsQueryClient:
+        """
+        Retorna o LogsQueryClient compartilhado, criando-o no primeiro uso.
+        """
+        if self.client is not None:
+            return self.client
+
+        async with self._lock:
+            if self.client is None:
+                self.credential = DefaultAzureCredential()
+                self.client = LogsQueryClient(self.credential)
+        return self.client
+
+    async def close(self):
+        """
+        Fecha o cliente e a credencial. Uma query posterior cria novos.
+        """
+        async with self._lock:
+            if self.client is not None:
+                await self.client.close()
+                self.client = None
+            if self.credential is not None:
+                await self.credential.close()
+                self.credential = None
+
+# Instância global compartilhada por todas as queries
+azure_monitor_client = AzureMonitorClient()
+
+class KqlQueryCache:
+    """
+    Cache de resultados de queries KQL.
+    A chave é formada pela query normalizada (sem comentários e espaços redundantes), o workspace e o
+    intervalo de tempo arredondado para um bucket. Como as queries usam intervalos relativos ("últimas N horas"),
+    o instante atual também é arredondado para o bucket: a mesma query repetida dentro do bucket reaproveita o resultado.
+    """
+
+    def __init__(self):
+        self.enabled = Config.kql_cache_enabled
+        self.bucket = Config.kql_cache_bucket
+        self.cache = TTLCache(
+            backend=Config.kql_cache_backend,
+            ttl=Config.kql_cache_ttl,
+            max_entries=Config.kql_cache_max_entries,
+            path=Config.kql_cache_path,
+            table="kql_cache"
+        )
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Remove linhas de comentário, espaços redundantes e o ponto e vírgula final da query.
+        Comentários no fim de uma linha são mantidos, já que "//" também aparece dentro de strings (URLs).
+        """
+        lines = [line for line in query.splitlines() if not line.strip().startswith("//")]
+        return re.sub(r"\s+", " ", " ".join(lines)).strip().rstrip(";").strip()
+
+    def key(self, query: str, workspace_id: str, time_span: timedelta) -> str:
+        span = time_span.total_seconds() if isinstance(time_span, timedelta) else 0
+        span_bucket = round(span / self.bucket) * self.bucket
+        now_bucket = int(time.time() // self.bucket)
+        raw = f"{workspace_id}|{self.normalize_query(query)}|{span_bucket}|{now_bucket}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str):
+        return self.cache.get(key) if self.enabled else None
+
+    def set(self, key: str, value: str):
+        if self.enabled:
+            self.cache.set(key, value)
+
+    def stats(self):
+        return {"enabled": self.enabled, "bucket_seconds": self.bucket, **self.cache.stats()}
+
+# Instância global compartilhada por todas as queries
+kql_cache = KqlQueryCache()
+
+def _rows(response) -> Tuple[list, Optional[str]]:
+    """
+    Converte as tabelas de uma resposta (completa ou parcial) em uma lista de dicionários.
+    Retorna também a mensagem de erro quando o resultado é parcial (LogsQueryPartialResult), e None caso contrário.
+    """
+    if getattr(response, "status", None) == LogsQueryStatus.PARTIAL:
+        tables = response.partial_data or []
+        error = response.partial_error
+        message = getattr(error, "message", None) or str(error)
+    else:
+        tables = response.tables or []
+        message = None
+    results = []
+    for table in tables:
+        for row in table.rows:
+            results.append(dict(zip(table.columns, row)))
+    return results, message
+
 #No momento, o workspace_id esta sendo passado via environment variable, mas precisa ser passado via parametro, quando a funcion calling ocorrer
+@traced_tool
 async def query_azure_monitor(query: str, time_span: timedelta):
     """
     Executa uma query em um recurso no Azure Monitor workspace em busca de logs.
@@ -32,11 +153,18 @@ async def query_azure_monitor(query: str, time_span: timedelta):
     - json: Saída do comando ou erro.
     """
 
-    credential = DefaultAzureCredential()
-    client = LogsQueryClient(credential)
     workspace_id = Config.azm_workspace_id
     results = []
 
+    # Reaproveita o resultado de uma query equivalente executada há pouco
+    cache_key = kql_cache.key(query, workspace_id, time_span)
+    cached = kql_cache.get(cache_key)
+    if cached is not None:
+        logger.info("KQL query served from cache")
+        return cached
+
+    client = await azure_monitor_client.get_client()
+
     try:
         response = await client.query_workspace(
             workspace_id=workspace_id,
@@ -44,17 +172,112 @@ async def query_azure_monitor(query: str, time_span: timedelta):
             timespan=time_span
         )
 
-        if response.tables:
-            for table in response.tables:
-                for row in table.rows:
-                    row_dict = dict(zip(table.columns, row))
-                    results.append(row_dict)
+        results, partial_error = _rows(response)
+
+        # Merge repeated rows and keep the most relevant ones within the token budget
+        logs, reduction = reduce_records(results)
 
-        query_result = json.dumps({"status": "success", "logs": results}, cls=DateTimeEncoder)
+        if partial_error is not None:
+            # Resultado incompleto: o agente vê o erro, e a query é executada de novo na próxima vez
+            logger.warning(f"KQL query returned partial results: {partial_error}")
+            return json.dumps({"status": "partial", "message": partial_error, "logs": logs, "reduction": reduction}, cls=DateTimeEncoder)
+
+        query_result = json.dumps({"status": "success", "logs": logs, "reduction": reduction}, cls=DateTimeEncoder)
+
+        # Somente resultados bem sucedidos são guardados
+        kql_cache.set(cache_key, query_result)
         return query_result
 
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
-    finally:
-        await credential.close()
-        await client.close()
\ No newline at end of file
+
+@traced_tool
+async def query_azure_monitor_batch(queries: List[str], time_span: timedelta) -> str:
+    """
+    Executa várias queries KQL de uma vez no Azure Monitor workspace e retorna todos os resultados em uma única resposta.
+    Use quando a investigação precisar de mais de uma query: elas rodam em paralelo.
+
+    Parâmetros:
+    - queries (list[str]): Queries Kusto a serem executadas.
+    - time_span (timedelta): Intervalo de tempo aplicado a todas as queries.
+    Retorno:
+    - json: Resultado, status e tempo de execução de cada query, na mesma ordem das queries.
+    """
+    started_at = time.monotonic()
+    workspace_id = Config.azm_workspace_id
+    results = [None] * len(queries)
+
+    # O orçamento de tokens é dividido entre as queries para a resposta inteira caber no contexto
+    token_budget = max(Config.tool_output_token_budget // max(len(queries), 1), 500)
+
+    def store(index: int, response, elapsed: float, cache_key: str):
+        rows, partial_error = _rows(response)
+        logs, reduction = reduce_records(rows, token_budget=token_budget)
+        result = {"query": queries[index], "status": "success", "logs": logs, "reduction": reduction,
+                  "elapsed_ms": round(elapsed * 1000), "cached": False}
+        if partial_error is not None:
+            # Resultados parciais não são guardados
+            result = {**result, "status": "partial", "message": partial_error}
+        else:
+            kql_cache.set(cache_key, json.dumps(result, cls=DateTimeEncoder))
+        results[index] = result
+
+    def fail(index: int, message: str, elapsed: float):
+        results[index] = {"query": queries[index], "status": "error", "message": message,
+                          "elapsed_ms": round(elapsed * 1000), "cached": False}
+
+    # Queries já executadas há pouco saem do cache
+    pending = []
+    for index, query in enumerate(queries):
+        cache_key = "batch|" + kql_cache.key(query, workspace_id, time_span)
+        cached = kql_cache.get(cache_key)
+        if cached is not None:
+            results[index] = {**json.loads(cached), "cached": True, "elapsed_ms": 0}
+        else:
+            pending.append((index, cache_key))
+
+    client = await azure_monitor_client.get_client() if pending else None
+    semaphore = asyncio.Semaphore(Config.kql_batch_concurrency)
+
+    async def run_single(index: int, cache_key: str):
+        async with semaphore:
+            query_started_at = time.monotonic()
+            try:
+                response = await client.query_workspace(workspace_id=workspace_id, query=queries[index], timespan=time_span)
+                store(index, response, time.monotonic() - query_started_at, cache_key)
+            except Exception as e:
+                fail(index, str(e), time.monotonic() - query_started_at)
+
+    async def run_chunk(chunk: list):
+        # A API de batch do Log Analytics executa várias queries em uma única requisição
+        async with semaphore:
+            chunk_started_at = time.monotonic()
+            try:
+                responses = await client.query_batch([
+                    LogsBatchQuery(workspace_id=workspace_id, query=queries[index], timespan=time_span)
+                    for index, _ in chunk
+                ])
+            except Exception as e:
+                logger.warning(f"KQL batch request failed, running the queries one by one: {str(e)}")
+                responses = None
+            elapsed = time.monotonic() - chunk_started_at
+
+        if responses is None:
+            await asyncio.gather(*(run_single(index, cache_key) for index, cache_key in chunk))
+            return
+
+        for (index, cache_key), response in zip(chunk, responses):
+            if isinstance(response, LogsQueryError):
+                fail(index, response.message, elapsed)
+            else:
+                store(index, response, elapsed, cache_key)
+
+    chunk_size = Config.kql_batch_size
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+
+    return json.dumps({
+        "status": "success" if all(result["status"] == "success" for result in results) else "partial",
+        "results": results,
+        "elapsed_ms": round((time.monotonic() - started_at) * 1000)
+    }, cls=DateTimeEncoder)
@@ -1,23 +1,134 @@
-import subprocess
+import asyncio
+from collections import deque
+from typing import Optional
+from autogen_core import CancellationToken
+from utils.azauth import az_session
 from utils.config import Config
+from utils.console_streamer import console_streamer
+from utils.tracing import traced_tool
+from utils.process import kill_process_group, reap
+from utils.logger import setup_logger
 
-def shell(command: str) -> str:
+# Set up logging
+logger = setup_logger(__name__)
+
+class OutputBuffer:
+    """
+    Guarda o início e o fim da saída de um comando, descartando o meio quando ela passa do limite.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = deque()
+        self.tail_size = 0
+        self.dropped = 0
+
+    def write(self, data: bytes):
+        if len(self.head) < self.head_limit:
+            room = self.head_limit - len(self.head)
+            self.head.extend(data[:room])
+            data = data[room:]
+        if not data:
+            return
+
+        self.tail.append(data)
+        self.tail_size += len(data)
+        while self.tail_size > self.tail_limit:
+            excess = self.tail_size - self.tail_limit
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                self.tail_size -= len(first)
+                self.dropped += len(first)
+            else:
+                self.tail[0] = first[excess:]
+                self.tail_size -= excess
+                self.dropped += excess
+
+    def text(self) -> str:
+        head = self.head.decode("utf-8", errors="replace")
+        tail = b"".join(self.tail).decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{head}\n... [{self.dropped} bytes omitidos] ...\n{tail}"
+        return head + tail
+
+async def _pump(stream: asyncio.StreamReader, buffer: OutputBuffer, sender: str):
+    """
+    Lê a saída do processo à medida que ela é produzida, guardando-a no buffer e enviando cada linha ao WebSocket.
+    """
+    pending = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if Config.shell_stream_output:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    console_streamer.publish(sender, line.decode("utf-8", errors="replace"))
+    if Config.shell_stream_output and pending.strip():
+        console_streamer.publish(sender, pending.decode("utf-8", errors="replace"))
+
+@traced_tool
+async def shell(command: str, timeout_seconds: Optional[int] = None, cancellation_token: CancellationToken = None) -> str:
     """
     Executa comandos em um shell linux.
 
     Parâmetros:
     - command (str): Comando a ser executado dentro do AKS. Exemplos: "kubectl get pods", "az login", etc.
+    - timeout_seconds (int): Tempo máximo de execução do comando em segundos. Opcional.
 
     Retorno:
     - str: Saída do comando ou erro.
     """
-    try:
-        result = subprocess.run(
-            command,
-            shell=True, check=True, capture_output=True, text=True
+    # O backend já fez o login e configurou o kubectl; esses passos não são repetidos
+    remaining = az_session.redundant_command(command)
+    if remaining is not None:
+        if not remaining:
+            return az_session.cached_result()
+        logger.info(f"Skipping auth steps already done by the backend in: {command}")
+        command = remaining
+
+    timeout = timeout_seconds or Config.shell_timeout
+    stdout = OutputBuffer(Config.shell_max_output_bytes)
+    stderr = OutputBuffer(Config.shell_max_output_bytes)
+
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+
+    async def run():
+        await asyncio.gather(
+            _pump(process.stdout, stdout, "SHELL"),
+            _pump(process.stderr, stderr, "SHELL_STDERR")
         )
+        return await process.wait()
+
+    task = asyncio.ensure_future(run())
+    if cancellation_token is not None:
+        cancellation_token.link_future(task)
+
+    try:
+        returncode = await asyncio.wait_for(task, timeout=timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(process)
+        await reap(process)
+        logger.warning(f"Command timed out after {timeout}s: {command}")
+        return f"Erro ao executar comando: tempo limite de {timeout}s excedido.\nSaída parcial:\n{stdout.text().strip()}\n{stderr.text().strip()}".strip()
+    except asyncio.CancelledError:
+        kill_process_group(process)
+        await reap(process)
+        logger.info(f"Command cancelled: {command}")
+        raise
+
+    if returncode != 0:
+        return f"Erro ao executar comando: {stderr.text().strip()}"
 
-        return result.stdout.strip()
-    
-    except subprocess.CalledProcessError as e:
-        return f"Erro ao executar comando: {e.stderr.strip()}"
+    return stdout.text().strip()
@@ -3,10 +3,19 @@ from autogen_ext.models.openai import AzureOpenAIChatCompletionClient
 from autogen_agentchat.agents import AssistantAgent #, MultimodalWebSurfer
 from autogen_agentchat.teams import MagenticOneGroupChat
 from autogen_agentchat.ui import Console
-from tools.getdynatracelogs import get_dynatrace_logs
+import json
+import time
+from tools.getdynatracelogs import get_dynatrace_logs_tool
 from tools.shell import shell
-from tools.queryazmonitor import query_azure_monitor
+from tools.kubestate import query_kube_state
+from tools.queryazmonitor import query_azure_monitor, query_azure_monitor_batch
 from utils.config import Config
+from utils.fanout import FanOutTeam, resolve_team_mode
+from utils.context import investigation_id_var, new_investigation_id
+from utils.investigations import InvestigationRecorder, investigation_store
+from utils.modelclient import client_stats, with_priority, wrap_model_client
+from utils.compaction import with_compaction
+from utils.tracing import TurnTracer, tracer, with_tracing
 from utils.prompthandler import get_prompt
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from utils.logger import setup_logger
@@ -16,91 +25,246 @@ load_dotenv()
 # Set up logging
 logger = setup_logger(__name__)
 
-class Agents:
+# Full agent messages are high volume: they get their own logger so they can be sampled or silenced
+message_logger = setup_logger(f"{__name__}.messages")
+
+def _message_source(message):
+    # Agent messages are objects, or dicts once converted for the console
+    if isinstance(message, dict):
+        return message.get("source")
+    return getattr(message, "source", None)
+
+PROMPT_NAMES = ["dynatrace_specialist", "planner", "aks_specialist", "azuremonitor_specialist", "fanout_planner"]
+
+class AgentFactory:
+    """
+    Process-wide factory that owns the long-lived Azure OpenAI Chat Completion Client.
+    The model client, its credential and its HTTP connection pool are created once and shared by every
+    team handed out by the factory, so building a new team for a task only costs the agent objects themselves.
+    """
+
     def __init__(self):
+        self._model_client = None
+        self._credential = None
+
+    @property
+    def model_client(self) -> AzureOpenAIChatCompletionClient:
         """
-        Initializes the Agents class, setting up the Azure OpenAI Chat Completion Client and creating specialized agents.
-        The agents are designed to handle specific tasks related to Dynatrace logs, shell commands, and Azure Monitor queries.
-        The class also creates a team of agents for collaborative tasks.
-        The Azure OpenAI Chat Completion Client is initialized based on the environment configuration.
+        Returns the shared Azure OpenAI Chat Completion Client, creating it on first use.
+        The client is wrapped with the completion cache (see utils/modelclient.py) when it is enabled.
         """
-        
+        if self._model_client is None:
+            self._model_client = wrap_model_client(self._create_model_client())
+        return self._model_client
+
+    def _create_model_client(self) -> AzureOpenAIChatCompletionClient:
         # Initialize the Azure OpenAI Chat Completion Client based on the environment
         if Config.environment == "dev":
             # Use API key authentication for development environment
-            self.az_model_client = AzureOpenAIChatCompletionClient(
+            return AzureOpenAIChatCompletionClient(
                 azure_deployment=Config.aoai_deployment,
                 model=Config.aoai_model,
                 api_version=Config.aoai_version,
                 azure_endpoint=Config.aoai_endpoint,
                 api_key=Config.aoai_api_key
             )
-        else:
-            # Use Azure AD token provider for non-development environments
-            token_provider = get_bearer_token_provider(DefaultAzureCredential(), Config.llm_model_scope)
-            self.az_model_client = AzureOpenAIChatCompletionClient(
-                azure_deployment=Config.aoai_deployment,
-                model=Config.aoai_model,
-                api_version=Config.aoai_version,
-                azure_endpoint=Config.aoai_endpoint,
-                azure_ad_token_provider=token_provider
-            )
+
+        # Use Azure AD token provider for non-development environments.
+        # The credential is kept so its token cache survives across tasks.
+        self._credential = DefaultAzureCredential()
+        token_provider = get_bearer_token_provider(self._credential, Config.llm_model_scope)
+        return AzureOpenAIChatCompletionClient(
+            azure_deployment=Config.aoai_deployment,
+            model=Config.aoai_model,
+            api_version=Config.aoai_version,
+            azure_endpoint=Config.aoai_endpoint,
+            azure_ad_token_provider=token_provider
+        )
+
+    def warm_up(self):
+        """
+        Creates the shared model client and loads every prompt into the prompt cache.
+        Meant to be called once at application startup so the first alert does not pay for it.
+        """
+        for prompt_name in PROMPT_NAMES:
+            get_prompt(prompt_name)
+        _ = self.model_client
+        logger.info("Agent factory warmed up")
+
+    def create_agents(self, team_mode: str = None) -> "Agents":
+        """
+        Returns a fresh Agents instance (agents and team) bound to the shared model client.
+        Agents and teams keep conversation state, so each task must get its own instance.
+
+        Args:
+            team_mode (str, optional): "magentic" or "fanout". Defaults to Config.team_mode.
+        """
+        return Agents(model_client=self.model_client, team_mode=team_mode)
+
+    def stats(self) -> dict:
+        """
+        Counters of the model client wrappers, keyed by wrapper; empty until the client is created.
+        """
+        return client_stats(self._model_client) if self._model_client is not None else {}
+
+    async def close(self):
+        """
+        Closes the shared model client and credential.
+        """
+        if self._model_client is not None:
+            await self._model_client.close()
+            self._model_client = None
+        if self._credential is not None:
+            self._credential.close()
+            self._credential = None
+
+
+class Agents:
+    def __init__(self, model_client: AzureOpenAIChatCompletionClient = None, team_mode: str = None):
+        """
+        Initializes the Agents class, creating specialized agents on top of an Azure OpenAI Chat Completion Client.
+        The agents are designed to handle specific tasks related to Dynatrace logs, shell commands, and Azure Monitor queries.
+        The class also creates a team of agents for collaborative tasks.
+
+        Args:
+            model_client (AzureOpenAIChatCompletionClient, optional): The model client to use.
+                Defaults to the shared client owned by the process-wide agent factory.
+            team_mode (str, optional): "magentic" runs a MagenticOne team that calls one specialist at a time,
+                "fanout" runs a FanOutTeam where the specialists work on independent sub-tasks concurrently.
+                Defaults to Config.team_mode.
+
+        Raises:
+            ValueError: If the team mode is unknown.
+        """
+        self.team_mode = resolve_team_mode(team_mode)
+
+        # Reuse the shared Azure OpenAI Chat Completion Client unless one is provided
+        self.az_model_client = model_client if model_client is not None else agent_factory.model_client
+
+        orchestrator_client = self._client_for("orchestrator", "orchestrator")
 
         # Create an agent specialized in handling Dynatrace logs
         self.dynatrace_specialist = AssistantAgent(
             name="dynatrace_specialist",
-            model_client=self.az_model_client,
+            model_client=self._client_for("dynatrace_specialist", "specialist"),
+            description="Busca e analisa logs e problemas no Dynatrace.",
             system_message=get_prompt("dynatrace_specialist"),
-            tools=[get_dynatrace_logs]
+            tools=[get_dynatrace_logs_tool]
         )
 
         # Create an agent specialized in creating a plan
         self.planner = AssistantAgent(
             name="planner",
-            model_client=self.az_model_client,
+            model_client=self._client_for("planner", "orchestrator"),
             system_message=get_prompt("planner")
         )
 
         # Create an agent specialized in executing shell commands
         self.aks_specialist = AssistantAgent(
             name="aks_specialist",
-            model_client=self.az_model_client,
+            model_client=self._client_for("aks_specialist", "specialist"),
+            description="Inspeciona o cluster AKS (pods, deployments, eventos, logs de containers) com kubectl.",
             system_message=get_prompt("aks_specialist"),
-            tools=[shell]
+            tools=[shell, query_kube_state]
         )
 
         # Create an agent specialized in querying Azure Monitor using KQL
         self.azuremonitor_specialist = AssistantAgent(
             name="azuremonitor_specialist",
-            model_client=self.az_model_client,
+            model_client=self._client_for("azuremonitor_specialist", "specialist"),
+            description="Consulta logs e métricas no Azure Monitor / Log Analytics com KQL.",
             system_message=get_prompt("azuremonitor_specialist"),
-            tools=[query_azure_monitor]
+            tools=[query_azure_monitor, query_azure_monitor_batch]
         )
 
         # Create a team of agents for collaborative tasks
-        self.team = MagenticOneGroupChat([self.aks_specialist, self.azuremonitor_specialist], model_client=self.az_model_client)
+        if self.team_mode == "fanout":
+            # Independent sub-tasks run concurrently across every specialist, joined before each planning step
+            self.team = FanOutTeam(
+                [self.aks_specialist, self.azuremonitor_specialist, self.dynatrace_specialist],
+                model_client=orchestrator_client
+            )
+        else:
+            self.team = MagenticOneGroupChat([self.aks_specialist, self.azuremonitor_specialist], model_client=orchestrator_client)
+
+    def _client_for(self, agent_name: str, priority: str):
+        """
+        The agent's view of the shared model client: it compacts the history sent on each turn, records a
+        span per call, and tags requests with the agent's priority for the rate limiter (orchestrator first).
+        """
+        return with_compaction(with_tracing(with_priority(self.az_model_client, priority), agent_name), agent_name)
     
-    async def run_task(self, event, stream_handler=None):
+    async def run_task(self, event, stream_handler=None, investigation_id: str = None, use_cache: bool = True):
         """
         Runs a task with the team of agents and streams the output.
 
         Args:
             event (str): The task to be performed by the agents.
             stream_handler (callable, optional): A handler to process streamed messages.
+            investigation_id (str, optional): Tags everything the task prints or logs, so viewers can
+                replay or attach to it. Generated when not provided.
+            use_cache (bool): Answer with the finding of a recent matching investigation when there is one,
+                and store this one for later matches.
+        """
+        # Everything started from here inherits the investigation id
+        investigation_id = investigation_id or new_investigation_id()
+        context_token = investigation_id_var.set(investigation_id)
+        try:
+            with tracer.span("investigation", "investigation", team_mode=self.team_mode) as span:
+                use_cache = use_cache and Config.investigation_cache_enabled
+                if use_cache and await self._answer_from_cache(event):
+                    if span is not None:
+                        span.set_attributes(cached=True)
+                    return
+                recorder = InvestigationRecorder()
+                await self._run_task(event, stream_handler, recorder)
+                if use_cache:
+                    await investigation_store.save(investigation_id, event, recorder, team_mode=self.team_mode)
+        finally:
+            investigation_id_var.reset(context_token)
+
+    async def _answer_from_cache(self, event) -> bool:
+        """
+        Prints the finding of a recent investigation of a matching alert, marked as cached. Returns False when there is none.
         """
+        try:
+            match = await investigation_store.lookup(event)
+        except Exception as e:
+            logger.error(f"Investigation store lookup failed: {str(e)}")
+            return False
+        if match is None:
+            return False
+
+        age_minutes = match["age_seconds"] // 60
+        print(f"♻️ Cached diagnosis from investigation {match['investigation_id']} "
+              f"({age_minutes} min ago, {match['matched_by']} similarity {match['similarity']}):")
+        print(match["diagnosis"])
+        if match["evidence"]:
+            print("🔎 Evidence: " + json.dumps(match["evidence"], ensure_ascii=False))
+        logger.info(f"Answered from cached investigation {match['investigation_id']} "
+                    f"(similarity {match['similarity']}, {match['age_seconds']}s old)")
+        return True
+
+    async def _run_task(self, event, stream_handler=None, recorder: InvestigationRecorder = None):
         # Console output for demo
         print(f"🤖 Starting AI task execution...")
         print(f"📋 Task: {event}")
         print(f"🔄 Initializing agent team...")
         
-        logger.info(f"Starting task execution: {event}")
+        logger.info(f"Starting task execution ({self.team_mode} team): {event}")
+        started = time.monotonic()
+        turns = TurnTracer()
         
         # Stream the output using the provided handler or default to the console
         if stream_handler:
             print(f"📡 Streaming output to WebSocket...")
             async for message in self.team.run_stream(task=event):
+                turns.observe(message)
+                if recorder is not None:
+                    recorder.observe(message)
+
                 # Log the message to the console
-                logger.info(f"Agent Message: {message}")
+                message_logger.info("Agent Message: %s", message, extra={"agent": _message_source(message)})
 
                 # Send the message to the stream handler (e.g., WebSocket)
                 await stream_handler(message)
@@ -108,6 +272,10 @@ class Agents:
             # Default to streaming to the console
             print(f"📺 Streaming output to console...")
             async for message in self.team.run_stream(task=event):
+                turns.observe(message)
+                if recorder is not None:
+                    recorder.observe(message)
+
                 # Convert TextMessage to a dictionary if necessary
                 if hasattr(message, "to_dict"):
                     message = message.to_dict()
@@ -115,10 +283,14 @@ class Agents:
                     message = {"content": message}
 
                 # Log the message to the console
-                logger.info(f"Agent Message: {message}")
+                message_logger.info("Agent Message: %s", message, extra={"agent": _message_source(message)})
 
                 # Stream the message to the console
                 print(message)
                 
-        print(f"✅ Task execution completed!")
-        logger.info(f"Task execution completed for: {event}")
\ No newline at end of file
+        elapsed = time.monotonic() - started
+        print(f"✅ Task execution completed in {elapsed:.1f}s!")
+        logger.info(f"Task execution completed in {elapsed:.1f}s ({self.team_mode} team) for: {event}")
+
+# Global instance
+agent_factory = AgentFactory()
@@ -0,0 +1,241 @@
+# one-time Azure CLI login and AKS kubeconfig setup shared by every investigation
+import asyncio
+import json
+import os
+import re
+import shlex
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from utils.config import Config
+from utils.process import communicate
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Commands the agents tend to repeat that the session already ran
+AZ_LOGIN_PATTERN = re.compile(r"^\s*az\s+login\b")
+AZ_GET_CREDENTIALS_PATTERN = re.compile(r"^\s*az\s+aks\s+get-credentials\b")
+
+# Options that leave a repeated command equivalent to what the session ran; any other option
+# (another subscription, --admin, --file, ...) makes it a different command that must run
+AZ_LOGIN_OPTIONS = {"--federated-token", "--service-principal", "-u", "--username", "-t", "--tenant",
+                    "--allow-no-subscriptions", "--only-show-errors", "-o", "--output"}
+AZ_GET_CREDENTIALS_OPTIONS = {"-g", "--resource-group", "-n", "--name", "--overwrite-existing", "--only-show-errors",
+                              "-o", "--output"}
+
+# Same login command the aks_specialist prompt prescribes
+AZ_LOGIN_COMMAND = 'az login --federated-token "$(cat $AZURE_FEDERATED_TOKEN_FILE)" --service-principal -u $AZURE_CLIENT_ID -t $AZURE_TENANT_ID'
+
+class AzureCliSession:
+    """
+    Runs the federated `az login` and `az aks get-credentials` once per process and renews them
+    before the Azure CLI token expires, so investigations can use kubectl right away.
+    """
+
+    def __init__(self, refresh_margin: int = None):
+        self.refresh_margin = Config.az_login_refresh_margin if refresh_margin is None else refresh_margin
+        self.login_output: Optional[str] = None
+        self.credentials_output: Optional[str] = None
+        self.logged_in_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Consecutive failed logins, retried on a short backoff
+        self.failures = 0
+        self.skipped_commands = 0
+
+    @staticmethod
+    def configured() -> bool:
+        """Workload identity federation is available in this environment."""
+        return all(os.getenv(name) for name in ("AZURE_FEDERATED_TOKEN_FILE", "AZURE_CLIENT_ID", "AZURE_TENANT_ID"))
+
+    @property
+    def ready(self) -> bool:
+        return self.logged_in_at is not None and (self.expires_at is None or time.time() < self.expires_at)
+
+    async def _run(self, command: str) -> str:
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+        stdout, stderr = await communicate(process, Config.shell_timeout)
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode("utf-8", errors="replace").strip())
+        return stdout.decode("utf-8", errors="replace").strip()
+
+    async def _token_expiry(self) -> Optional[float]:
+        try:
+            token = json.loads(await self._run("az account get-access-token -o json"))
+        except Exception as e:
+            logger.warning(f"Could not read the Azure CLI token expiry: {str(e)}")
+            return None
+        if token.get("expires_on"):
+            return float(token["expires_on"])
+        if token.get("expiresOn"):
+            # Older CLIs only report a local time
+            return datetime.strptime(token["expiresOn"].split(".")[0], "%Y-%m-%d %H:%M:%S").timestamp()
+        return None
+
+    async def login(self):
+        """
+        Log in with the federated token and write the AKS kubeconfig.
+        """
+        self.login_output = await self._run(AZ_LOGIN_COMMAND)
+        if Config.az_resourcegroup and Config.az_aks_name:
+            self.credentials_output = await self._run(
+                f"az aks get-credentials --resource-group {Config.az_resourcegroup} --name {Config.az_aks_name} --overwrite-existing"
+            )
+        else:
+            logger.warning("RESOURCE_GROUP or AKS_CLUSTER_NAME not set, skipping az aks get-credentials")
+        self.logged_in_at = time.time()
+        self.expires_at = await self._token_expiry()
+        logger.info(f"Azure CLI session ready, token expires at {self._format(self.expires_at)}")
+
+    def _next_delay(self) -> float:
+        if self.failures:
+            # Retry a failed login soon, backing off up to the regular interval
+            return min(Config.az_login_retry_interval * 2 ** (self.failures - 1), Config.az_login_refresh_interval)
+        if self.expires_at:
+            return max(self.expires_at - time.time() - self.refresh_margin, 60)
+        return Config.az_login_refresh_interval
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self._next_delay())
+            try:
+                await self.login()
+                self.failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Azure CLI session refresh failed, retrying in {self._next_delay():.0f}s: {str(e)}")
+
+    async def start(self):
+        """
+        Log in once and keep the session renewed in the background.
+        Failures are logged; the agents can still authenticate through the shell tool.
+        """
+        if not self.configured():
+            logger.info("Workload identity not configured, skipping the startup Azure CLI login")
+            return
+        try:
+            await self.login()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Startup Azure CLI login failed, retrying in {self._next_delay():.0f}s: {str(e)}")
+        if self.task is None:
+            self.task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    @staticmethod
+    def _format(timestamp: Optional[float]) -> str:
+        if not timestamp:
+            return "unknown"
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+    @staticmethod
+    def _options(segment: str, pattern: re.Pattern) -> Optional[Dict[str, Optional[str]]]:
+        # The options of a command matching pattern, None when it does not match or cannot be parsed
+        match = pattern.match(segment)
+        if not match:
+            return None
+        try:
+            tokens = shlex.split(segment[match.end():])
+        except ValueError:
+            return None
+        options: Dict[str, Optional[str]] = {}
+        index = 0
+        while index < len(tokens):
+            name, _, value = tokens[index].partition("=")
+            if not name.startswith("-"):
+                return None
+            if not value and index + 1 < len(tokens) and not tokens[index + 1].startswith("-"):
+                index += 1
+                value = tokens[index]
+            options[name] = value or None
+            index += 1
+        return options
+
+    @staticmethod
+    def _same(value: Optional[str], expected: Optional[str], variable: str = None) -> bool:
+        if value is None or expected is None:
+            return False
+        if variable is not None and value in (f"${variable}", f"${{{variable}}}"):
+            return True
+        return value.strip().lower() == expected.strip().lower()
+
+    def _is_session_login(self, segment: str) -> bool:
+        # Only the federated login of this workload identity
+        options = self._options(segment, AZ_LOGIN_PATTERN)
+        if options is None or not set(options) <= AZ_LOGIN_OPTIONS or "--service-principal" not in options:
+            return False
+        username = options.get("-u", options.get("--username"))
+        tenant = options.get("-t", options.get("--tenant"))
+        return self._same(username, os.getenv("AZURE_CLIENT_ID"), "AZURE_CLIENT_ID") \
+            and self._same(tenant, os.getenv("AZURE_TENANT_ID"), "AZURE_TENANT_ID")
+
+    def _is_session_credentials(self, segment: str) -> bool:
+        # Only the configured cluster, in the default subscription
+        if self.credentials_output is None:
+            return False
+        options = self._options(segment, AZ_GET_CREDENTIALS_PATTERN)
+        if options is None or not set(options) <= AZ_GET_CREDENTIALS_OPTIONS:
+            return False
+        resource_group = options.get("-g", options.get("--resource-group"))
+        name = options.get("-n", options.get("--name"))
+        return self._same(resource_group, Config.az_resourcegroup, "RESOURCE_GROUP") \
+            and self._same(name, Config.az_aks_name, "AKS_CLUSTER_NAME")
+
+    def redundant_command(self, command: str) -> Optional[str]:
+        """
+        Strip the auth steps the session already performed from a command: the federated login of this
+        workload identity and get-credentials for the configured cluster. Commands for another identity,
+        resource group, cluster or subscription are left to run.
+
+        Args:
+            command (str): The shell command requested by an agent.
+
+        Returns:
+            str or None: None when nothing was stripped. Otherwise the remaining command, or "" if the
+            whole command was redundant.
+        """
+        if not self.ready:
+            return None
+        segments = [segment.strip() for segment in command.split("&&")]
+        remaining: List[str] = [
+            segment for segment in segments
+            if not self._is_session_login(segment) and not self._is_session_credentials(segment)
+        ]
+        if len(remaining) == len(segments):
+            return None
+        self.skipped_commands += 1
+        return " && ".join(remaining)
+
+    def cached_result(self) -> str:
+        """Answer for an auth command the session already ran."""
+        return (
+            f"Autenticação já realizada pelo backend às {self._format(self.logged_in_at)} "
+            f"(válida até {self._format(self.expires_at)}); o kubectl já está configurado para o cluster "
+            f"{Config.az_aks_name}. Não é necessário executar az login ou az aks get-credentials."
+        )
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "logged_in_at": self._format(self.logged_in_at),
+            "expires_at": self._format(self.expires_at),
+            "failures": self.failures,
+            "skipped_commands": self.skipped_commands,
+        }
+
+# Global instance
+az_session = AzureCliSession()
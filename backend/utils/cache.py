@@ -0,0 +1,137 @@
+# small key/value caches with TTL and LRU eviction, kept in memory or in a local SQLite file
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class MemoryCacheBackend:
+    """In-memory backend: an ordered dict used as an LRU list."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float):
+        self.entries[key] = (value, time.time() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def size(self) -> int:
+        return len(self.entries)
+
+class SqliteCacheBackend:
+    """On-disk backend: a SQLite table, so entries survive restarts and can be shared by workers."""
+
+    def __init__(self, path: str, max_entries: int, table: str = "cache"):
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)"
+        )
+        self.connection.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.connection.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < time.time():
+                self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.connection.commit()
+                return None
+            self.connection.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+            # Drop expired entries, then the least recently used ones above the limit
+            self.connection.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            excess = self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+            self.connection.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+class TTLCache:
+    """
+    String cache with a default TTL, LRU eviction and hit/miss counters.
+    """
+
+    def __init__(self, backend: str = "memory", ttl: float = 300, max_entries: int = 256,
+                 path: Optional[str] = None, table: str = "cache"):
+        """
+        Args:
+            backend (str): "memory" or "disk" (SQLite at path).
+            ttl (float): Default seconds an entry stays valid.
+            max_entries (int): Entries kept before the least recently used are evicted.
+            path (str, optional): SQLite file used by the disk backend.
+            table (str): SQLite table used by the disk backend.
+        """
+        self.ttl = ttl
+        self.backend_name = backend
+        if backend == "disk":
+            self.backend = SqliteCacheBackend(path, max_entries, table=table)
+        else:
+            self.backend = MemoryCacheBackend(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str, ttl: float = None):
+        self.backend.set(key, value, self.ttl if ttl is None else ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend_name,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.backend.evictions,
+        }
@@ -0,0 +1,180 @@
+# compaction of the conversation history sent to the model on each turn
+from typing import Any, Dict, List, Sequence, Tuple
+from autogen_core.models import (
+    AssistantMessage, ChatCompletionClient, CreateResult, FunctionExecutionResult, FunctionExecutionResultMessage,
+    LLMMessage, SystemMessage, UserMessage
+)
+from utils.config import Config
+from utils.modelclient import DelegatingChatCompletionClient
+from utils.reducer import RELEVANCE_KEYWORDS, estimate_tokens, log_template
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Notable lines kept in the summary of an old tool result
+SUMMARY_NOTABLE_LINES = 5
+
+# Totals across every compacting client, for /metrics
+_stats = {"turns": 0, "compacted_turns": 0, "tokens_before": 0, "tokens_after": 0, "dropped_messages": 0, "over_ceiling": 0}
+
+def summarize_text(text: str, max_chars: int) -> str:
+    """
+    Head of a long text plus its most notable distinct lines (errors, failures, timeouts), within about max_chars.
+    """
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars // 2]
+
+    notable: Dict[str, Tuple[int, str]] = {}
+    for line in text[len(head):].splitlines():
+        lowered = line.lower()
+        score = sum(weight for keyword, weight in RELEVANCE_KEYWORDS.items() if keyword in lowered)
+        template = log_template(line.strip())
+        if score >= 3 and template not in notable:
+            notable[template] = (score, line.strip()[:max_chars // (2 * SUMMARY_NOTABLE_LINES)])
+    lines = [line for _, line in sorted(notable.values(), key=lambda item: -item[0])[:SUMMARY_NOTABLE_LINES]]
+
+    summary = head + f"\n[... {len(text) - len(head)} of {len(text)} chars omitted"
+    if lines:
+        summary += "; notable lines:\n" + "\n".join(lines) + "\n"
+    return summary + "]"
+
+def _compact_message(message: LLMMessage, max_chars: int) -> LLMMessage:
+    # Old tool results become summaries that point back to their call; old long texts are clipped
+    if isinstance(message, FunctionExecutionResultMessage):
+        results = []
+        for result in message.content:
+            if len(result.content) > max_chars:
+                content = f"[compacted result of {result.name}, call {result.call_id}]\n" + summarize_text(result.content, max_chars)
+                result = FunctionExecutionResult(content=content, name=result.name, call_id=result.call_id, is_error=result.is_error)
+            results.append(result)
+        return FunctionExecutionResultMessage(content=results)
+    if isinstance(message, (UserMessage, AssistantMessage)) and isinstance(message.content, str) and len(message.content) > max_chars:
+        return message.model_copy(update={"content": summarize_text(message.content, max_chars)})
+    return message
+
+def _units(messages: List[LLMMessage]) -> List[List[LLMMessage]]:
+    # A tool call and its results are kept or dropped together
+    units: List[List[LLMMessage]] = []
+    for message in messages:
+        if isinstance(message, FunctionExecutionResultMessage) and units and isinstance(units[-1][-1], AssistantMessage) \
+                and not isinstance(units[-1][-1].content, str):
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return units
+
+class CompactingChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    Compacts the history an agent sends on each turn, so prompt size stops growing with every tool result.
+
+    The system messages, the task and the last CONTEXT_KEEP_RECENT messages are sent as they are. Older tool
+    results are replaced by a summary (head and notable lines) that names the call they came from, and older
+    long messages are clipped. If the turn is still above CONTEXT_MAX_TOKENS, the oldest messages are dropped,
+    never separating a tool call from its results, and then the recent tool results are summarized as well,
+    the latest one last.
+    """
+
+    def __init__(self, inner: ChatCompletionClient, agent_name: str, max_tokens: int = None,
+                 keep_recent: int = None, max_chars: int = None):
+        """
+        Args:
+            inner (ChatCompletionClient): The client to wrap.
+            agent_name (str): Agent whose turns are compacted, for the logs.
+            max_tokens (int, optional): Prompt tokens per turn. Defaults to Config.context_max_tokens.
+            keep_recent (int, optional): Recent messages sent verbatim. Defaults to Config.context_keep_recent.
+            max_chars (int, optional): Characters kept of an older tool result or message.
+                Defaults to Config.context_old_message_max_chars.
+        """
+        super().__init__(inner)
+        self.agent_name = agent_name
+        self.max_tokens = max_tokens or Config.context_max_tokens
+        self.keep_recent = keep_recent or Config.context_keep_recent
+        self.max_chars = max_chars or Config.context_old_message_max_chars
+
+    def _count(self, message: LLMMessage) -> int:
+        try:
+            return self.inner.count_tokens([message])
+        except Exception:
+            return estimate_tokens(message.model_dump(mode="json"))
+
+    def compact(self, messages: Sequence[LLMMessage]) -> List[LLMMessage]:
+        messages = list(messages)
+
+        # Protected head: the system messages and the task
+        head_end = 0
+        while head_end < len(messages) and isinstance(messages[head_end], SystemMessage):
+            head_end += 1
+        if head_end < len(messages) and isinstance(messages[head_end], UserMessage):
+            head_end += 1
+
+        # Recent messages, not starting in the middle of a tool call
+        recent_start = max(head_end, len(messages) - self.keep_recent)
+        while recent_start > head_end and isinstance(messages[recent_start], FunctionExecutionResultMessage):
+            recent_start -= 1
+
+        head, recent = messages[:head_end], messages[recent_start:]
+        older = _units([_compact_message(message, self.max_chars) for message in messages[head_end:recent_start]])
+
+        fixed = sum(self._count(message) for message in head + recent)
+        unit_tokens = [sum(self._count(message) for message in unit) for unit in older]
+        dropped = 0
+        while older and fixed + sum(unit_tokens) > self.max_tokens:
+            dropped += len(older.pop(0))
+            unit_tokens.pop(0)
+        _stats["dropped_messages"] += dropped
+
+        # Still too big with only recent messages left: summarize their tool results, the latest one last
+        for index in [i for i, message in enumerate(recent) if isinstance(message, FunctionExecutionResultMessage)]:
+            if older or fixed <= self.max_tokens:
+                break
+            fixed -= self._count(recent[index])
+            recent[index] = _compact_message(recent[index], self.max_chars)
+            fixed += self._count(recent[index])
+
+        compacted = head
+        if dropped:
+            compacted = compacted + [UserMessage(content=f"[{dropped} earlier messages omitted to stay within the context limit]", source="context")]
+        return compacted + [message for unit in older for message in unit] + recent
+
+    def _compact_turn(self, messages: Sequence[LLMMessage]) -> Sequence[LLMMessage]:
+        before = sum(self._count(message) for message in messages)
+        _stats["turns"] += 1
+        _stats["tokens_before"] += before
+        if len(messages) <= self.keep_recent + 2 and before <= self.max_tokens:
+            _stats["tokens_after"] += before
+            logger.info("Context for %s: %d tokens in %d messages, not compacted", self.agent_name, before, len(messages))
+            return messages
+
+        compacted = self.compact(messages)
+        after = sum(self._count(message) for message in compacted)
+        _stats["compacted_turns"] += 1
+        _stats["tokens_after"] += after
+        if after > self.max_tokens:
+            _stats["over_ceiling"] += 1
+            logger.warning("Context for %s still has %d tokens after compaction (ceiling %d)", self.agent_name, after, self.max_tokens)
+        logger.info(
+            "Context for %s: %d -> %d tokens, %d -> %d messages",
+            self.agent_name, before, after, len(messages), len(compacted)
+        )
+        return compacted
+
+    async def create(self, messages: Sequence[LLMMessage], **kwargs) -> CreateResult:
+        return await self.inner.create(self._compact_turn(messages), **kwargs)
+
+    def create_stream(self, messages: Sequence[LLMMessage], **kwargs):
+        return self.inner.create_stream(self._compact_turn(messages), **kwargs)
+
+    async def close(self) -> None:
+        # The shared client is closed by its owner
+        pass
+
+def with_compaction(client: ChatCompletionClient, agent_name: str) -> ChatCompletionClient:
+    if not Config.context_compaction_enabled:
+        return client
+    return CompactingChatCompletionClient(client, agent_name)
+
+def compaction_stats() -> Dict[str, Any]:
+    saved = _stats["tokens_before"] - _stats["tokens_after"]
+    return {**_stats, "tokens_saved": saved}
@@ -25,4 +25,136 @@ class Config:
     dynatrace_client_id = os.getenv('DYNATRACE_CLIENT_ID')
     dynatrace_client_secret = os.getenv('DYNATRACE_CLIENT_SECRET')
     dynatrace_account_urn = os.getenv('DYNATRACE_ACCOUNT_URN')
-    environment = os.getenv('ENVIRONMENT')
\ No newline at end of file
+    environment = os.getenv('ENVIRONMENT')
+
+    # Logging: JSON lines in LOG_DIR/app.log written by a background thread. LOG_SAMPLE_RATES keeps a fraction
+    # of a logger's INFO records, e.g. "utils.agents.messages=0.1" for the full agent message log
+    log_dir = os.getenv('LOG_DIR', 'logs')
+    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_queue_size = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    log_sample_rates = os.getenv('LOG_SAMPLE_RATES', '')
+
+    # Alert scheduler settings
+    alert_queue_size = int(os.getenv('ALERT_QUEUE_SIZE', 50))
+    alert_workers = int(os.getenv('ALERT_WORKERS', 4))
+    alert_retry_after = int(os.getenv('ALERT_RETRY_AFTER', 30))
+
+    # Default agent team: "magentic" (one specialist at a time) or "fanout" (specialists run concurrently);
+    # can be overridden per request
+    team_mode = os.getenv('TEAM_MODE', 'magentic')
+    fanout_max_rounds = int(os.getenv('FANOUT_MAX_ROUNDS', 3))
+    fanout_finding_max_chars = int(os.getenv('FANOUT_FINDING_MAX_CHARS', 4000))
+
+    # /ws: investigations running at once per connection, cancel them when the connection closes
+    ws_max_investigations = int(os.getenv('WS_MAX_INVESTIGATIONS', 3))
+    ws_cancel_on_disconnect = os.getenv('WS_CANCEL_ON_DISCONNECT', 'false').lower() == 'true'
+
+    # Streaming /run_task: seconds of silence before a heartbeat, characters of the final message in the summary
+    run_task_heartbeat_interval = float(os.getenv('RUN_TASK_HEARTBEAT_INTERVAL', 15))
+    run_task_summary_max_chars = int(os.getenv('RUN_TASK_SUMMARY_MAX_CHARS', 4000))
+
+    # Past investigations: matching alerts about the same resource within INVESTIGATION_CACHE_MAX_AGE seconds are
+    # answered with the stored finding. Similarity uses the embeddings deployment when set, else a local n-gram embedding
+    investigation_cache_enabled = os.getenv('INVESTIGATION_CACHE_ENABLED', 'false').lower() == 'true'
+    investigation_store_path = os.getenv('INVESTIGATION_STORE_PATH', str(BASE_DIR / 'cache' / 'investigations.sqlite'))
+    investigation_match_threshold = float(os.getenv('INVESTIGATION_MATCH_THRESHOLD', 0.97))
+    investigation_cache_max_age = float(os.getenv('INVESTIGATION_CACHE_MAX_AGE', 86400))
+    investigation_store_max_entries = int(os.getenv('INVESTIGATION_STORE_MAX_ENTRIES', 1000))
+    investigation_embedding_deployment = os.getenv('INVESTIGATION_EMBEDDING_DEPLOYMENT')
+
+    # Alert deduplication settings
+    alert_dedup_window = float(os.getenv('ALERT_DEDUP_WINDOW', 600))
+    alert_coalesce_window = float(os.getenv('ALERT_COALESCE_WINDOW', 5))
+
+    # Dynatrace client settings; the token is refreshed this many seconds before expiry
+    dynatrace_token_refresh_margin = int(os.getenv('DYNATRACE_TOKEN_REFRESH_MARGIN', 60))
+    dynatrace_timeout = float(os.getenv('DYNATRACE_TIMEOUT', 30))
+    dynatrace_page_size = int(os.getenv('DYNATRACE_PAGE_SIZE', 100))
+    dynatrace_max_bytes = int(os.getenv('DYNATRACE_MAX_BYTES', 262144))
+
+    # Outbound HTTP client settings
+    http_timeout = float(os.getenv('HTTP_TIMEOUT', 30))
+    http_max_retries = int(os.getenv('HTTP_MAX_RETRIES', 3))
+    http_backoff_base = float(os.getenv('HTTP_BACKOFF_BASE', 0.5))
+    http_backoff_max = float(os.getenv('HTTP_BACKOFF_MAX', 10))
+    http_connection_limit = int(os.getenv('HTTP_CONNECTION_LIMIT', 20))
+
+    # Tool output reduction: estimated tokens per tool result, records kept, characters per field
+    tool_output_token_budget = int(os.getenv('TOOL_OUTPUT_TOKEN_BUDGET', 4000))
+    tool_output_top_n = int(os.getenv('TOOL_OUTPUT_TOP_N', 50))
+    tool_output_max_field_chars = int(os.getenv('TOOL_OUTPUT_MAX_FIELD_CHARS', 500))
+
+    # KQL result cache: backend is "memory" or "disk" (SQLite at KQL_CACHE_PATH)
+    kql_cache_enabled = os.getenv('KQL_CACHE_ENABLED', 'true').lower() == 'true'
+    kql_cache_backend = os.getenv('KQL_CACHE_BACKEND', 'memory')
+    kql_cache_ttl = float(os.getenv('KQL_CACHE_TTL', 300))
+    kql_cache_bucket = int(os.getenv('KQL_CACHE_BUCKET', 60))
+    kql_cache_max_entries = int(os.getenv('KQL_CACHE_MAX_ENTRIES', 256))
+    kql_cache_path = os.getenv('KQL_CACHE_PATH', str(BASE_DIR / 'cache' / 'kql_cache.sqlite'))
+
+    # LLM completion cache: LLM_CACHE_MODE is off, cache (LLM_CACHE_BACKEND memory or disk, entries expire after
+    # LLM_CACHE_TTL seconds), record (store every completion at LLM_RECORD_PATH) or replay (answer only from
+    # the recordings, for offline test runs)
+    llm_cache_mode = os.getenv('LLM_CACHE_MODE', 'off')
+    llm_cache_backend = os.getenv('LLM_CACHE_BACKEND', 'memory')
+    llm_cache_ttl = float(os.getenv('LLM_CACHE_TTL', 600))
+    llm_cache_max_entries = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 512))
+    llm_cache_path = os.getenv('LLM_CACHE_PATH', str(BASE_DIR / 'cache' / 'llm_cache.sqlite'))
+    llm_record_path = os.getenv('LLM_RECORD_PATH', str(BASE_DIR / 'cache' / 'llm_recordings.sqlite'))
+
+    # Model deployment quota enforced client-side (0 for no limit), and the tokens reserved for each completion
+    # until its actual usage is known
+    llm_rate_limit_tpm = int(os.getenv('LLM_RATE_LIMIT_TPM', 0))
+    llm_rate_limit_rpm = int(os.getenv('LLM_RATE_LIMIT_RPM', 0))
+    llm_completion_tokens_estimate = int(os.getenv('LLM_COMPLETION_TOKENS_ESTIMATE', 1000))
+
+    # Context compaction: prompt tokens per agent turn, recent messages sent verbatim, characters kept of
+    # older tool results and messages
+    context_compaction_enabled = os.getenv('CONTEXT_COMPACTION_ENABLED', 'true').lower() == 'true'
+    context_max_tokens = int(os.getenv('CONTEXT_MAX_TOKENS', 24000))
+    context_keep_recent = int(os.getenv('CONTEXT_KEEP_RECENT', 8))
+    context_old_message_max_chars = int(os.getenv('CONTEXT_OLD_MESSAGE_MAX_CHARS', 1500))
+
+    # Tracing: spans of the last TRACE_MAX_INVESTIGATIONS investigations are kept in memory, at most
+    # TRACE_MAX_SPANS each, and served by GET /investigations/{id}/trace
+    tracing_enabled = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+    trace_max_investigations = int(os.getenv('TRACE_MAX_INVESTIGATIONS', 100))
+    trace_max_spans = int(os.getenv('TRACE_MAX_SPANS', 5000))
+
+    # KQL batch tool: queries per Log Analytics batch request, batch requests in flight
+    kql_batch_size = int(os.getenv('KQL_BATCH_SIZE', 10))
+    kql_batch_concurrency = int(os.getenv('KQL_BATCH_CONCURRENCY', 4))
+
+    # Shell tool: default timeout in seconds, bytes of stdout/stderr kept (head and tail), stream output to the WebSocket
+    shell_timeout = int(os.getenv('SHELL_TIMEOUT', 120))
+    shell_max_output_bytes = int(os.getenv('SHELL_MAX_OUTPUT_BYTES', 32768))
+    shell_stream_output = os.getenv('SHELL_STREAM_OUTPUT', 'true').lower() == 'true'
+
+    # Console streaming to /ws: lines buffered before the oldest are dropped, seconds between flushes,
+    # lines per frame, seconds to wait on a slow socket
+    stream_buffer_size = int(os.getenv('STREAM_BUFFER_SIZE', 2000))
+    stream_flush_interval = float(os.getenv('STREAM_FLUSH_INTERVAL', 0.1))
+    stream_batch_max = int(os.getenv('STREAM_BATCH_MAX', 200))
+    stream_send_timeout = float(os.getenv('STREAM_SEND_TIMEOUT', 5))
+    # Per-client queue in frames and what to do when it is full: drop_oldest, disconnect or sample
+    # (keep one in STREAM_SAMPLE_RATE frames)
+    stream_subscriber_queue = int(os.getenv('STREAM_SUBSCRIBER_QUEUE', 100))
+    stream_overflow_policy = os.getenv('STREAM_OVERFLOW_POLICY', 'drop_oldest')
+    stream_sample_rate = int(os.getenv('STREAM_SAMPLE_RATE', 5))
+    # Replay log: events kept per investigation, investigations kept
+    stream_replay_size = int(os.getenv('STREAM_REPLAY_SIZE', 2000))
+    stream_replay_investigations = int(os.getenv('STREAM_REPLAY_INVESTIGATIONS', 50))
+
+    # kube-state snapshot used by the query_kube_state tool
+    kube_state_enabled = os.getenv('KUBE_STATE_ENABLED', 'true').lower() == 'true'
+    kube_state_file = os.getenv('KUBE_STATE_FILE', str(BASE_DIR.parent / 'kube-state-data.json'))
+    kube_state_refresh_interval = int(os.getenv('KUBE_STATE_REFRESH_INTERVAL', 60))
+    kube_state_max_events = int(os.getenv('KUBE_STATE_MAX_EVENTS', 500))
+
+    # Azure CLI session: federated az login and az aks get-credentials run once at startup and renewed
+    # this many seconds before the token expires (or every AZ_LOGIN_REFRESH_INTERVAL if the expiry is unknown);
+    # a failed login is retried after AZ_LOGIN_RETRY_INTERVAL seconds, doubling up to AZ_LOGIN_REFRESH_INTERVAL
+    az_login_enabled = os.getenv('AZ_LOGIN_ENABLED', 'true').lower() == 'true'
+    az_login_refresh_margin = int(os.getenv('AZ_LOGIN_REFRESH_MARGIN', 600))
+    az_login_refresh_interval = int(os.getenv('AZ_LOGIN_REFRESH_INTERVAL', 2700))
+    az_login_retry_interval = int(os.getenv('AZ_LOGIN_RETRY_INTERVAL', 30))
@@ -2,57 +2,377 @@ import sys
 import io
 import logging
 import asyncio
+import threading
+from collections import deque
 from contextlib import redirect_stdout, redirect_stderr
 from threading import Thread
+import time
 import traceback
 from datetime import datetime
+from collections import OrderedDict
+from utils.config import Config
+from utils.context import current_investigation_id
+
+# What a subscriber does when its queue is full
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect", "sample")
+
+class Subscriber:
+    """
+    One WebSocket connection with its own bounded frame queue and writer task, so a slow
+    client only falls behind itself instead of stalling the broadcaster and the other viewers.
+
+    When the queue is full the overflow policy decides what happens:
+    - drop_oldest: the oldest queued frame is dropped to make room.
+    - disconnect: the connection is closed; the client can reconnect and start fresh.
+    - sample: only one in every STREAM_SAMPLE_RATE overflowing frames is kept (replacing the oldest).
+
+    Anything else that sends on the same socket must hold send_lock, so frames are never written concurrently.
+    """
+
+    def __init__(self, websocket, on_close, max_frames: int = None, policy: str = None, sample_rate: int = None,
+                 send_lock: asyncio.Lock = None):
+        self.websocket = websocket
+        self.on_close = on_close
+        self.send_lock = send_lock or asyncio.Lock()
+        self.max_frames = max_frames or Config.stream_subscriber_queue
+        self.policy = policy or Config.stream_overflow_policy
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{self.policy}', expected one of: {', '.join(OVERFLOW_POLICIES)}")
+        self.sample_rate = max(sample_rate or Config.stream_sample_rate, 1)
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        # Only this investigation's events are sent when set
+        self.investigation_id = None
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self._write())
+
+        # Metrics
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.dropped_unreported = 0
+        self.overflows = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def offer(self, frame, created_at: float):
+        """Queue a frame for this client, applying the overflow policy. Never blocks."""
+        if self.closed:
+            return
+        if self.investigation_id is not None:
+            messages = [message for message in frame["messages"] if message["investigation_id"] == self.investigation_id]
+            if not messages:
+                return
+            frame = {**frame, "messages": messages}
+        if len(self.queue) >= self.max_frames:
+            self.overflows += 1
+            if self.policy == "disconnect":
+                self.close(reason="too slow")
+                return
+            if self.policy == "sample" and self.overflows % self.sample_rate:
+                self._drop(len(frame["messages"]))
+                return
+            _, dropped_frame = self.queue.popleft()
+            self._drop(len(dropped_frame["messages"]))
+        self.queue.append((created_at, frame))
+        self.ready.set()
+
+    def prepend(self, frame):
+        """Send a frame ahead of everything queued, e.g. the events a reconnecting client missed."""
+        if not self.closed:
+            self.queue.appendleft((time.time(), frame))
+            self.ready.set()
+
+    def _drop(self, lines: int):
+        self.frames_dropped += 1
+        self.dropped_unreported += lines
+
+    async def _write(self):
+        try:
+            while True:
+                await self.ready.wait()
+                while self.queue:
+                    created_at, frame = self.queue.popleft()
+                    if self.dropped_unreported:
+                        frame = {**frame, "dropped": frame["dropped"] + self.dropped_unreported}
+                        self.dropped_unreported = 0
+                    async with self.send_lock:
+                        await asyncio.wait_for(self.websocket.send_json(frame), timeout=Config.stream_send_timeout)
+                    self.frames_sent += 1
+                    self.last_lag = time.time() - created_at
+                    self.max_lag = max(self.max_lag, self.last_lag)
+                self.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Failed or timed out: the connection is gone or hopelessly behind
+            self.close(reason="send failed")
+
+    def close(self, reason: str = None):
+        """Stop the writer and detach from the broadcaster."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        if reason is not None:
+            # Close the socket so the client notices and reconnects
+            asyncio.get_running_loop().create_task(self._close_socket())
+        self.on_close(self.websocket)
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "investigation_id": self.investigation_id,
+            "queued_frames": len(self.queue),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "lag_seconds": round(time.time() - self.queue[0][0], 3) if self.queue else 0.0,
+            "last_lag_seconds": round(self.last_lag, 3),
+            "max_lag_seconds": round(self.max_lag, 3),
+        }
+
+class ReplayLog:
+    """The last events of one investigation, so clients can catch up after reconnecting or attaching late."""
+
+    def __init__(self, max_events: int):
+        self.events = deque(maxlen=max_events)
+        self.trimmed_seq = 0
+        self.updated_at = time.time()
+
+    def append(self, event):
+        if len(self.events) == self.events.maxlen:
+            self.trimmed_seq = self.events[0]["seq"]
+        self.events.append(event)
+        self.updated_at = time.time()
+
+    def since(self, last_seq: int):
+        """Events after last_seq, and whether some of the requested events were already trimmed."""
+        return [event for event in self.events if event["seq"] > last_seq], last_seq < self.trimmed_seq
+
+    def stats(self):
+        return {
+            "events": len(self.events),
+            "last_seq": self.events[-1]["seq"] if self.events else 0,
+            "updated_at": datetime.fromtimestamp(self.updated_at).isoformat(timespec="seconds"),
+        }
 
 class ConsoleStreamer:
-    """Captures all console output and streams it to WebSocket connections."""
+    """
+    Captures all console output and streams it to WebSocket connections.
     
-    def __init__(self):
-        self.websockets = set()
+    Lines are appended to a bounded ring buffer, which is safe to do from any thread, and a single
+    broadcaster task flushes them on a short interval as batched frames handed to every subscriber's queue.
+    When the buffer is full the oldest lines are dropped, and consecutive identical lines are coalesced.
+
+    Every line gets a sequence number and is kept in a bounded replay log for its investigation, so a client
+    can resume from the last sequence it saw or attach to an investigation that is already running.
+    """
+
+    def __init__(self, buffer_size: int = None, flush_interval: float = None, batch_max: int = None):
+        self.subscribers = {}
         self.original_stdout = sys.stdout
         self.original_stderr = sys.stderr
         self.buffer = io.StringIO()
         self.is_capturing = False
+
+        self.persistent = False
+
+        # Ring buffer of [sender, text, timestamp, count, seq, investigation_id], fed from any thread
+        self.buffer_size = buffer_size or Config.stream_buffer_size
+        self.flush_interval = flush_interval or Config.stream_flush_interval
+        self.batch_max = batch_max or Config.stream_batch_max
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.flush_task = None
+        self.seq = 0
+
+        # Replay logs by investigation id (None for output outside an investigation), least recently updated first
+        self.replay_size = Config.stream_replay_size
+        self.replay_investigations = Config.stream_replay_investigations
+        self.replay_logs = OrderedDict()
+
+        # Metrics
+        self.dropped = 0
+        self.dropped_unreported = 0
+        self.coalesced = 0
+        self.lines_sent = 0
+        self.frames_sent = 0
         
-    def add_websocket(self, websocket):
-        """Add a WebSocket connection to receive console output."""
-        self.websockets.add(websocket)
+    def add_websocket(self, websocket, send_lock: asyncio.Lock = None):
+        """Add a WebSocket connection to receive console output, sending under send_lock when given."""
+        if websocket not in self.subscribers:
+            self.subscribers[websocket] = Subscriber(websocket, on_close=self.remove_websocket, send_lock=send_lock)
         
     def remove_websocket(self, websocket):
         """Remove a WebSocket connection."""
-        self.websockets.discard(websocket)
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is not None:
+            subscriber.close()
         
-    async def send_to_websockets(self, sender, message):
-        """Send a message to all connected WebSockets."""
-        if not self.websockets:
+    def enqueue(self, sender, message):
+        """
+        Add a line to the ring buffer. Safe to call from any thread, never blocks on the sockets.
+        """
+        investigation_id = current_investigation_id()
+        # Investigation output is kept for replay even when nobody is watching
+        if not self.subscribers and investigation_id is None:
             return
+        with self.lock:
+            last = self.pending[-1] if self.pending else None
+            if last is not None and last[0] == sender and last[1] == message and last[5] == investigation_id:
+                last[3] += 1
+                self.coalesced += 1
+                return
+            if len(self.pending) >= self.buffer_size:
+                self.pending.popleft()
+                self.dropped += 1
+                self.dropped_unreported += 1
+            self.seq += 1
+            self.pending.append([sender, message, time.time(), 1, self.seq, investigation_id])
             
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        data = {
-            "sender": sender,
-            "text": message,
-            "timestamp": timestamp
-        }
+    def _take_batch(self):
+        with self.lock:
+            count = min(len(self.pending), self.batch_max)
+            lines = [self.pending.popleft() for _ in range(count)]
+            dropped, self.dropped_unreported = self.dropped_unreported, 0
+        return lines, dropped
         
-        # Send to all connected WebSockets
-        disconnected = set()
-        for websocket in self.websockets.copy():
+    async def flush(self):
+        """Hand everything buffered so far as batched frames to all connected WebSockets."""
+        while True:
+            lines, dropped = self._take_batch()
+            if not lines and not dropped:
+                return
+            frame = {
+                "type": "batch",
+                "messages": [
+                    {
+                        "seq": seq,
+                        "investigation_id": investigation_id,
+                        "sender": sender,
+                        "text": text if count == 1 else f"{text} (x{count})",
+                        "timestamp": datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+                    }
+                    for sender, text, timestamp, count, seq, investigation_id in lines
+                ],
+                "dropped": dropped
+            }
+            for message in frame["messages"]:
+                self._replay_log(message["investigation_id"]).append(message)
+
+            # Each subscriber's writer sends it at the client's own pace
+            now = time.time()
+            for subscriber in list(self.subscribers.values()):
+                subscriber.offer(frame, now)
+            self.lines_sent += len(lines)
+            self.frames_sent += 1
+
+    def _replay_log(self, investigation_id):
+        log = self.replay_logs.get(investigation_id)
+        if log is None:
+            log = self.replay_logs[investigation_id] = ReplayLog(self.replay_size)
+            # Forget the investigations that have been quiet the longest
+            while len(self.replay_logs) > self.replay_investigations:
+                self.replay_logs.popitem(last=False)
+        else:
+            self.replay_logs.move_to_end(investigation_id)
+        return log
+
+    def replay(self, websocket, last_seq: int = 0, investigation_id: str = None):
+        """
+        Send a client the events it missed and, when an investigation is given, restrict it to that investigation.
+
+        Args:
+            websocket: A connection registered with start_capturing.
+            last_seq (int): The last sequence number the client received; 0 replays everything kept.
+            investigation_id (str, optional): Attach to this investigation only. By default every event is replayed.
+
+        Returns:
+            int: The number of events replayed.
+        """
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return 0
+        subscriber.investigation_id = investigation_id
+        if investigation_id is not None:
+            log = self.replay_logs.get(investigation_id)
+            events, truncated = log.since(last_seq) if log is not None else ([], False)
+        else:
+            events, truncated = [], False
+            for log in self.replay_logs.values():
+                log_events, log_truncated = log.since(last_seq)
+                events.extend(log_events)
+                truncated = truncated or log_truncated
+            events.sort(key=lambda event: event["seq"])
+
+        # Queued ahead of the live frames; the client skips any event it already has by seq
+        subscriber.prepend({
+            "type": "batch",
+            "replay": True,
+            "investigation_id": investigation_id,
+            "truncated": truncated,
+            "messages": events,
+            "dropped": 0
+        })
+        return len(events)
+
+    def investigations(self):
+        """Investigations with a replay log, most recently updated first."""
+        return [
+            {"investigation_id": investigation_id, **log.stats()}
+            for investigation_id, log in reversed(self.replay_logs.items())
+            if investigation_id is not None
+        ]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
             try:
-                await websocket.send_json(data)
-            except Exception as e:
-                # Mark for removal if WebSocket is disconnected
-                disconnected.add(websocket)
-                
-        # Remove disconnected WebSockets
-        for ws in disconnected:
-            self.websockets.discard(ws)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Never let a broken frame stop the broadcaster
+                self.original_stderr.write(traceback.format_exc())
     
-    def start_capturing(self, websocket):
-        """Start capturing console output and stream to WebSocket."""
-        self.add_websocket(websocket)
+    def publish(self, sender, message):
+        """Send a message to all connected WebSockets without waiting for it."""
+        self.enqueue(sender, message)
+    
+    def start(self):
+        """
+        Capture console output for the whole process, so investigations are recorded for replay
+        even before anyone connects. Must be called from the running event loop.
+        """
+        self.persistent = True
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self._run())
+        if not self.is_capturing:
+            self.is_capturing = True
+            sys.stdout = ConsoleWriter(self, "STDOUT")
+            sys.stderr = ConsoleWriter(self, "STDERR")
+            self.setup_logging_handler()
+
+    def start_capturing(self, websocket, send_lock: asyncio.Lock = None):
+        """
+        Start capturing console output and stream to WebSocket.
+
+        Args:
+            websocket: The connection to stream to.
+            send_lock (asyncio.Lock, optional): Lock held by everything else that sends on this connection.
+        """
+        self.add_websocket(websocket, send_lock=send_lock)
+
+        # Start the broadcaster on the running event loop
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self._run())
         
         if not self.is_capturing:
             self.is_capturing = True
@@ -69,13 +389,52 @@ class ConsoleStreamer:
         self.remove_websocket(websocket)
         
         # If no more WebSockets, restore original streams
-        if not self.websockets and self.is_capturing:
+        if not self.subscribers and self.is_capturing and not self.persistent:
             sys.stdout = self.original_stdout
             sys.stderr = self.original_stderr
             self.is_capturing = False
             
             # Remove logging handler
             self.remove_logging_handler()
+
+            # Nobody left to send to: stop the broadcaster and discard what is buffered
+            if self.flush_task is not None:
+                self.flush_task.cancel()
+                self.flush_task = None
+            with self.lock:
+                self.pending.clear()
+                self.dropped_unreported = 0
+
+    async def stop(self):
+        """Stop the broadcaster and restore the original streams."""
+        self.persistent = False
+        for websocket in list(self.subscribers):
+            self.remove_websocket(websocket)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+        if self.is_capturing:
+            sys.stdout = self.original_stdout
+            sys.stderr = self.original_stderr
+            self.is_capturing = False
+            self.remove_logging_handler()
+
+    def stats(self):
+        with self.lock:
+            buffered = len(self.pending)
+        return {
+            "subscribers": len(self.subscribers),
+            "buffered": buffered,
+            "buffer_size": self.buffer_size,
+            "lines_sent": self.lines_sent,
+            "frames_sent": self.frames_sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "last_seq": self.seq,
+            "replay_logs": len(self.replay_logs),
+            "clients": [subscriber.stats() for subscriber in self.subscribers.values()],
+        }
     
     def setup_logging_handler(self):
         """Set up a custom logging handler to capture log messages."""
@@ -85,10 +444,11 @@ class ConsoleStreamer:
         root_logger = logging.getLogger()
         root_logger.addHandler(self.log_handler)
         
-        # Also add to specific loggers that might be used
+        # Also add to specific loggers that might be used; those that propagate already reach the root logger
         for logger_name in ['uvicorn', 'fastapi', '__main__']:
             logger = logging.getLogger(logger_name)
-            logger.addHandler(self.log_handler)
+            if not logger.propagate:
+                logger.addHandler(self.log_handler)
     
     def remove_logging_handler(self):
         """Remove the custom logging handler."""
@@ -116,10 +476,8 @@ class ConsoleWriter:
         
         # Send to WebSockets if there's actual content
         if text.strip():
-            # Create async task to send to WebSockets
-            asyncio.create_task(
-                self.streamer.send_to_websockets(self.stream_type, text.strip())
-            )
+            # Buffered for the broadcaster, so this works from any thread
+            self.streamer.enqueue(self.stream_type, text.strip())
         
         return len(text)
     
@@ -143,9 +501,7 @@ class WebSocketLogHandler(logging.Handler):
             sender = f"LOG_{record.levelname}"
             
             # Send to WebSockets
-            asyncio.create_task(
-                self.streamer.send_to_websockets(sender, message)
-            )
+            self.streamer.enqueue(sender, message)
         except Exception:
             # Don't let logging errors crash the application
             pass
@@ -0,0 +1,14 @@
+# per-investigation context shared by the streaming, logging and tracing code
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+# Set while an investigation runs; tasks started from it inherit the value
+investigation_id_var: ContextVar[Optional[str]] = ContextVar("investigation_id", default=None)
+
+def new_investigation_id() -> str:
+    return uuid.uuid4().hex
+
+def current_investigation_id() -> Optional[str]:
+    """The id of the investigation the calling code runs in, or None outside of one."""
+    return investigation_id_var.get()
@@ -0,0 +1,275 @@
+# deduplication and coalescing of alerts before they are dispatched to the agents
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from utils.config import Config
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Payload keys that change on every delivery of the same problem and must not be part of the fallback fingerprint
+VOLATILE_KEYS = {
+    "timestamp", "time", "firedDateTime", "resolvedDateTime", "startTime", "endTime",
+    "lastUpdated", "eventTime", "id", "alertId", "monitorCondition", "state", "status",
+}
+
+K8S_NAMESPACE_KEYS = ("k8s.namespace.name", "namespace", "kubernetes.namespace")
+K8S_WORKLOAD_KEYS = ("k8s.workload.name", "workload", "kubernetes.workload")
+K8S_CLUSTER_KEYS = ("k8s.cluster.name", "cluster", "kubernetes.cluster")
+
+# Outcomes of AlertDeduplicator.submit
+NEW = "new"
+COALESCED = "coalesced"
+DUPLICATE = "duplicate"
+
+def _first(source: Dict[str, Any], keys) -> Optional[str]:
+    for key in keys:
+        value = source.get(key)
+        if value not in (None, "", [], {}):
+            return str(value)
+    return None
+
+def _properties(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge the places where Dynatrace and Azure Monitor put entity and Kubernetes properties."""
+    properties = dict(payload)
+    ranked_events = payload.get("rankedEvents")
+    if isinstance(ranked_events, list) and ranked_events and isinstance(ranked_events[0], dict):
+        properties.update(ranked_events[0])
+        properties.update(ranked_events[0].get("customProperties") or {})
+    properties.update(payload.get("customProperties") or {})
+
+    data = payload.get("data")
+    if isinstance(data, dict):
+        properties.update(data.get("essentials") or {})
+        properties.update(data.get("customProperties") or {})
+    return properties
+
+def _normalize(value: Optional[str]) -> Optional[str]:
+    return value.strip().lower() if isinstance(value, str) else value
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+def alert_keys(payload: Any) -> Tuple[str, Optional[str]]:
+    """
+    Build the dedup fingerprint and the correlation key of an alert payload.
+
+    The fingerprint identifies the same problem across re-deliveries: the Dynatrace problem ID or
+    the Azure Monitor alert rule and target, plus the impacted entity and Kubernetes namespace/workload.
+    The correlation key groups different alerts about the same Kubernetes workload (or entity).
+
+    Args:
+        payload (Any): The alert payload as received by the /alert route.
+
+    Returns:
+        tuple: (fingerprint, correlation_key). The correlation key is None when the payload carries no entity.
+    """
+    if not isinstance(payload, dict):
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        return digest, None
+
+    properties = _properties(payload)
+    problem_id = _first(properties, ("problemId", "ProblemID", "PID", "displayId", "alertRule", "originAlertId"))
+    entity = _first(properties, ("entityName", "ImpactedEntity", "impactedEntity", "alertTargetIDs", "targetResourceIds", "configurationItems"))
+    namespace = _first(properties, K8S_NAMESPACE_KEYS)
+    workload = _first(properties, K8S_WORKLOAD_KEYS)
+    cluster = _first(properties, K8S_CLUSTER_KEYS)
+
+    parts = [_normalize(part) for part in (problem_id, entity, cluster, namespace, workload)]
+    if any(parts):
+        fingerprint_source = "|".join(part or "" for part in parts)
+    else:
+        # Nothing recognizable, fall back to the payload without its volatile fields
+        fingerprint_source = json.dumps(_strip_volatile(payload), sort_keys=True, default=str)
+    fingerprint = hashlib.sha256(fingerprint_source.encode()).hexdigest()
+
+    if namespace or workload:
+        correlation_key = "|".join(_normalize(part) or "" for part in (cluster, namespace, workload))
+    elif entity:
+        correlation_key = _normalize(entity)
+    else:
+        correlation_key = None
+
+    return fingerprint, correlation_key
+
+@dataclass
+class AlertGroup:
+    """One investigation and every alert attached to it."""
+    group_id: str
+    correlation_key: Optional[str]
+    priority: int
+    payloads: List[Any] = field(default_factory=list)
+    fingerprints: set = field(default_factory=set)
+    created_at: float = field(default_factory=time.monotonic)
+    last_seen: float = field(default_factory=time.monotonic)
+    completed_at: Optional[float] = None
+    repeats: int = 0
+    dispatched: bool = False
+    team_mode: Optional[str] = None
+    use_cache: bool = True
+
+    def event(self) -> str:
+        """The task text handed to the agents."""
+        if len(self.payloads) == 1:
+            return json.dumps(self.payloads[0])
+        return json.dumps({"correlated_alerts": self.payloads})
+
+class AlertDeduplicator:
+    """
+    Attaches repeated alerts to the investigation already handling them and merges correlated
+    alerts that arrive within a few seconds of each other into a single investigation.
+    """
+
+    def __init__(self, dispatch: Callable[[AlertGroup], Any], admit: Callable[[], Any] = None,
+                 window: float = None, coalesce_window: float = None):
+        """
+        Args:
+            dispatch (callable): Called with an AlertGroup once it is ready to be investigated.
+            admit (callable, optional): Called before a new investigation is created; raises to reject it. Once it
+                returns, dispatch must not fail for lack of room, e.g. it holds a queue slot for the group.
+            window (float, optional): Seconds a fingerprint stays suppressed after its investigation finishes.
+            coalesce_window (float, optional): Seconds a new group waits for correlated alerts before being dispatched.
+        """
+        self.dispatch = dispatch
+        self.admit = admit
+        self.window = Config.alert_dedup_window if window is None else window
+        self.coalesce_window = Config.alert_coalesce_window if coalesce_window is None else coalesce_window
+        self.groups: Dict[str, AlertGroup] = {}
+        self.by_fingerprint: Dict[str, AlertGroup] = {}
+        self.collecting: Dict[str, AlertGroup] = {}
+
+        # Metrics
+        self.created = 0
+        self.duplicates = 0
+        self.coalesced = 0
+
+    def submit(self, payload: Any, priority: int, team_mode: Optional[str] = None,
+               use_cache: bool = True) -> Tuple[AlertGroup, str]:
+        """
+        Register an incoming alert.
+
+        Args:
+            payload (Any): The alert payload.
+            priority (int): The scheduling priority of the alert.
+            team_mode (str, optional): Agent team used if this alert starts a new investigation.
+            use_cache (bool): Whether the investigation may be answered from a stored one. An alert that asks
+                for a fresh investigation turns this off for the group it joins.
+
+        Returns:
+            tuple: (group, outcome) where outcome is "new", "coalesced" or "duplicate".
+        """
+        self._expire()
+        now = time.monotonic()
+        fingerprint, correlation_key = alert_keys(payload)
+
+        # Same problem already being investigated (or recently finished)
+        group = self.by_fingerprint.get(fingerprint)
+        if group is not None:
+            group.repeats += 1
+            group.last_seen = now
+            self.duplicates += 1
+            logger.info(f"Alert {fingerprint[:12]} is a repeat, attached to investigation {group.group_id}")
+            return group, DUPLICATE
+
+        # A correlated alert arrived while a group is still collecting
+        group = self.collecting.get(correlation_key) if correlation_key else None
+        if group is not None:
+            group.payloads.append(payload)
+            group.fingerprints.add(fingerprint)
+            group.priority = min(group.priority, priority)
+            group.use_cache = group.use_cache and use_cache
+            group.last_seen = now
+            self.by_fingerprint[fingerprint] = group
+            self.coalesced += 1
+            logger.info(f"Alert {fingerprint[:12]} coalesced into investigation {group.group_id}")
+            return group, COALESCED
+
+        # Apply backpressure before committing to a new investigation: an alert that was answered
+        # must not be rejected when its group is dispatched after the coalesce window
+        if self.admit is not None:
+            self.admit()
+
+        group = AlertGroup(
+            group_id=uuid.uuid4().hex,
+            correlation_key=correlation_key,
+            priority=priority,
+            payloads=[payload],
+            fingerprints={fingerprint},
+            team_mode=team_mode,
+            use_cache=use_cache,
+        )
+
+        if self.coalesce_window > 0 and correlation_key:
+            # Give correlated alerts a chance to join before dispatching
+            self._register(group)
+            self.collecting[correlation_key] = group
+            asyncio.get_running_loop().call_later(self.coalesce_window, self._flush, group)
+        else:
+            # Dispatch first so a rejected alert is not remembered as in flight
+            self.dispatch(group)
+            group.dispatched = True
+            self._register(group)
+
+        self.created += 1
+        return group, NEW
+
+    def _register(self, group: AlertGroup):
+        self.groups[group.group_id] = group
+        for fingerprint in group.fingerprints:
+            self.by_fingerprint[fingerprint] = group
+
+    def _flush(self, group: AlertGroup):
+        if group.dispatched or group.group_id not in self.groups:
+            return
+        if self.collecting.get(group.correlation_key) is group:
+            del self.collecting[group.correlation_key]
+        try:
+            self.dispatch(group)
+            group.dispatched = True
+        except Exception as e:
+            logger.error(f"Failed to dispatch investigation {group.group_id}: {str(e)}")
+            self._forget(group)
+
+    def flush(self):
+        """Dispatch the groups still collecting without waiting for their coalesce window, e.g. on shutdown."""
+        for group in list(self.collecting.values()):
+            self._flush(group)
+
+    def _forget(self, group: AlertGroup):
+        self.groups.pop(group.group_id, None)
+        for fingerprint in group.fingerprints:
+            if self.by_fingerprint.get(fingerprint) is group:
+                del self.by_fingerprint[fingerprint]
+
+    def complete(self, group_id: str):
+        """
+        Mark an investigation as finished. Its fingerprints stay suppressed for the dedup window.
+        """
+        group = self.groups.get(group_id)
+        if group is not None:
+            group.completed_at = time.monotonic()
+
+    def _expire(self):
+        now = time.monotonic()
+        for group in list(self.groups.values()):
+            if group.completed_at is not None and now - max(group.completed_at, group.last_seen) > self.window:
+                self._forget(group)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return dedup and coalescing metrics."""
+        return {
+            "active_investigations": sum(1 for group in self.groups.values() if group.completed_at is None),
+            "tracked_fingerprints": len(self.by_fingerprint),
+            "investigations_created": self.created,
+            "duplicates_suppressed": self.duplicates,
+            "alerts_coalesced": self.coalesced,
+        }
@@ -0,0 +1,207 @@
+# fan-out team: a planner splits the task into independent sub-tasks that the specialists work on concurrently
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence, Union
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, TextMessage
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, SystemMessage, UserMessage
+from utils.config import Config
+from utils.prompthandler import get_prompt
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# "magentic": MagenticOne orchestrator calling one specialist at a time; "fanout": FanOutTeam
+TEAM_MODES = ("magentic", "fanout")
+
+def resolve_team_mode(team_mode: Optional[str] = None) -> str:
+    """
+    Returns the team mode to use, falling back to the configured default.
+
+    Raises:
+        ValueError: If the mode is not one of TEAM_MODES.
+    """
+    mode = (team_mode or Config.team_mode).strip().lower()
+    if mode not in TEAM_MODES:
+        raise ValueError(f"Unknown team mode '{team_mode}', expected one of: {', '.join(TEAM_MODES)}")
+    return mode
+
+def parse_plan(text: str) -> Dict[str, Any]:
+    """
+    Extract the JSON plan from the planner reply. A reply without valid JSON is taken as the final answer.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            plan = json.loads(match.group(0))
+            if isinstance(plan, dict):
+                return plan
+        except ValueError:
+            pass
+    return {"done": True, "final_answer": text}
+
+class FanOutTeam:
+    """
+    Team where a planner splits the task into independent sub-tasks, the specialists work on them concurrently,
+    and their findings are joined before the next planning step.
+
+    Exposes run() and run_stream() like the autogen teams, so it can be used in place of MagenticOneGroupChat.
+    """
+
+    def __init__(self, specialists: Sequence[AssistantAgent], model_client: ChatCompletionClient,
+                 max_rounds: int = None, finding_max_chars: int = None):
+        """
+        Args:
+            specialists (list): The agents sub-tasks can be assigned to, by name.
+            model_client (ChatCompletionClient): The model client used by the planner.
+            max_rounds (int, optional): Planning rounds before the planner is asked for the final answer.
+            finding_max_chars (int, optional): Characters of each specialist answer passed back to the planner.
+        """
+        self.name = "fanout_planner"
+        self.specialists = {agent.name: agent for agent in specialists}
+        self.model_client = model_client
+        self.max_rounds = max_rounds or Config.fanout_max_rounds
+        self.finding_max_chars = finding_max_chars or Config.fanout_finding_max_chars
+
+    def _context(self, task: str, findings: List[Dict[str, Any]], round_number: int, final: bool) -> str:
+        lines = [f"Tarefa:\n{task}", "", f"Rodada: {round_number} de {self.max_rounds}", "", "Especialistas disponíveis:"]
+        lines += [f"- {name}: {agent.description}" for name, agent in self.specialists.items()]
+        lines += ["", "Resultados até agora:"]
+        if not findings:
+            lines.append("(nenhum)")
+        for finding in findings:
+            lines.append(f"[rodada {finding['round']}] {finding['agent']} - sub-tarefa: {finding['task']}")
+            lines.append(f"resultado: {finding['result']}")
+        if final:
+            lines += ["", "Não há mais rodadas: não crie sub-tarefas e responda com done=true e a resposta final."]
+        return "\n".join(lines)
+
+    async def _plan(self, task: str, findings: List[Dict[str, Any]], round_number: int, final: bool,
+                    cancellation_token: Optional[CancellationToken]) -> Dict[str, Any]:
+        result = await self.model_client.create(
+            [
+                SystemMessage(content=get_prompt("fanout_planner")),
+                UserMessage(content=self._context(task, findings, round_number, final), source="user")
+            ],
+            cancellation_token=cancellation_token
+        )
+        content = result.content if isinstance(result.content, str) else str(result.content)
+        return parse_plan(content)
+
+    def _assignments(self, plan: Dict[str, Any]) -> Dict[str, str]:
+        # Each agent keeps a single conversation, so sub-tasks for the same agent are merged into one
+        assignments: Dict[str, List[str]] = {}
+        for subtask in plan.get("subtasks") or []:
+            if not isinstance(subtask, dict):
+                continue
+            name, text = subtask.get("agent"), subtask.get("task")
+            if name in self.specialists and text:
+                assignments.setdefault(name, []).append(str(text))
+            else:
+                logger.warning(f"Ignoring invalid fan-out sub-task: {subtask}")
+        return {name: "\n".join(texts) for name, texts in assignments.items()}
+
+    async def _run_specialist(self, agent: AssistantAgent, subtask: str, queue: asyncio.Queue,
+                              cancellation_token: Optional[CancellationToken]) -> str:
+        answer = None
+        try:
+            async for item in agent.run_stream(task=subtask, cancellation_token=cancellation_token, output_task_messages=False):
+                if isinstance(item, TaskResult):
+                    continue
+                await queue.put(item)
+                # Tool-using specialists end their turn with a tool call summary rather than a text message
+                if isinstance(item, BaseChatMessage) and item.source == agent.name:
+                    answer = item.to_text()
+        finally:
+            # Tells the consumer this specialist is done
+            await queue.put(None)
+        return answer or "(sem resposta)"
+
+    async def run_stream(self, task: str, cancellation_token: CancellationToken = None
+                         ) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, TaskResult], None]:
+        """
+        Runs the task, yielding the planner and specialist messages as they are produced and a TaskResult at the end.
+
+        Args:
+            task (str): The task to be performed by the agents.
+            cancellation_token (CancellationToken, optional): Cancels the planner and every running specialist.
+        """
+        messages: List[Union[BaseAgentEvent, BaseChatMessage]] = [TextMessage(source="user", content=task)]
+        yield messages[0]
+        findings: List[Dict[str, Any]] = []
+        stop_reason = "Maximum rounds reached"
+
+        for round_number in range(1, self.max_rounds + 2):
+            final = round_number > self.max_rounds
+            plan = await self._plan(task, findings, min(round_number, self.max_rounds), final, cancellation_token)
+            assignments = {} if final else self._assignments(plan)
+
+            if plan.get("done") or not assignments:
+                answer = plan.get("final_answer") or plan
+                if not isinstance(answer, str):
+                    answer = json.dumps(answer, ensure_ascii=False, default=str)
+                message = TextMessage(source=self.name, content=answer)
+                messages.append(message)
+                yield message
+                if not final:
+                    stop_reason = "Planner finished"
+                break
+
+            message = TextMessage(
+                source=self.name,
+                content=f"Rodada {round_number}:\n" + "\n".join(f"- {name}: {text}" for name, text in assignments.items())
+            )
+            messages.append(message)
+            yield message
+
+            # Run the sub-tasks concurrently and forward their messages as they arrive
+            started = time.monotonic()
+            queue: asyncio.Queue = asyncio.Queue()
+            tasks = {
+                name: asyncio.create_task(self._run_specialist(self.specialists[name], text, queue, cancellation_token))
+                for name, text in assignments.items()
+            }
+            try:
+                running = len(tasks)
+                while running:
+                    item = await queue.get()
+                    if item is None:
+                        running -= 1
+                        continue
+                    messages.append(item)
+                    yield item
+            finally:
+                for running_task in tasks.values():
+                    if not running_task.done():
+                        running_task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+            # Join the findings before the next planning step
+            for name, running_task in tasks.items():
+                if running_task.cancelled():
+                    result = "Erro: sub-tarefa cancelada"
+                elif running_task.exception() is not None:
+                    result = f"Erro: {str(running_task.exception())}"
+                else:
+                    result = running_task.result()
+                if len(result) > self.finding_max_chars:
+                    result = result[:self.finding_max_chars] + f"... [{len(result) - self.finding_max_chars} chars truncated]"
+                findings.append({"round": round_number, "agent": name, "task": assignments[name], "result": result})
+            logger.info(f"Fan-out round {round_number}: {len(tasks)} specialists finished in {time.monotonic() - started:.1f}s")
+
+        yield TaskResult(messages=messages, stop_reason=stop_reason)
+
+    async def run(self, task: str, cancellation_token: CancellationToken = None) -> TaskResult:
+        """
+        Runs the task and returns the TaskResult.
+        """
+        result = None
+        async for item in self.run_stream(task=task, cancellation_token=cancellation_token):
+            if isinstance(item, TaskResult):
+                result = item
+        return result
@@ -1,14 +1,29 @@
 from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 import asyncio
 from pydantic import BaseModel
-from typing import Any, List
-from utils.agents import Agents
-from tools.queryazmonitor import query_azure_monitor
+from typing import Any, Dict, List
+from utils.agents import agent_factory
+from tools.getdynatracelogs import dynatrace_client
+from tools.kubestate import kube_state
+from utils.azauth import az_session
+from utils.config import Config
+from tools.queryazmonitor import query_azure_monitor, azure_monitor_client, kql_cache
 from datetime import timedelta
 import json
-from utils.logger import setup_logger
+from utils.logger import setup_logger, logging_stats
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from utils.console_streamer import console_streamer
+from utils.scheduler import AlertScheduler, AlertQueueFullError, SchedulerUnavailableError, get_alert_priority
+from utils.dedup import AlertDeduplicator
+from utils.fanout import resolve_team_mode
+from utils.context import investigation_id_var, new_investigation_id
+from utils.investigations import investigation_store
+from utils.compaction import compaction_stats
+from utils.tracing import TurnTracer, tracer
+from autogen_agentchat.base import TaskResult
+from utils.streaming import STREAM_FORMATS, resolve_stream_format, stream_team_run
+import time
 
 # Set up logging
 logger = setup_logger(__name__)
@@ -29,13 +44,130 @@ class CustomConsoleHandler:
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
 
+class WebSocketSession:
+    """
+    Investigations started from one /ws connection. Each event runs as its own task, so the
+    connection keeps receiving messages (cancel, status, ping, more events) while they run.
+    """
+
+    def __init__(self, websocket, max_investigations: int = None):
+        self.websocket = websocket
+        self.max_investigations = max_investigations or Config.ws_max_investigations
+        self.investigations: Dict[str, Dict[str, Any]] = {}
+        # Also held by the console stream writer for this connection
+        self.send_lock = asyncio.Lock()
+
+    async def send(self, message: Dict[str, Any]):
+        # Investigation tasks, the receive loop and the console stream share the socket
+        async with self.send_lock:
+            await self.websocket.send_json(message)
+
+    async def start(self, event: str, team_mode: str = None, use_cache: bool = True) -> str:
+        """
+        Start an investigation for an event.
+
+        Raises:
+            ValueError: If the team mode is unknown or the connection already runs its maximum of investigations.
+        """
+        if len(self.investigations) >= self.max_investigations:
+            raise ValueError(f"This connection already runs {self.max_investigations} investigations, cancel one or wait")
+
+        # A fresh team per investigation, since teams keep conversation state
+        agents = agent_factory.create_agents(team_mode=team_mode)
+        investigation_id = new_investigation_id()
+        task = asyncio.create_task(self._run(agents, event, investigation_id, use_cache))
+        self.investigations[investigation_id] = {
+            "task": task,
+            "event": event,
+            "team_mode": agents.team_mode,
+            "started": time.monotonic(),
+        }
+        task.add_done_callback(lambda _: self.investigations.pop(investigation_id, None))
+        return investigation_id
+
+    async def _run(self, agents, event: str, investigation_id: str, use_cache: bool = True):
+        # Send command echo to show what's being executed
+        await self.send({
+            "sender": "COMMAND",
+            "type": "investigation",
+            "investigation_id": investigation_id,
+            "text": f"Processing alert: {event}"
+        })
+        logger.info(f"Processing WebSocket alert event {investigation_id}: {event}")
+        try:
+            # Run the agent's task (same as in /alert route)
+            await agents.run_task(event, investigation_id=investigation_id, use_cache=use_cache)
+            await self.send({
+                "sender": "SYSTEM",
+                "investigation_id": investigation_id,
+                "text": "Alert processing completed successfully"
+            })
+        except asyncio.CancelledError:
+            logger.info(f"Investigation {investigation_id} cancelled")
+            await self._notify({
+                "sender": "SYSTEM",
+                "investigation_id": investigation_id,
+                "text": "Investigation cancelled"
+            })
+            raise
+        except Exception as e:
+            logger.error(f"Error processing alert event {investigation_id}: {str(e)}")
+            await self._notify({
+                "sender": "ERROR",
+                "investigation_id": investigation_id,
+                "text": f"Error processing alert: {str(e)}"
+            })
+
+    async def _notify(self, message: Dict[str, Any]):
+        # The socket may already be gone
+        try:
+            await self.send(message)
+        except Exception:
+            pass
+
+    def cancel(self, investigation_id: str) -> bool:
+        investigation = self.investigations.get(investigation_id)
+        if investigation is None:
+            return False
+        investigation["task"].cancel()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "type": "status",
+            "max_investigations": self.max_investigations,
+            "investigations": [
+                {
+                    "investigation_id": investigation_id,
+                    "team_mode": investigation["team_mode"],
+                    "elapsed_seconds": round(now - investigation["started"], 1),
+                    "event": investigation["event"][:200],
+                }
+                for investigation_id, investigation in self.investigations.items()
+            ]
+        }
+
+    def close(self):
+        """Called when the connection goes away."""
+        if Config.ws_cancel_on_disconnect:
+            for investigation in list(self.investigations.values()):
+                investigation["task"].cancel()
+        elif self.investigations:
+            # They keep running and can be attached to again from /ws
+            logger.info(f"WebSocket closed with {len(self.investigations)} investigations still running")
+
 class APIEndpoint:
     """
     A class to define and manage a FastAPI application with specific routes and background task handling.
     """
     def __init__(self):
         self.app = FastAPI()
-        self.background_tasks = set()
+        self.background_tasks = AlertScheduler()
+        self.deduplicator = AlertDeduplicator(
+            dispatch=self.dispatch_alert_group,
+            admit=self.background_tasks.reserve
+        )
         self.active_connections: List[WebSocket] = []
         
         # Add CORS middleware
@@ -60,46 +192,85 @@ class APIEndpoint:
                 # Read the request body
                 payload = await request.json()
 
-                # Convert the JSON payload to a string
-                event_str = json.dumps(payload)
-                
-                # Initialize the Agents class instance
-                agents = Agents()
-                
-                # Create an asynchronous task to run the agent's task with the event string
-                task = asyncio.create_task(agents.run_task(event_str))
-                
-                # Add the created task to the set of background tasks
-                self.background_tasks.add(task)
-                
-                # Ensure the task is removed from the set once it is completed
-                task.add_done_callback(self.background_tasks.discard)
+                # Agent team for this investigation, e.g. /alert?mode=fanout
+                try:
+                    team_mode = resolve_team_mode(request.query_params.get("mode"))
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+
+                # /alert?fresh=true investigates even when a past investigation matches
+                use_cache = request.query_params.get("fresh", "false").lower() != "true"
+
+                # Attach repeats to the running investigation, merge correlated alerts and queue new ones
+                group, outcome = self.deduplicator.submit(
+                    payload, priority=get_alert_priority(payload), team_mode=team_mode, use_cache=use_cache
+                )
                 
                 # Return a success response with HTTP status 200
-                return {"status": "success"}, 200
+                return {"status": "success", "alert_id": group.group_id, "dedup": outcome}
 
+            except HTTPException:
+                raise
+            except AlertQueueFullError as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail=str(e),
+                    headers={"Retry-After": str(self.background_tasks.retry_after())}
+                )
+            except SchedulerUnavailableError as e:
+                raise HTTPException(
+                    status_code=503,
+                    detail=str(e),
+                    headers={"Retry-After": str(self.background_tasks.retry_after())}
+                )
             except Exception as e:
                 raise HTTPException(
                     status_code=500,
                     detail=f"Error processing payload: {str(e)}"
                 )
         
+        @self.app.get("/metrics")
+        async def metrics():
+            return {
+                "alert_queue": self.background_tasks.stats(),
+                "alert_dedup": self.deduplicator.stats(),
+                "kql_cache": kql_cache.stats(),
+                "kube_state": kube_state.stats(),
+                "az_session": az_session.stats(),
+                "console_stream": console_streamer.stats(),
+                "logging": logging_stats(),
+                "investigation_store": investigation_store.stats(),
+                "model_client": agent_factory.stats(),
+                "context_compaction": compaction_stats(),
+                "tracing": tracer.stats()
+            }
+        
+        @self.app.get("/investigations")
+        async def investigations():
+            # Investigations a viewer can attach to over /ws with {"attach": id, "last_seq": 0}
+            return {"investigations": console_streamer.investigations()}
+
+        @self.app.get("/investigations/{investigation_id}/trace")
+        async def investigation_trace(investigation_id: str):
+            # Waterfall of the investigation's turns, model calls and tool calls with durations and tokens
+            waterfall = tracer.waterfall(investigation_id)
+            if waterfall is None:
+                raise HTTPException(status_code=404, detail=f"No trace for investigation {investigation_id}")
+            return waterfall
+        
         @self.app.websocket("/ws")
         async def websocket_endpoint(websocket: WebSocket):
             await websocket.accept()
             logger.info(f"WebSocket connection established")
 
-            # Start capturing console output for this WebSocket
-            console_streamer.start_capturing(websocket)
-
-            try:
-                agents = Agents()
+            session = WebSocketSession(websocket)
 
-                # Use the CustomConsoleHandler to send messages to the WebSocket
-                console_handler = CustomConsoleHandler(websocket)
+            # Start capturing console output for this WebSocket, sending frames under the session's lock
+            console_streamer.start_capturing(websocket, send_lock=session.send_lock)
 
+            try:
                 # Send a welcome message
-                await websocket.send_json({
+                await session.send({
                     "sender": "SYSTEM",
                     "text": "Console streaming started. All output will be shown here."
                 })
@@ -110,31 +281,42 @@ class APIEndpoint:
                     data_json = json.loads(data)
                     logger.info(f"Received WebSocket message: {data}")
 
-                    if "event" in data_json:
-                        event = data_json["event"]
+                    if "ping" in data_json:
+                        await session.send({"type": "pong", "ping": data_json["ping"]})
 
-                        try:
-                            # Send command echo to show what's being executed
-                            await websocket.send_json({
-                                "sender": "COMMAND",
-                                "text": f"Processing alert: {event}"
-                            })
-                            
-                            # Process the event using the same logic as the /alert route
-                            logger.info(f"Processing WebSocket alert event: {event}")
-                            
-                            # Run the agent's task (same as in /alert route)
-                            await agents.run_task(event)
-                            
-                            # Send a completion message
-                            await websocket.send_json({
-                                "sender": "SYSTEM", 
-                                "text": "Alert processing completed successfully"
+                    elif "status" in data_json:
+                        await session.send(session.status())
+
+                    elif "cancel" in data_json:
+                        investigation_id = data_json["cancel"]
+                        if not session.cancel(investigation_id):
+                            await session.send({
+                                "sender": "ERROR",
+                                "investigation_id": investigation_id,
+                                "text": f"No running investigation {investigation_id} on this connection"
                             })
-                        except Exception as e:
-                            logger.error(f"Error processing alert event: {str(e)}")
-                            await websocket.send_json({
-                                "sender": "ERROR", 
+
+                    elif "attach" in data_json or "last_seq" in data_json:
+                        # Resume after a reconnect, or attach to an investigation that is already running
+                        replayed = console_streamer.replay(
+                            websocket,
+                            last_seq=int(data_json.get("last_seq") or 0),
+                            investigation_id=data_json.get("attach")
+                        )
+                        logger.info(f"Replayed {replayed} events to WebSocket client")
+
+                    elif "event" in data_json:
+                        # Runs in the background; its messages are tagged with the investigation id
+                        try:
+                            # {"fresh": true} skips the cached findings of past investigations
+                            await session.start(
+                                data_json["event"],
+                                team_mode=data_json.get("mode"),
+                                use_cache=not data_json.get("fresh")
+                            )
+                        except ValueError as e:
+                            await session.send({
+                                "sender": "ERROR",
                                 "text": f"Error processing alert: {str(e)}"
                             })
 
@@ -143,6 +325,8 @@ class APIEndpoint:
             except Exception as e:
                 logger.error(f"WebSocket error: {str(e)}", exc_info=True)
             finally:
+                session.close()
+
                 # Stop capturing console output for this WebSocket
                 console_streamer.stop_capturing(websocket)
                 logger.info(f"Cleaning up WebSocket connection")
@@ -157,14 +341,46 @@ class APIEndpoint:
                 if not event:
                     raise HTTPException(status_code=400, detail="Missing 'event' parameter")
                 
-                # Initialize the Agents class
-                agents = Agents()
+                # Get a fresh team bound to the shared model client
+                try:
+                    agents = agent_factory.create_agents(team_mode=body.get("mode"))
+                    stream_format = resolve_stream_format(body.get("stream"), request.headers.get("accept"))
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
                 
-                # Execute the task and get the response
-                response = await agents.team.run(task=event)
+                investigation_id = new_investigation_id()
+
+                # Opt-in streaming: each agent message as it is produced, heartbeats, then a compact summary
+                if stream_format is not None:
+                    return StreamingResponse(
+                        stream_team_run(agents, event, investigation_id, stream_format),
+                        media_type=STREAM_FORMATS[stream_format],
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                    )
+                
+                # Execute the task and get the response, traced like any other investigation
+                started = time.monotonic()
+                response = None
+                context_token = investigation_id_var.set(investigation_id)
+                try:
+                    with tracer.span("investigation", "investigation", team_mode=agents.team_mode):
+                        turns = TurnTracer()
+                        async for item in agents.team.run_stream(task=event):
+                            turns.observe(item)
+                            if isinstance(item, TaskResult):
+                                response = item
+                finally:
+                    investigation_id_var.reset(context_token)
                 
                 # Return the response
-                return {"response": response}
+                return {
+                    "response": response,
+                    "investigation_id": investigation_id,
+                    "team_mode": agents.team_mode,
+                    "elapsed_seconds": round(time.monotonic() - started, 3)
+                }
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Error in run_task: {str(e)}")
                 raise HTTPException(
@@ -172,10 +388,45 @@ class APIEndpoint:
                     detail=f"Error processing task: {str(e)}"
                 )
     
+    def dispatch_alert_group(self, group):
+        """
+        Queues an alert group on the scheduler once the deduplicator has finished collecting it,
+        in the slot reserved for it when its first alert was accepted.
+        """
+        self.background_tasks.submit(
+            group.event(), priority=group.priority, alert_id=group.group_id, team_mode=group.team_mode,
+            use_cache=group.use_cache, reserved=True
+        )
+
     # Method to return the FastAPI application instance
     def get_app(self):
         return self.app
     
+async def run_alert(job):
+    """
+    Runs a queued alert with a fresh team bound to the shared model client.
+    """
+    try:
+        agents = agent_factory.create_agents(team_mode=job.team_mode)
+        await agents.run_task(job.event, investigation_id=job.alert_id, use_cache=job.use_cache)
+    finally:
+        # Keep suppressing repeats of this alert for the dedup window
+        api.deduplicator.complete(job.alert_id)
+
+async def start_cluster_access():
+    """
+    Logs in to Azure and fetches the AKS credentials once, then starts the cluster snapshot that depends on them.
+    """
+    if Config.az_login_enabled:
+        await az_session.start()
+    if Config.kube_state_enabled:
+        kube_state.start()
+
+def _log_cluster_access_failure(task: asyncio.Task):
+    # Startup does not wait for this task, so its failure would otherwise go unnoticed
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Cluster access setup failed: {str(task.exception())}", exc_info=task.exception())
+
 # Create an instance of the APIEndpoint class
 api = APIEndpoint()
 
@@ -185,13 +436,34 @@ app = api.get_app()
 # Define an event handler for the "startup" event
 @app.on_event("startup")
 async def startup_event():
-    # Placeholder for any startup logic (currently does nothing)
-    pass
+    # Create the shared model client and load the prompts before the first request arrives
+    agent_factory.warm_up()
+
+    # Record console output for streaming and replay from the start
+    console_streamer.start()
+
+    # Start the workers that run queued alerts
+    api.background_tasks.start(run_alert)
+
+    # Log in to the cluster once for the whole process, then warm start the cluster snapshot and keep it refreshed
+    app.state.cluster_access_task = asyncio.create_task(start_cluster_access())
+    app.state.cluster_access_task.add_done_callback(_log_cluster_access_failure)
 
 # Define an event handler for the "shutdown" event
 @app.on_event("shutdown")
 async def shutdown_event():
-    # Check if there are any background tasks still running
-    if api.background_tasks:
-        # Wait for all background tasks to complete before shutting down
-        await asyncio.gather(*api.background_tasks)
\ No newline at end of file
+    # Queue the alerts still being coalesced, then stop accepting alerts and wait for the queued and running ones
+    api.deduplicator.flush()
+    await api.background_tasks.stop(drain=True)
+    cluster_access_task = getattr(app.state, "cluster_access_task", None)
+    if cluster_access_task is not None and not cluster_access_task.done():
+        cluster_access_task.cancel()
+        await asyncio.gather(cluster_access_task, return_exceptions=True)
+    await kube_state.stop()
+    await az_session.stop()
+    await console_streamer.stop()
+
+    # Release the shared model client and the connection pools
+    await agent_factory.close()
+    await dynatrace_client.close()
+    await azure_monitor_client.close()
\ No newline at end of file
@@ -1,25 +1,128 @@
 # create a http client for sending requests to the server
-import requests
-from requests.exceptions import RequestException
-from typing import Dict, Any, Optional
-import logging
+import asyncio
 import json
-import os
+import random
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional
+import aiohttp
+from utils.config import Config
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+@dataclass
+class HttpResponse:
+    """The status, headers and body of a completed request."""
+    status: int
+    text: str
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def json(self) -> Any:
+        return json.loads(self.text)
 
 class HttpClient:
-    def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None):
-        self.base_url = base_url
+    """
+    Async HTTP client with a shared keep-alive connection pool, timeouts and retries.
+    Requests that fail with a connection error, a timeout, 429 or a 5xx are retried with
+    jittered exponential backoff, honoring Retry-After when the server sends one.
+    """
+
+    def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None, timeout: float = None,
+                 max_retries: int = None, backoff_base: float = None, backoff_max: float = None,
+                 connection_limit: int = None):
+        self.base_url = base_url.rstrip("/") if base_url else ""
         self.headers = headers if headers else {}
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-        #logging.basicConfig(level=logging.INFO)
+        self.timeout = aiohttp.ClientTimeout(total=timeout or Config.http_timeout)
+        self.max_retries = Config.http_max_retries if max_retries is None else max_retries
+        self.backoff_base = backoff_base or Config.http_backoff_base
+        self.backoff_max = backoff_max or Config.http_backoff_max
+        self.connection_limit = connection_limit or Config.http_connection_limit
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session must be created inside the running event loop, so it is created on first use
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=60)
+            )
+        return self.session
+
+    def _url(self, endpoint: str) -> str:
+        if endpoint.startswith("http://") or endpoint.startswith("https://"):
+            return endpoint
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
 
-    def send_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
-        url = os.path.join(self.base_url, endpoint)
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: a random delay up to the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request(self, method: str, endpoint: str, params: Optional[Dict[str, Any]] = None,
+                      data: Optional[Dict[str, Any]] = None, json_body: Optional[Any] = None,
+                      headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        """
+        Send a request and return the response, retrying transient failures.
+
+        Args:
+            method (str): The HTTP method.
+            endpoint (str): Path relative to the base URL, or an absolute URL.
+            params (dict, optional): Query string parameters. None values are left out.
+            data (dict, optional): Form-encoded body.
+            json_body (Any, optional): JSON body.
+            headers (dict, optional): Extra headers for this request.
+
+        Returns:
+            HttpResponse: The last response received. Non-retryable error statuses are returned, not raised.
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: If the request still fails after all retries.
+        """
+        url = self._url(endpoint)
+        if params:
+            params = {key: str(value) for key, value in params.items() if value is not None}
+
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().request(method, url, params=params, data=data, json=json_body, headers=headers) as response:
+                    result = HttpResponse(status=response.status, text=await response.text(), headers=dict(response.headers))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{method} {url} failed ({type(e).__name__}: {e}), retrying in {delay:.2f}s")
+            else:
+                if result.status not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return result
+                delay = self._backoff(attempt, result.headers.get("Retry-After"))
+                logger.warning(f"{method} {url} returned {result.status}, retrying in {delay:.2f}s")
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def send_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         try:
-            response = self.session.request(method, url, json=data)
-            response.raise_for_status()  # Raise an error for bad responses
+            response = await self.request(method, endpoint, json_body=data)
+            if response.status >= 400:
+                logger.error(f"Request failed: {response.status} - {response.text}")
+                return None
             return response.json()
-        except RequestException as e:
-            logging.error(f"Request failed: {e}")
-            return None
\ No newline at end of file
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Request failed: {e}")
+            return None
+
+    async def close(self):
+        """Close the connection pool."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
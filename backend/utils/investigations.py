@@ -0,0 +1,309 @@
+# store of past investigations, matched against new alerts by fingerprint or text similarity
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import TextMessage, ToolCallExecutionEvent, ToolCallRequestEvent
+from utils.config import Config
+from utils.dedup import VOLATILE_KEYS, alert_keys
+from utils.reducer import TEMPLATE_PATTERNS
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Size of the hashed n-gram vectors
+VECTOR_DIMENSIONS = 1024
+
+def alert_signature(event: str) -> str:
+    """
+    The text an alert is compared on: its fields without the ones that change on every delivery, with
+    timestamps masked. Resource names, ids and numbers are kept, so alerts about different nodes,
+    namespaces or workloads do not look alike.
+    """
+    try:
+        payload = json.loads(event)
+    except (TypeError, ValueError):
+        payload = event
+
+    lines: List[str] = []
+
+    def flatten(value: Any, path: str):
+        if isinstance(value, dict):
+            for key in sorted(value):
+                if key not in VOLATILE_KEYS:
+                    flatten(value[key], f"{path}.{key}" if path else key)
+        elif isinstance(value, list):
+            for item in value:
+                flatten(item, path)
+        elif value not in (None, ""):
+            lines.append(f"{path}: {value}" if path else str(value))
+
+    flatten(payload, "")
+    timestamp_pattern, placeholder = TEMPLATE_PATTERNS[0]
+    return timestamp_pattern.sub(placeholder, "\n".join(lines)).lower()
+
+def local_embedding(text: str) -> Dict[int, float]:
+    """
+    Offline embedding: character trigrams and words hashed into a fixed number of dimensions, L2-normalized.
+    Returned as a sparse {dimension: weight} dict.
+    """
+    features = Counter()
+    for word in re.findall(r"[\w<>.-]+", text):
+        features[f"w:{word}"] += 1
+        padded = f" {word} "
+        for index in range(len(padded) - 2):
+            features[f"c:{padded[index:index + 3]}"] += 1
+
+    vector: Dict[int, float] = {}
+    for feature, count in features.items():
+        dimension = zlib.crc32(feature.encode()) % VECTOR_DIMENSIONS
+        vector[dimension] = vector.get(dimension, 0.0) + count
+    norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+    return {dimension: weight / norm for dimension, weight in vector.items()}
+
+def cosine(a, b) -> float:
+    """Cosine similarity of two normalized vectors, sparse dicts or dense lists."""
+    if isinstance(a, dict):
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(weight * b.get(dimension, 0.0) for dimension, weight in a.items())
+    return sum(x * y for x, y in zip(a, b))
+
+class InvestigationRecorder:
+    """Collects the final diagnosis, tool calls and evidence of a team run from its message stream."""
+
+    def __init__(self, max_items: int = 20, max_chars: int = 500):
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.evidence: List[Dict[str, Any]] = []
+        self.diagnosis: Optional[str] = None
+        self.stop_reason: Optional[str] = None
+
+    def _clip(self, text: str) -> str:
+        return text if len(text) <= self.max_chars else text[:self.max_chars] + "..."
+
+    def observe(self, message: Any):
+        if isinstance(message, ToolCallRequestEvent):
+            for call in message.content:
+                if len(self.tool_calls) < self.max_items:
+                    self.tool_calls.append({"agent": message.source, "tool": call.name, "arguments": self._clip(call.arguments)})
+        elif isinstance(message, ToolCallExecutionEvent):
+            for result in message.content:
+                if len(self.evidence) < self.max_items and not result.is_error:
+                    self.evidence.append({"agent": message.source, "tool": result.name, "result": self._clip(result.content)})
+        elif isinstance(message, TaskResult):
+            self.stop_reason = message.stop_reason
+        elif isinstance(message, TextMessage) and message.source != "user":
+            self.diagnosis = message.content
+
+class InvestigationStore:
+    """
+    SQLite store of finished investigations (diagnosis, tool calls, evidence) with an in-memory similarity index.
+
+    New alerts are matched by dedup fingerprint first, then by cosine similarity of their signatures, but only
+    against investigations with the same correlation key (Kubernetes cluster/namespace/workload or entity):
+    an alert without one, or about another resource, is never answered with a stored finding.
+    Signatures are embedded with the configured Azure OpenAI embeddings deployment when there is one,
+    and always with the local hashed n-gram embedding, which is used whenever the remote one is unavailable.
+    """
+
+    def __init__(self, path: str = None, threshold: float = None, max_age: float = None, max_entries: int = None):
+        self.path = path or Config.investigation_store_path
+        self.threshold = Config.investigation_match_threshold if threshold is None else threshold
+        self.max_age = Config.investigation_cache_max_age if max_age is None else max_age
+        self.max_entries = max_entries or Config.investigation_store_max_entries
+        self.connection: Optional[sqlite3.Connection] = None
+        self.index: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._embeddings_client = None
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+
+    def _open(self):
+        # Opened on first use, then the whole index is kept in memory
+        if self.connection is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS investigations (id TEXT PRIMARY KEY, fingerprint TEXT, signature TEXT, "
+            "local_vector TEXT, remote_vector TEXT, diagnosis TEXT, tool_calls TEXT, evidence TEXT, "
+            "team_mode TEXT, created_at REAL, correlation_key TEXT)"
+        )
+        # Stores created before the correlation key was recorded
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(investigations)")}
+        if "correlation_key" not in columns:
+            self.connection.execute("ALTER TABLE investigations ADD COLUMN correlation_key TEXT")
+        self.connection.commit()
+        rows = self.connection.execute(
+            "SELECT id, fingerprint, local_vector, remote_vector, created_at, correlation_key FROM investigations "
+            "ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        self.index = [
+            {
+                "id": row[0],
+                "fingerprint": row[1],
+                "local_vector": {int(dimension): weight for dimension, weight in json.loads(row[2]).items()},
+                "remote_vector": json.loads(row[3]) if row[3] else None,
+                "created_at": row[4],
+                "correlation_key": row[5],
+            }
+            for row in rows
+        ]
+        logger.info(f"Loaded {len(self.index)} past investigations from {self.path}")
+
+    async def _remote_embedding(self, text: str) -> Optional[List[float]]:
+        if not Config.investigation_embedding_deployment:
+            return None
+        try:
+            if self._embeddings_client is None:
+                from openai import AsyncAzureOpenAI
+                if Config.environment == "dev":
+                    self._embeddings_client = AsyncAzureOpenAI(
+                        azure_endpoint=Config.aoai_endpoint, api_version=Config.aoai_version, api_key=Config.aoai_api_key
+                    )
+                else:
+                    from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+                    self._embeddings_client = AsyncAzureOpenAI(
+                        azure_endpoint=Config.aoai_endpoint, api_version=Config.aoai_version,
+                        azure_ad_token_provider=get_bearer_token_provider(DefaultAzureCredential(), Config.llm_model_scope)
+                    )
+            response = await self._embeddings_client.embeddings.create(
+                model=Config.investigation_embedding_deployment, input=text[:8000]
+            )
+            vector = response.data[0].embedding
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            return [value / norm for value in vector]
+        except Exception as e:
+            logger.warning(f"Embeddings unavailable, using the local embedding: {str(e)}")
+            return None
+
+    def _keys(self, event: str) -> Tuple[str, Optional[str]]:
+        # Dedup fingerprint and correlation key of the alert
+        try:
+            return alert_keys(json.loads(event))
+        except (TypeError, ValueError):
+            return alert_keys(event)
+
+    async def lookup(self, event: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a recent investigation of the same or a closely matching alert.
+
+        Returns:
+            dict or None: The stored finding with its similarity, how it matched and its age in seconds.
+        """
+        self._open()
+        now = time.time()
+        candidates = [entry for entry in self.index if now - entry["created_at"] <= self.max_age]
+        if not candidates:
+            self.misses += 1
+            return None
+
+        best: Tuple[float, Optional[Dict[str, Any]], str] = (0.0, None, "")
+        fingerprint, correlation_key = self._keys(event)
+        for entry in candidates:
+            if entry["fingerprint"] == fingerprint:
+                best = (1.0, entry, "fingerprint")
+                break
+        else:
+            # Similar text is only trusted for the same resource
+            same_resource = [entry for entry in candidates if correlation_key and entry["correlation_key"] == correlation_key]
+            if same_resource:
+                signature = alert_signature(event)
+                remote_vector = await self._remote_embedding(signature)
+                local_vector = local_embedding(signature)
+            for entry in same_resource:
+                if remote_vector is not None and entry["remote_vector"] is not None:
+                    similarity, method = cosine(remote_vector, entry["remote_vector"]), "embedding"
+                else:
+                    similarity, method = cosine(local_vector, entry["local_vector"]), "ngram"
+                if similarity > best[0]:
+                    best = (similarity, entry, method)
+
+        similarity, entry, method = best
+        if entry is None or similarity < self.threshold:
+            self.misses += 1
+            return None
+
+        row = self.connection.execute(
+            "SELECT diagnosis, tool_calls, evidence, team_mode FROM investigations WHERE id = ?", (entry["id"],)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            "investigation_id": entry["id"],
+            "similarity": round(similarity, 3),
+            "matched_by": method,
+            "age_seconds": round(now - entry["created_at"]),
+            "diagnosis": row[0],
+            "tool_calls": json.loads(row[1]),
+            "evidence": json.loads(row[2]),
+            "team_mode": row[3],
+        }
+
+    async def save(self, investigation_id: str, event: str, recorder: InvestigationRecorder, team_mode: str = None):
+        """Store a finished investigation. Runs without a diagnosis are not stored."""
+        if not recorder.diagnosis:
+            return
+        self._open()
+        signature = alert_signature(event)
+        local_vector = local_embedding(signature)
+        remote_vector = await self._remote_embedding(signature)
+        fingerprint, correlation_key = self._keys(event)
+        entry = {
+            "id": investigation_id,
+            "fingerprint": fingerprint,
+            "local_vector": local_vector,
+            "remote_vector": remote_vector,
+            "created_at": time.time(),
+            "correlation_key": correlation_key,
+        }
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO investigations (id, fingerprint, signature, local_vector, remote_vector, diagnosis, "
+                "tool_calls, evidence, team_mode, created_at, correlation_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entry["id"], entry["fingerprint"], signature, json.dumps(local_vector),
+                    json.dumps(remote_vector) if remote_vector is not None else None,
+                    recorder.diagnosis, json.dumps(recorder.tool_calls), json.dumps(recorder.evidence),
+                    team_mode, entry["created_at"], correlation_key
+                )
+            )
+            # Keep only the most recent investigations
+            self.connection.execute(
+                "DELETE FROM investigations WHERE id NOT IN (SELECT id FROM investigations ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self.connection.commit()
+            self.index = [item for item in self.index if item["id"] != entry["id"]]
+            self.index.insert(0, entry)
+            del self.index[self.max_entries:]
+        self.saves += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saves": self.saves,
+        }
+
+# Global instance
+investigation_store = InvestigationStore()
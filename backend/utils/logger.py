@@ -1,51 +1,153 @@
+import json
 import logging
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+import atexit
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+from utils.config import Config
+from utils.context import current_investigation_id
+
+# Shared pipeline, created by the first setup_logger call
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the current investigation id, and an agent name when none was passed in extra."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "investigation_id"):
+            record.investigation_id = current_investigation_id()
+        if not hasattr(record, "agent"):
+            record.agent = None
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of a high-volume logger's INFO and DEBUG records; warnings and errors are always kept."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "investigation_id": getattr(record, "investigation_id", None),
+            "agent": getattr(record, "agent", None),
+            "location": f"{record.filename}:{record.lineno}",
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread as they are, so message formatting and file writes happen off
+    the event loop. When the queue is full the record is dropped rather than blocking the caller.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+def _sample_rates() -> dict:
+    # LOG_SAMPLE_RATES="utils.agents.messages=0.1,other.logger=0.5"
+    rates = {}
+    for item in Config.log_sample_rates.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+def _configure() -> QueueHandler:
+    global _queue_handler, _listener
+    with _lock:
+        if _queue_handler is not None:
+            return _queue_handler
+
+        # Create logs directory if it doesn't exist
+        if not os.path.exists(Config.log_dir):
+            os.makedirs(Config.log_dir)
+
+        # File handler (rotating file handler to manage log size), JSON lines
+        file_handler = RotatingFileHandler(
+            os.path.join(Config.log_dir, 'app.log'),
+            maxBytes=10485760,  # 10MB
+            backupCount=5
+        )
+        file_handler.setFormatter(JsonFormatter())
+
+        # Console handler
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        # Loggers only enqueue; a single listener thread formats and writes
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=Config.log_queue_size))
+        _queue_handler.addFilter(ContextFilter())
+        _listener = QueueListener(_queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+        _listener.start()
+
+        # On the root logger only, so each record reaches it once and stays visible to the other handlers
+        # attached there (the /ws console stream)
+        logging.getLogger().addHandler(_queue_handler)
+        atexit.register(stop_logging)
+        return _queue_handler
+
+def stop_logging():
+    """Flush the queued records and stop the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def logging_stats() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler is not None else 0,
+        "dropped": NonBlockingQueueHandler.dropped,
+    }
 
 def setup_logger(name: str) -> logging.Logger:
     """
-    Configure and return a logger instance with both file and console handlers.
-    
+    Return a logger wired to the shared logging pipeline, which is configured on the first call.
+    Records propagate to the root logger, where they go through a queue to a listener thread that writes JSON lines to logs/app.log and text to stdout.
+    Use %-style arguments (logger.info("x: %s", value)) so messages are only built for records that are kept.
+
     Args:
         name (str): The name of the logger, typically __name__
-        
+
     Returns:
         logging.Logger: Configured logger instance
     """
-    # Create logs directory if it doesn't exist
-    log_dir = "logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
+    _configure()
+
     # Create logger
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
-    # Create formatters
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-    )
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    )
-    
-    # File handler (rotating file handler to manage log size)
-    file_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'app.log'),
-        maxBytes=10485760,  # 10MB
-        backupCount=5
-    )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(file_formatter)
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(console_formatter)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+    logger.setLevel(Config.log_level)
+
+    # Calling this again for the same name must not add the filter twice
+    rate = _sample_rates().get(name)
+    if rate is not None and rate < 1 and not any(isinstance(f, SamplingFilter) for f in logger.filters):
+        logger.addFilter(SamplingFilter(rate))
+
+    return logger
@@ -0,0 +1,492 @@
+# wrappers around the shared chat completion client: caching, request coalescing, record/replay and rate limiting
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, Literal, Mapping, Optional, Sequence, Union
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelCapabilities, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+from utils.cache import TTLCache
+from utils.config import Config
+from utils.context import current_investigation_id
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Cache modes: "off", "cache" (TTL/LRU, misses go to the model), "record" (always call the model and store
+# the result), "replay" (answer only from recordings, for deterministic offline runs)
+LLM_CACHE_MODES = ("off", "cache", "record", "replay")
+
+# Priority of the model requests made in the current context; lower is served first
+REQUEST_PRIORITIES = {"orchestrator": 0, "specialist": 1}
+request_priority_var: ContextVar[str] = ContextVar("request_priority", default="specialist")
+
+class LLMReplayMissError(RuntimeError):
+    """Raised in replay mode when a request was never recorded."""
+
+class DelegatingChatCompletionClient(ChatCompletionClient):
+    """Base for the wrappers: forwards everything to the wrapped client."""
+
+    # Key of the wrapper's counters in client_stats, None for wrappers without counters
+    stats_name: Optional[str] = None
+
+    def __init__(self, inner: ChatCompletionClient):
+        self.inner = inner
+
+    async def create(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = [],
+                     tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+                     json_output: Optional[Union[bool, type[BaseModel]]] = None,
+                     extra_create_args: Mapping[str, Any] = {},
+                     cancellation_token: Optional[CancellationToken] = None) -> CreateResult:
+        return await self.inner.create(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token
+        )
+
+    def create_stream(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = [],
+                      tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+                      json_output: Optional[Union[bool, type[BaseModel]]] = None,
+                      extra_create_args: Mapping[str, Any] = {},
+                      cancellation_token: Optional[CancellationToken] = None) -> AsyncGenerator[Union[str, CreateResult], None]:
+        return self.inner.create_stream(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token
+        )
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self.inner.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self.inner.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self.inner.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = []) -> int:
+        return self.inner.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return self.inner.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.inner.model_info
+
+def _tool_schema(tool: Union[Tool, ToolSchema]) -> Any:
+    return tool.schema if hasattr(tool, "schema") else tool
+
+def request_key(model: str, messages: Sequence[LLMMessage], tools: Sequence[Union[Tool, ToolSchema]], tool_choice: Any,
+                json_output: Any, extra_create_args: Mapping[str, Any]) -> str:
+    """Hash of everything that determines a completion: model, messages, tool schemas and create arguments."""
+    if isinstance(json_output, type):
+        json_output = json_output.model_json_schema()
+    request = {
+        "model": model,
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [_tool_schema(tool) for tool in tools],
+        "tool_choice": tool_choice if isinstance(tool_choice, str) else _tool_schema(tool_choice),
+        "json_output": json_output,
+        "extra_create_args": dict(extra_create_args),
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+class CachingChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    Caches completions by request hash and coalesces identical requests that are in flight, so the same
+    prompt (e.g. the orchestrator's initial planning for the same alert) is only paid for once.
+    Cached results come back with cached=True.
+    """
+
+    stats_name = "llm_cache"
+
+    def __init__(self, inner: ChatCompletionClient, mode: str = None, model: str = None):
+        """
+        Args:
+            inner (ChatCompletionClient): The client to wrap.
+            mode (str, optional): One of LLM_CACHE_MODES. Defaults to Config.llm_cache_mode.
+            model (str, optional): Model name included in the cache key. Defaults to the configured deployment.
+        """
+        super().__init__(inner)
+        self.mode = mode or Config.llm_cache_mode
+        if self.mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode '{self.mode}', expected one of: {', '.join(LLM_CACHE_MODES)}")
+        self.model = model or f"{Config.aoai_deployment}/{Config.aoai_model}"
+        if self.mode in ("record", "replay"):
+            # Recordings are never expired or evicted
+            self.cache = TTLCache(backend="disk", ttl=10 * 365 * 86400, max_entries=2 ** 31,
+                                  path=Config.llm_record_path, table="llm_recordings")
+        else:
+            self.cache = TTLCache(backend=Config.llm_cache_backend, ttl=Config.llm_cache_ttl,
+                                  max_entries=Config.llm_cache_max_entries, path=Config.llm_cache_path, table="llm_cache")
+        # request key -> {"task": the shared call, "waiters": callers still waiting for it}
+        self.inflight: Dict[str, Dict[str, Any]] = {}
+        self.coalesced = 0
+
+    def _lookup(self, key: str) -> Optional[CreateResult]:
+        if self.mode == "record":
+            return None
+        value = self.cache.get(key)
+        if value is None:
+            if self.mode == "replay":
+                raise LLMReplayMissError(f"No recorded completion for request {key[:12]}")
+            return None
+        result = CreateResult.model_validate_json(value)
+        result.cached = True
+        return result
+
+    async def create(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = [],
+                     tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+                     json_output: Optional[Union[bool, type[BaseModel]]] = None,
+                     extra_create_args: Mapping[str, Any] = {},
+                     cancellation_token: Optional[CancellationToken] = None) -> CreateResult:
+        key = request_key(self.model, messages, tools, tool_choice, json_output, extra_create_args)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        # The call runs in its own task shared by every caller of the same request, so cancelling one
+        # caller (e.g. a cancelled investigation) does not cancel the others; it is only cancelled when
+        # no caller is left waiting for it
+        shared = self.inflight.get(key)
+        leader = shared is None
+        if leader:
+            task = asyncio.create_task(self._shared_create(key, messages, tools, tool_choice, json_output, extra_create_args))
+            shared = self.inflight[key] = {"task": task, "waiters": 0}
+        else:
+            self.coalesced += 1
+        shared["waiters"] += 1
+
+        waiter = asyncio.shield(shared["task"])
+        if cancellation_token is not None:
+            cancellation_token.link_future(waiter)
+        try:
+            result = await waiter
+        except asyncio.CancelledError:
+            if not shared["task"].done():
+                shared["waiters"] -= 1
+                if shared["waiters"] == 0:
+                    # Nobody may join a call that is being cancelled
+                    if self.inflight.get(key) is shared:
+                        del self.inflight[key]
+                    shared["task"].cancel()
+            raise
+        return result if leader else result.model_copy(update={"cached": True})
+
+    async def _shared_create(self, key: str, messages: Sequence[LLMMessage], tools: Sequence[Union[Tool, ToolSchema]],
+                             tool_choice: Any, json_output: Any, extra_create_args: Mapping[str, Any]) -> CreateResult:
+        try:
+            result = await self.inner.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output, extra_create_args=extra_create_args
+            )
+            self.cache.set(key, result.model_dump_json())
+            return result
+        finally:
+            if self.inflight.get(key, {}).get("task") is asyncio.current_task():
+                del self.inflight[key]
+
+    async def create_stream(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = [],
+                            tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+                            json_output: Optional[Union[bool, type[BaseModel]]] = None,
+                            extra_create_args: Mapping[str, Any] = {},
+                            cancellation_token: Optional[CancellationToken] = None) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key = request_key(self.model, messages, tools, tool_choice, json_output, extra_create_args)
+        cached = self._lookup(key)
+        if cached is not None:
+            # A cached answer arrives in one piece
+            if isinstance(cached.content, str):
+                yield cached.content
+            yield cached
+            return
+
+        async for item in self.inner.create_stream(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token
+        ):
+            if isinstance(item, CreateResult):
+                self.cache.set(key, item.model_dump_json())
+            yield item
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "coalesced": self.coalesced, "inflight": len(self.inflight), **self.cache.stats()}
+
+class PriorityChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    A view of the shared client that tags its requests with a priority for the rate limiter,
+    so the orchestrator and the specialists can use the same client with different priorities.
+    """
+
+    def __init__(self, inner: ChatCompletionClient, priority: str):
+        super().__init__(inner)
+        if priority not in REQUEST_PRIORITIES:
+            raise ValueError(f"Unknown request priority '{priority}', expected one of: {', '.join(REQUEST_PRIORITIES)}")
+        self.priority = priority
+
+    async def create(self, messages: Sequence[LLMMessage], **kwargs) -> CreateResult:
+        context_token = request_priority_var.set(self.priority)
+        try:
+            return await self.inner.create(messages, **kwargs)
+        finally:
+            request_priority_var.reset(context_token)
+
+    async def create_stream(self, messages: Sequence[LLMMessage], **kwargs) -> AsyncGenerator[Union[str, CreateResult], None]:
+        context_token = request_priority_var.set(self.priority)
+        try:
+            async for item in self.inner.create_stream(messages, **kwargs):
+                yield item
+        finally:
+            request_priority_var.reset(context_token)
+
+    async def close(self) -> None:
+        # The shared client is closed by its owner
+        pass
+
+def with_priority(client: ChatCompletionClient, priority: str) -> ChatCompletionClient:
+    return PriorityChatCompletionClient(client, priority)
+
+class TokenBucket:
+    """Per-minute quota refilled continuously, starting full."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available, 0 if it is available now."""
+        self.refill()
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing * 60 / self.capacity)
+
+class RateLimitedChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    Keeps requests within the deployment's requests-per-minute and tokens-per-minute quotas instead of
+    letting bursts hit 429s and retries.
+
+    Each request reserves its prompt tokens (counted before sending) plus an estimate of the completion,
+    and the reservation is corrected with the actual usage once the answer arrives. Requests that have to
+    wait are queued by priority (orchestrator before specialists) and served round-robin across
+    investigations within a priority, so one busy investigation cannot starve the others.
+    """
+
+    stats_name = "rate_limit"
+
+    def __init__(self, inner: ChatCompletionClient, tpm: int = None, rpm: int = None, completion_tokens: int = None):
+        """
+        Args:
+            inner (ChatCompletionClient): The client to wrap.
+            tpm (int, optional): Tokens per minute, 0 for no limit. Defaults to Config.llm_rate_limit_tpm.
+            rpm (int, optional): Requests per minute, 0 for no limit. Defaults to Config.llm_rate_limit_rpm.
+            completion_tokens (int, optional): Tokens reserved for each completion until its usage is known.
+                Defaults to Config.llm_completion_tokens_estimate.
+        """
+        super().__init__(inner)
+        self.tpm = Config.llm_rate_limit_tpm if tpm is None else tpm
+        self.rpm = Config.llm_rate_limit_rpm if rpm is None else rpm
+        self.completion_tokens = Config.llm_completion_tokens_estimate if completion_tokens is None else completion_tokens
+        self.token_bucket = TokenBucket(self.tpm) if self.tpm else None
+        self.request_bucket = TokenBucket(self.rpm) if self.rpm else None
+        # priority -> investigation id -> waiting (future, tokens) pairs
+        self.waiters: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        # (time, tokens) of the requests sent in the last minute
+        self.recent: deque = deque()
+        self.requests = 0
+        self.queued = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _estimate(self, messages: Sequence[LLMMessage], tools: Sequence[Union[Tool, ToolSchema]]) -> int:
+        try:
+            prompt_tokens = self.inner.count_tokens(messages, tools=tools)
+        except Exception:
+            # Roughly four characters per token
+            prompt_tokens = len(json.dumps([message.model_dump(mode="json") for message in messages], default=str)) // 4
+        return prompt_tokens + self.completion_tokens
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        return wait
+
+    def _take(self, tokens: int):
+        if self.token_bucket is not None:
+            self.token_bucket.available -= min(tokens, self.token_bucket.capacity)
+        if self.request_bucket is not None:
+            self.request_bucket.available -= 1
+
+    def _dispatch(self):
+        # Grant queued requests in order while the quota allows; otherwise wake up when it will
+        self._wakeup = None
+        while self.waiters:
+            priority = min(self.waiters)
+            investigations = self.waiters[priority]
+            investigation_id, queue = next(iter(investigations.items()))
+            future, tokens = queue[0]
+            if future.done():
+                # Cancelled while waiting
+                queue.popleft()
+            else:
+                wait = self._wait_time(tokens)
+                if wait > 0:
+                    self._wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                    return
+                queue.popleft()
+                self._take(tokens)
+                future.set_result(None)
+                # Next turn goes to the next investigation
+                investigations.move_to_end(investigation_id)
+            if not queue:
+                del investigations[investigation_id]
+            if not investigations:
+                del self.waiters[priority]
+
+    async def _acquire(self, tokens: int):
+        started = time.monotonic()
+        if not self.waiters and self._wait_time(tokens) == 0:
+            self._take(tokens)
+        else:
+            self.queued += 1
+            future = asyncio.get_running_loop().create_future()
+            priority = REQUEST_PRIORITIES[request_priority_var.get()]
+            investigations = self.waiters.setdefault(priority, OrderedDict())
+            investigations.setdefault(current_investigation_id() or "", deque()).append((future, tokens))
+            if self._wakeup is None:
+                self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just before the cancellation: give the quota back
+                    self._release(tokens, 0)
+                raise
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _release(self, reserved: int, used: int):
+        # Correct the reservation with the actual usage
+        if self.token_bucket is not None:
+            self.token_bucket.available = min(self.token_bucket.capacity, self.token_bucket.available + reserved - used)
+        if self._wakeup is None and self.waiters:
+            self._dispatch()
+
+    def _record(self, tokens: int):
+        now = time.monotonic()
+        self.requests += 1
+        self.recent.append((now, tokens))
+        while self.recent and now - self.recent[0][0] > 60:
+            self.recent.popleft()
+
+    def _throttled(self, error: BaseException):
+        # The service disagrees with our count: stop sending until the quota refills
+        if getattr(error, "status_code", None) == 429:
+            self.throttled += 1
+            if self.token_bucket is not None:
+                self.token_bucket.refill()
+                self.token_bucket.available = min(self.token_bucket.available, 0)
+            logger.warning("Model deployment answered 429, holding queued requests until the quota refills")
+
+    async def create(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = [],
+                     tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+                     json_output: Optional[Union[bool, type[BaseModel]]] = None,
+                     extra_create_args: Mapping[str, Any] = {},
+                     cancellation_token: Optional[CancellationToken] = None) -> CreateResult:
+        tokens = self._estimate(messages, tools)
+        await self._acquire(tokens)
+        used = tokens
+        try:
+            result = await self.inner.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token
+            )
+            used = result.usage.prompt_tokens + result.usage.completion_tokens
+            return result
+        except BaseException as e:
+            self._throttled(e)
+            raise
+        finally:
+            self._record(used)
+            self._release(tokens, used)
+
+    async def create_stream(self, messages: Sequence[LLMMessage], *, tools: Sequence[Union[Tool, ToolSchema]] = [],
+                            tool_choice: Union[Tool, Literal["auto", "required", "none"]] = "auto",
+                            json_output: Optional[Union[bool, type[BaseModel]]] = None,
+                            extra_create_args: Mapping[str, Any] = {},
+                            cancellation_token: Optional[CancellationToken] = None) -> AsyncGenerator[Union[str, CreateResult], None]:
+        tokens = self._estimate(messages, tools)
+        await self._acquire(tokens)
+        used = tokens
+        try:
+            async for item in self.inner.create_stream(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token
+            ):
+                if isinstance(item, CreateResult):
+                    used = item.usage.prompt_tokens + item.usage.completion_tokens
+                yield item
+        except BaseException as e:
+            self._throttled(e)
+            raise
+        finally:
+            self._record(used)
+            self._release(tokens, used)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        recent = [tokens for timestamp, tokens in self.recent if now - timestamp <= 60]
+        waiting = {
+            name: sum(len(queue) for queue in self.waiters.get(priority, {}).values())
+            for name, priority in REQUEST_PRIORITIES.items()
+        }
+        return {
+            "tpm_limit": self.tpm,
+            "rpm_limit": self.rpm,
+            "tokens_last_minute": sum(recent),
+            "requests_last_minute": len(recent),
+            "tpm_utilization": round(sum(recent) / self.tpm, 3) if self.tpm else None,
+            "rpm_utilization": round(len(recent) / self.rpm, 3) if self.rpm else None,
+            "waiting": waiting,
+            "requests": self.requests,
+            "queued": self.queued,
+            "throttled": self.throttled,
+            "avg_wait_seconds": round(self.total_wait / self.requests, 3) if self.requests else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+        }
+
+def client_stats(client: ChatCompletionClient) -> Dict[str, Any]:
+    """Counters of every wrapper around a client, keyed by stats_name."""
+    stats = {}
+    while isinstance(client, DelegatingChatCompletionClient):
+        if client.stats_name is not None:
+            stats[client.stats_name] = client.stats()
+        client = client.inner
+    return stats
+
+def wrap_model_client(client: ChatCompletionClient) -> ChatCompletionClient:
+    """
+    Wraps the model client with the configured layers: the rate limiter next to the model,
+    then the cache, so cached answers do not use quota.
+    """
+    if Config.llm_rate_limit_tpm or Config.llm_rate_limit_rpm:
+        client = RateLimitedChatCompletionClient(client)
+    if Config.llm_cache_mode != "off":
+        client = CachingChatCompletionClient(client)
+    return client
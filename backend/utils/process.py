@@ -0,0 +1,34 @@
+# cleanup of the CLI processes (az, kubectl) the backend starts in their own process group
+import asyncio
+import os
+import signal
+from typing import Tuple
+
+def kill_process_group(process: asyncio.subprocess.Process):
+    """
+    Kill a process and its children. The process must have been started with start_new_session=True,
+    so it leads its own group.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def reap(process: asyncio.subprocess.Process):
+    """Wait for a killed process to exit, so it leaves no zombie or open transport, even if the caller is cancelled."""
+    try:
+        await asyncio.shield(process.wait())
+    except asyncio.CancelledError:
+        pass
+
+async def communicate(process: asyncio.subprocess.Process, timeout: float) -> Tuple[bytes, bytes]:
+    """
+    process.communicate() with a timeout. On timeout or cancellation the process group is killed and
+    reaped before the error is raised.
+    """
+    try:
+        return await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        kill_process_group(process)
+        await reap(process)
+        raise
@@ -1,10 +1,13 @@
 # a file that will get a prompt from a file and return it as a string
 import os
 import json
+from functools import lru_cache
 
+@lru_cache(maxsize=None)
 def get_prompt(prompt_name: str) -> str:
     """
     Get a prompt from a file and return it as a string.
+    Prompts are read from disk once per process and cached afterwards.
     :param
         prompt_name: The name of the prompt file (without extension).
     :return: The prompt as a string.
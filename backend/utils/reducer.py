@@ -0,0 +1,204 @@
+# reduce tool outputs (log records, query rows) before they are handed to the agents
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from utils.config import Config
+
+# Fields that usually hold the log line itself, in order of preference
+MESSAGE_FIELDS = ("content", "message", "Message", "msg", "log", "LogMessage", "LogEntry", "ResultDescription", "Description")
+
+# Words that make a record more relevant for an investigation
+RELEVANCE_KEYWORDS = {
+    "fatal": 5, "panic": 5, "oomkilled": 5, "crashloopbackoff": 5, "exception": 4, "error": 4,
+    "failed": 3, "failure": 3, "fail": 3, "timeout": 3, "timed out": 3, "refused": 3, "denied": 3,
+    "unhealthy": 3, "backoff": 3, "killed": 3, "evicted": 3, "critical": 3, "warn": 1, "warning": 1,
+}
+
+# Variable parts of a log line, replaced by placeholders to build its template
+TEMPLATE_PATTERNS = [
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<ts>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<ip>"),
+    (re.compile(r"\b([a-z0-9][a-z0-9-]*)-[a-f0-9]{6,10}-[a-z0-9]{5}\b"), r"\1-<pod>"),
+    (re.compile(r"\b(?:0x)?(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b"), "<hex>"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "<num>"),
+]
+
+def estimate_tokens(value: Any) -> int:
+    """
+    Estimate how many tokens a value takes once serialized, at roughly 4 characters per token.
+    """
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return (len(text) + 3) // 4
+
+def log_template(text: str) -> str:
+    """Replace timestamps, ids, addresses and numbers in a log line with placeholders."""
+    for pattern, placeholder in TEMPLATE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+def _message(record: Dict[str, Any]) -> Optional[str]:
+    for field in MESSAGE_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+def _is_log_record(record: Any) -> bool:
+    # Log lines, or records that carry one in a message field; anything else is a structured row
+    return isinstance(record, str) or (isinstance(record, dict) and _message(record) is not None)
+
+def _template_key(record: Any) -> str:
+    """
+    Grouping key of a record: the masked template for log lines, the exact serialized row for structured
+    rows, whose column values (counts, metrics, names) must never be merged away.
+    """
+    if isinstance(record, str):
+        return log_template(record)
+    if isinstance(record, dict):
+        message = _message(record)
+        if message is not None:
+            return log_template(message)
+    return json.dumps(record, sort_keys=True, default=str)
+
+def _sample(items: List[Any], size: int) -> List[Any]:
+    # Evenly spaced items, first and last included, so a time series keeps its shape
+    if size >= len(items):
+        return list(items)
+    if size <= 1:
+        return items[:size]
+    return [items[round(position * (len(items) - 1) / (size - 1))] for position in range(size)]
+
+def _relevance(template: str, count: int) -> float:
+    lowered = template.lower()
+    score = sum(weight for keyword, weight in RELEVANCE_KEYWORDS.items() if keyword in lowered)
+    # Frequent lines matter a bit more, without letting a noisy line dominate
+    return score + min(count, 100) ** 0.5 / 10
+
+class ToolOutputReducer:
+    """
+    Shrinks a list of records to fit a token budget before it reaches the model context.
+
+    Records that already fit the budget are returned unchanged. Otherwise log lines are grouped by template
+    (the line with timestamps, ids and numbers masked) so repeated lines are kept once with a count, long
+    fields are truncated, and when the result is still too large the least relevant lines (no error keywords,
+    rare) are dropped first. Structured rows (query results without a message field) keep their values:
+    only identical rows are merged, long fields are truncated and an evenly spaced sample is kept.
+    """
+
+    def __init__(self, token_budget: int = None, top_n: int = None, max_field_chars: int = None):
+        self.token_budget = token_budget or Config.tool_output_token_budget
+        self.top_n = top_n or Config.tool_output_top_n
+        self.max_field_chars = max_field_chars or Config.tool_output_max_field_chars
+
+    def _truncate(self, record: Any, max_chars: int) -> Tuple[Any, int]:
+        if isinstance(record, str):
+            if len(record) > max_chars:
+                return record[:max_chars] + f"... [{len(record) - max_chars} chars truncated]", 1
+            return record, 0
+        if isinstance(record, dict):
+            truncated = 0
+            result = {}
+            for key, value in record.items():
+                result[key], count = self._truncate(value, max_chars)
+                truncated += count
+            return result, truncated
+        if isinstance(record, list):
+            truncated = 0
+            result = []
+            for value in record:
+                value, count = self._truncate(value, max_chars)
+                result.append(value)
+                truncated += count
+            return result, truncated
+        return record, 0
+
+    def reduce(self, records: List[Any]) -> Tuple[List[Any], Dict[str, Any]]:
+        """
+        Reduce a list of records.
+
+        Args:
+            records (list): Log records or query rows, usually dicts.
+
+        Returns:
+            tuple: (reduced records, report) where the report says how much was merged, truncated and dropped.
+        """
+        tokens_before = estimate_tokens(records)
+        if tokens_before <= self.token_budget:
+            return list(records), {
+                "input_rows": len(records),
+                "output_rows": len(records),
+                "duplicate_rows_merged": 0,
+                "rows_dropped": 0,
+                "fields_truncated": 0,
+                "estimated_tokens_before": tokens_before,
+                "estimated_tokens_after": tokens_before,
+                "token_budget": self.token_budget,
+            }
+        structured = not any(_is_log_record(record) for record in records)
+
+        # Group repeated lines by template, keeping the first occurrence as the example
+        groups: Dict[str, Dict[str, Any]] = {}
+        for index, record in enumerate(records):
+            key = _template_key(record)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = {"index": index, "record": record, "count": 1, "template": key}
+            else:
+                group["count"] += 1
+
+        # Truncate long fields
+        fields_truncated = 0
+        reduced = []
+        for group in groups.values():
+            record, truncated = self._truncate(group["record"], self.max_field_chars)
+            fields_truncated += truncated
+            if group["count"] > 1:
+                if not isinstance(record, dict):
+                    record = {"value": record, "_count": group["count"]}
+                elif structured:
+                    record = {**record, "_count": group["count"]}
+                else:
+                    record = {**record, "_count": group["count"], "_template": group["template"][:self.max_field_chars]}
+            reduced.append((group["index"], _relevance(group["template"], group["count"]), record))
+
+        if structured:
+            # Rows in their original order, evenly sampled within the row cap and the token budget
+            size = min(len(reduced), self.top_n)
+            ranked = _sample(reduced, size)
+            while size > 1 and estimate_tokens([item[2] for item in ranked]) > self.token_budget:
+                size -= max(1, size // 10)
+                ranked = _sample(reduced, size)
+        else:
+            # Keep the most relevant records, within the row cap and the token budget
+            ranked = sorted(reduced, key=lambda item: (-item[1], item[0]))[:self.top_n]
+            while len(ranked) > 1 and estimate_tokens([item[2] for item in ranked]) > self.token_budget:
+                ranked.pop()
+
+        # A single record may still be over budget: truncate it harder
+        if len(ranked) == 1 and estimate_tokens(ranked[0][2]) > self.token_budget:
+            index, score, record = ranked[0]
+            record, truncated = self._truncate(record, max(self.token_budget * 2, 200))
+            fields_truncated += truncated
+            ranked = [(index, score, record)]
+
+        # Present the kept records in their original order
+        kept = [item[2] for item in sorted(ranked, key=lambda item: item[0])]
+        report = {
+            "input_rows": len(records),
+            "output_rows": len(kept),
+            "duplicate_rows_merged": len(records) - len(groups),
+            "rows_dropped": len(groups) - len(kept),
+            "fields_truncated": fields_truncated,
+            "sampled": structured and len(kept) < len(groups),
+            "estimated_tokens_before": tokens_before,
+            "estimated_tokens_after": estimate_tokens(kept),
+            "token_budget": self.token_budget,
+        }
+        return kept, report
+
+def reduce_records(records: List[Any], token_budget: int = None) -> Tuple[List[Any], Dict[str, Any]]:
+    """
+    Reduce tool output records with the configured limits. See ToolOutputReducer.
+    """
+    return ToolOutputReducer(token_budget=token_budget).reduce(records)
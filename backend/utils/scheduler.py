@@ -0,0 +1,258 @@
+# a bounded, priority-aware work queue used to run alert investigations in the background
+import asyncio
+import itertools
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+from utils.config import Config
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Lower numbers are processed first
+DEFAULT_PRIORITY = 3
+
+# Dynatrace problem severities
+DYNATRACE_SEVERITY_PRIORITY = {
+    "AVAILABILITY": 0,
+    "ERROR": 1,
+    "MONITORING_UNAVAILABLE": 1,
+    "PERFORMANCE": 2,
+    "RESOURCE_CONTENTION": 2,
+    "CUSTOM_ALERT": 3,
+    "INFO": 4,
+}
+
+class AlertQueueFullError(Exception):
+    """Exception raised when the alert queue has no room for a new alert"""
+    pass
+
+class SchedulerUnavailableError(Exception):
+    """Exception raised when the scheduler is not accepting new alerts"""
+    pass
+
+def get_alert_priority(payload: Any) -> int:
+    """
+    Get the scheduling priority of an alert from its severity.
+    Supports Dynatrace problem payloads and the Azure Monitor common alert schema.
+
+    Args:
+        payload (Any): The alert payload as received by the /alert route.
+
+    Returns:
+        int: The priority, from 0 (most urgent) to 4.
+    """
+    if not isinstance(payload, dict):
+        return DEFAULT_PRIORITY
+
+    # Azure Monitor common alert schema: data.essentials.severity = "Sev0".."Sev4"
+    essentials = payload.get("data", {}).get("essentials", {}) if isinstance(payload.get("data"), dict) else {}
+    severity = essentials.get("severity") or payload.get("severity")
+    if isinstance(severity, str) and severity.lower().startswith("sev") and severity[3:].isdigit():
+        return min(int(severity[3:]), 4)
+
+    # Dynatrace problem payloads
+    for key in ("severityLevel", "ProblemSeverity", "severity"):
+        value = payload.get(key)
+        if isinstance(value, str) and value.upper() in DYNATRACE_SEVERITY_PRIORITY:
+            return DYNATRACE_SEVERITY_PRIORITY[value.upper()]
+
+    return DEFAULT_PRIORITY
+
+@dataclass(order=True)
+class AlertJob:
+    """An alert waiting in the queue. Jobs are ordered by priority, then by arrival."""
+    priority: int
+    sequence: int
+    alert_id: str = field(compare=False)
+    event: str = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    team_mode: Optional[str] = field(compare=False, default=None)
+    use_cache: bool = field(compare=False, default=True)
+
+class AlertScheduler:
+    """
+    Runs alert investigations on a fixed pool of workers fed by a bounded priority queue.
+    When the queue is full new alerts are rejected instead of piling up, so a burst of alerts
+    cannot launch an unbounded number of concurrent agent teams.
+    """
+
+    def __init__(self, max_queue_size: int = None, workers: int = None):
+        self.max_queue_size = max_queue_size or Config.alert_queue_size
+        self.workers = workers or Config.alert_workers
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.handler: Optional[Callable[[AlertJob], Awaitable[Any]]] = None
+        self.worker_tasks = set()
+        self.running = set()
+        # Slots held for alerts that were accepted but are not queued yet (see reserve)
+        self.reserved = 0
+        self.accepting = False
+        self.sequence = itertools.count()
+
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=100)
+        self.run_times = deque(maxlen=100)
+
+    def start(self, handler: Callable[[AlertJob], Awaitable[Any]]):
+        """
+        Start the worker pool.
+
+        Args:
+            handler (callable): Coroutine function called with each AlertJob taken from the queue.
+        """
+        if self.accepting:
+            return
+
+        self.handler = handler
+        self.queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+        for index in range(self.workers):
+            task = asyncio.create_task(self._worker(index))
+            self.worker_tasks.add(task)
+        self.accepting = True
+        logger.info(f"Alert scheduler started with {self.workers} workers and queue size {self.max_queue_size}")
+
+    def submit(self, event: str, priority: int = DEFAULT_PRIORITY, alert_id: str = None, team_mode: str = None,
+               use_cache: bool = True, reserved: bool = False) -> AlertJob:
+        """
+        Add an alert to the queue.
+
+        Args:
+            event (str): The task to be performed by the agents.
+            priority (int): The scheduling priority, lower is more urgent.
+            alert_id (str, optional): Identifier of the alert. Generated when not provided.
+            team_mode (str, optional): Agent team that runs the investigation. Defaults to Config.team_mode.
+            use_cache (bool): Whether the investigation may be answered from a stored one.
+            reserved (bool): The alert takes the slot held for it by an earlier reserve() call.
+
+        Returns:
+            AlertJob: The queued job.
+
+        Raises:
+            SchedulerUnavailableError: If the scheduler is not running.
+            AlertQueueFullError: If the queue is full.
+        """
+        if reserved:
+            # The slot is given back whether or not the alert gets queued
+            self.reserved = max(self.reserved - 1, 0)
+        if not self.accepting:
+            raise SchedulerUnavailableError("Alert scheduler is not accepting new alerts")
+        if not reserved and self.is_full():
+            self.rejected += 1
+            logger.warning(f"Alert queue full ({self.max_queue_size}), rejecting alert {alert_id}")
+            raise AlertQueueFullError(f"Alert queue is full ({self.max_queue_size} alerts waiting)")
+
+        job = AlertJob(
+            priority=priority,
+            sequence=next(self.sequence),
+            alert_id=alert_id or uuid.uuid4().hex,
+            event=event,
+            team_mode=team_mode,
+            use_cache=use_cache
+        )
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Alert queue full ({self.max_queue_size}), rejecting alert {job.alert_id}")
+            raise AlertQueueFullError(f"Alert queue is full ({self.max_queue_size} alerts waiting)")
+
+        self.submitted += 1
+        logger.info(f"Queued alert {job.alert_id} with priority {priority} (queue depth {self.queue.qsize()})")
+        return job
+
+    def is_full(self) -> bool:
+        """Return True when a new alert would be rejected."""
+        return self.queue is not None and self.queue.qsize() + self.reserved >= self.max_queue_size
+
+    def reserve(self):
+        """
+        Hold a queue slot for an alert that is accepted now and submitted later with reserved=True,
+        so it cannot be rejected once the client has been answered.
+
+        Raises:
+            SchedulerUnavailableError: If the scheduler is not running.
+            AlertQueueFullError: If the queue and the slots already held leave no room.
+        """
+        if not self.accepting:
+            raise SchedulerUnavailableError("Alert scheduler is not accepting new alerts")
+        if self.is_full():
+            self.rejected += 1
+            logger.warning(f"Alert queue full ({self.max_queue_size}), rejecting new alert")
+            raise AlertQueueFullError(f"Alert queue is full ({self.max_queue_size} alerts waiting)")
+        self.reserved += 1
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self.queue.get()
+            wait_time = time.monotonic() - job.enqueued_at
+            self.wait_times.append(wait_time)
+            logger.info(f"Worker {index} picked alert {job.alert_id} after waiting {wait_time:.2f}s")
+
+            self.running.add(job.alert_id)
+            started_at = time.monotonic()
+            try:
+                await self.handler(job)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Alert {job.alert_id} failed: {str(e)}", exc_info=True)
+            finally:
+                self.run_times.append(time.monotonic() - started_at)
+                self.running.discard(job.alert_id)
+                self.queue.task_done()
+
+    async def stop(self, drain: bool = True):
+        """
+        Stop accepting alerts and shut the worker pool down.
+
+        Args:
+            drain (bool): Wait for the queued and running alerts to finish before stopping the workers.
+        """
+        self.accepting = False
+        if self.queue is not None and drain:
+            await self.queue.join()
+
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks.clear()
+        logger.info("Alert scheduler stopped")
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait before retrying."""
+        return Config.alert_retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, throughput and wait time metrics."""
+        waits = list(self.wait_times)
+        runs = list(self.run_times)
+        return {
+            "accepting": self.accepting,
+            "workers": self.workers,
+            "capacity": self.max_queue_size,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "reserved": self.reserved,
+            "running": len(self.running),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_time_seconds": {
+                "last": round(waits[-1], 3) if waits else 0.0,
+                "avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max": round(max(waits), 3) if waits else 0.0,
+            },
+            "run_time_seconds": {
+                "avg": round(sum(runs) / len(runs), 3) if runs else 0.0,
+                "max": round(max(runs), 3) if runs else 0.0,
+            },
+        }
@@ -0,0 +1,155 @@
+# stream a team run over HTTP as Server-Sent Events or NDJSON
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+from autogen_agentchat.base import TaskResult
+from utils.config import Config
+from utils.context import investigation_id_var
+from utils.tracing import TurnTracer, tracer
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Supported stream formats and their media types
+STREAM_FORMATS = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+def resolve_stream_format(requested: Optional[str], accept: Optional[str] = None) -> Optional[str]:
+    """
+    Returns "sse", "ndjson" or None (no streaming) from the request body option or the Accept header.
+
+    Raises:
+        ValueError: If an unknown format is requested.
+    """
+    if requested:
+        requested = str(requested).lower()
+        if requested in ("true", "1"):
+            return "ndjson"
+        if requested not in STREAM_FORMATS:
+            raise ValueError(f"Unknown stream format '{requested}', expected one of: {', '.join(STREAM_FORMATS)}")
+        return requested
+    for stream_format, media_type in STREAM_FORMATS.items():
+        if accept and media_type in accept:
+            return stream_format
+    return None
+
+def message_text(message: Any) -> str:
+    if hasattr(message, "to_text"):
+        return message.to_text()
+    return str(getattr(message, "content", message))
+
+def task_summary(result: Optional[TaskResult], max_chars: int = None) -> Dict[str, Any]:
+    """
+    A compact summary of a team run: the final answer and counts, instead of the whole history.
+    """
+    max_chars = max_chars or Config.run_task_summary_max_chars
+    if result is None:
+        return {"stop_reason": None, "messages": 0, "final_message": None}
+
+    final = next((message for message in reversed(result.messages) if getattr(message, "source", "user") != "user"), None)
+    text = message_text(final) if final is not None else None
+    if text is not None and len(text) > max_chars:
+        text = text[:max_chars] + f"... [{len(text) - max_chars} chars truncated]"
+
+    prompt_tokens = completion_tokens = 0
+    for message in result.messages:
+        usage = getattr(message, "models_usage", None)
+        if usage is not None:
+            prompt_tokens += usage.prompt_tokens
+            completion_tokens += usage.completion_tokens
+
+    return {
+        "stop_reason": result.stop_reason,
+        "messages": len(result.messages),
+        "final_source": getattr(final, "source", None),
+        "final_message": text,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+
+def _encode(stream_format: str, event: Dict[str, Any]) -> str:
+    data = json.dumps(event, default=str)
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+async def stream_team_run(agents, event: str, investigation_id: str, stream_format: str,
+                          heartbeat_interval: float = None) -> AsyncIterator[str]:
+    """
+    Runs the team and yields each agent message as it is produced, heartbeats while nothing is
+    produced, and a compact summary at the end.
+
+    Args:
+        agents (Agents): A fresh team.
+        event (str): The task to be performed by the agents.
+        investigation_id (str): Tags the run's output, as for /ws investigations.
+        stream_format (str): "sse" or "ndjson".
+        heartbeat_interval (float, optional): Seconds of silence before a heartbeat is sent.
+    """
+    heartbeat_interval = heartbeat_interval or Config.run_task_heartbeat_interval
+    queue: asyncio.Queue = asyncio.Queue()
+    started = time.monotonic()
+
+    async def produce():
+        context_token = investigation_id_var.set(investigation_id)
+        try:
+            with tracer.span("investigation", "investigation", team_mode=agents.team_mode, stream=stream_format):
+                turns = TurnTracer()
+                async for item in agents.team.run_stream(task=event):
+                    turns.observe(item)
+                    await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            investigation_id_var.reset(context_token)
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    result = None
+    sequence = 0
+    try:
+        yield _encode(stream_format, {"type": "start", "investigation_id": investigation_id, "team_mode": agents.team_mode})
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=heartbeat_interval)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield _encode(stream_format, {"type": "heartbeat", "elapsed_seconds": round(time.monotonic() - started, 1)})
+                continue
+
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                logger.error(f"Error in streamed run_task {investigation_id}: {str(item)}")
+                yield _encode(stream_format, {"type": "error", "investigation_id": investigation_id, "detail": str(item)})
+                continue
+            if isinstance(item, TaskResult):
+                result = item
+                continue
+
+            sequence += 1
+            yield _encode(stream_format, {
+                "type": "message",
+                "seq": sequence,
+                "message_type": type(item).__name__,
+                "source": getattr(item, "source", None),
+                "content": message_text(item),
+            })
+
+        yield _encode(stream_format, {
+            "type": "result",
+            "investigation_id": investigation_id,
+            "team_mode": agents.team_mode,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            **task_summary(result),
+        })
+    finally:
+        # The client went away: stop the agents instead of running the task for nobody
+        if not producer.done():
+            logger.info(f"Streamed run_task {investigation_id} closed by the client, cancelling")
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
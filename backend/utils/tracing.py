@@ -0,0 +1,281 @@
+# lightweight OpenTelemetry-style spans for investigations, kept in process and served as a waterfall
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from utils.config import Config
+from utils.context import current_investigation_id
+from utils.modelclient import DelegatingChatCompletionClient
+from utils.logger import setup_logger
+
+# Set up logging
+logger = setup_logger(__name__)
+
+# Span kinds, used to total the waterfall
+SPAN_KINDS = ("investigation", "turn", "model", "tool")
+
+current_span_var: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+class Span:
+    """One timed step of an investigation; the trace id is the investigation id."""
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: Optional[str] = None,
+                 start: float = None, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attributes(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(((self.end or time.time()) - self.start) * 1000, 1),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+class InMemorySpanExporter:
+    """Keeps the finished spans of the most recent investigations."""
+
+    def __init__(self, max_traces: int = None, max_spans: int = None):
+        self.max_traces = max_traces or Config.trace_max_investigations
+        self.max_spans = max_spans or Config.trace_max_spans
+        self.traces: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, span: Span):
+        with self._lock:
+            spans = self.traces.get(span.trace_id)
+            if spans is None:
+                spans = self.traces[span.trace_id] = []
+                while len(self.traces) > self.max_traces:
+                    self.traces.popitem(last=False)
+            if len(spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            spans.append(span)
+            self.exported += 1
+
+    def spans(self, trace_id: str) -> Optional[List[Span]]:
+        with self._lock:
+            spans = self.traces.get(trace_id)
+            return list(spans) if spans is not None else None
+
+class Tracer:
+    """
+    Creates spans for the current investigation and hands finished ones to the exporter.
+    Spans started outside an investigation are not recorded.
+    """
+
+    def __init__(self, exporter: InMemorySpanExporter = None):
+        self.exporter = exporter or InMemorySpanExporter()
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes) -> Iterator[Optional[Span]]:
+        """
+        Times the enclosed block as a child of the current span.
+
+        Yields:
+            Span or None: The span, to add attributes to; None when tracing is off or there is no investigation.
+        """
+        trace_id = current_investigation_id()
+        if not Config.tracing_enabled or trace_id is None:
+            yield None
+            return
+
+        parent = current_span_var.get()
+        span = Span(name, kind, trace_id, parent_id=parent.span_id if parent is not None and parent.trace_id == trace_id else None)
+        span.set_attributes(**attributes)
+        context_token = current_span_var.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = f"{type(e).__name__}: {str(e)}"[:500]
+            raise
+        finally:
+            span.end = time.time()
+            current_span_var.reset(context_token)
+            self.exporter.export(span)
+
+    def record(self, name: str, kind: str, start: float, end: float, **attributes):
+        """Records a step whose start and end were observed rather than wrapped, as a child of the current span."""
+        trace_id = current_investigation_id()
+        if not Config.tracing_enabled or trace_id is None:
+            return
+        parent = current_span_var.get()
+        span = Span(name, kind, trace_id, parent_id=parent.span_id if parent is not None else None, start=start)
+        span.end = end
+        span.set_attributes(**attributes)
+        self.exporter.export(span)
+
+    def waterfall(self, investigation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        The spans of an investigation in start order with their depth and offset from the first span,
+        and totals per span kind.
+
+        Returns:
+            dict or None: None when the investigation has no trace.
+        """
+        spans = self.exporter.spans(investigation_id)
+        if not spans:
+            return None
+        spans.sort(key=lambda span: span.start)
+        origin = spans[0].start
+        end = max(span.end or time.time() for span in spans)
+        by_id = {span.span_id: span for span in spans}
+
+        def depth(span: Span) -> int:
+            level = 0
+            while span.parent_id in by_id and level < 50:
+                span = by_id[span.parent_id]
+                level += 1
+            return level
+
+        totals: Dict[str, Dict[str, Any]] = {}
+        entries = []
+        for span in spans:
+            entry = span.to_dict()
+            entry["depth"] = depth(span)
+            entry["offset_ms"] = round((span.start - origin) * 1000, 1)
+            entries.append(entry)
+
+            total = totals.setdefault(span.kind, {"count": 0, "duration_ms": 0.0, "errors": 0})
+            total["count"] += 1
+            total["duration_ms"] = round(total["duration_ms"] + entry["duration_ms"], 1)
+            total["errors"] += span.status == "error"
+            for key in ("prompt_tokens", "completion_tokens"):
+                if key in span.attributes:
+                    total[key] = total.get(key, 0) + span.attributes[key]
+
+        return {
+            "investigation_id": investigation_id,
+            "duration_ms": round((end - origin) * 1000, 1),
+            "totals": totals,
+            "spans": entries,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "traces": len(self.exporter.traces),
+            "exported": self.exporter.exported,
+            "dropped": self.exporter.dropped,
+        }
+
+def _size(value: Any) -> int:
+    # Payload size in characters
+    if isinstance(value, str):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+def traced_tool(function):
+    """
+    Decorator for async tool functions: one span per call with its arguments and result sizes.
+    The signature and docstring are kept, so the tool schema seen by the agents does not change.
+    """
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        arguments = {key: value for key, value in kwargs.items() if key != "cancellation_token"}
+        with tracer.span(function.__name__, "tool", arguments_chars=_size([list(args), arguments])) as span:
+            result = await function(*args, **kwargs)
+            if span is not None:
+                span.set_attributes(result_chars=_size(result))
+            return result
+    return wrapper
+
+class TracingChatCompletionClient(DelegatingChatCompletionClient):
+    """A view of the model client that records each call of an agent as a model span."""
+
+    def __init__(self, inner: ChatCompletionClient, agent_name: str):
+        super().__init__(inner)
+        self.agent_name = agent_name
+
+    @staticmethod
+    def _finish(span: Optional[Span], result: CreateResult):
+        if span is None:
+            return
+        span.set_attributes(
+            prompt_tokens=result.usage.prompt_tokens,
+            completion_tokens=result.usage.completion_tokens,
+            completion_chars=_size(result.content),
+            finish_reason=result.finish_reason,
+            cached=result.cached,
+        )
+
+    async def create(self, messages: Sequence[LLMMessage], **kwargs) -> CreateResult:
+        with tracer.span(f"{self.agent_name} model call", "model", agent=self.agent_name, messages=len(messages),
+                         prompt_chars=sum(_size(message.content) for message in messages)) as span:
+            result = await self.inner.create(messages, **kwargs)
+            self._finish(span, result)
+            return result
+
+    async def create_stream(self, messages: Sequence[LLMMessage], **kwargs):
+        with tracer.span(f"{self.agent_name} model call", "model", agent=self.agent_name, messages=len(messages),
+                         prompt_chars=sum(_size(message.content) for message in messages), stream=True) as span:
+            async for item in self.inner.create_stream(messages, **kwargs):
+                if isinstance(item, CreateResult):
+                    self._finish(span, item)
+                yield item
+
+    async def close(self) -> None:
+        # The shared client is closed by its owner
+        pass
+
+def with_tracing(client: ChatCompletionClient, agent_name: str) -> ChatCompletionClient:
+    if not Config.tracing_enabled:
+        return client
+    return TracingChatCompletionClient(client, agent_name)
+
+class TurnTracer:
+    """
+    Records a turn span for each message of a team run, from the previous message to this one,
+    with its author, type, size and token usage.
+    """
+
+    def __init__(self):
+        self.last = time.time()
+
+    def observe(self, message: Any):
+        now = time.time()
+        source = getattr(message, "source", None)
+        if source is not None and source != "user":
+            usage = getattr(message, "models_usage", None)
+            tracer.record(
+                f"{source} turn", "turn", self.last, now,
+                agent=source,
+                message_type=type(message).__name__,
+                content_chars=_size(getattr(message, "content", "")),
+                prompt_tokens=usage.prompt_tokens if usage is not None else None,
+                completion_tokens=usage.completion_tokens if usage is not None else None,
+            )
+        self.last = now
+
+# Global instance
+tracer = Tracer()
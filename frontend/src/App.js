@@ -7,6 +7,8 @@ function App() {
   const [messages, setMessages] = useState([]);
   const [connecting, setConnecting] = useState(true);
   const wsRef = useRef(null);
+  const lastSeqRef = useRef(0); // Last stream event received, sent back when reconnecting
+  const seenSeqsRef = useRef(new Set()); // Stream events already shown
   const chatEndRef = useRef(null); // Ref to track the end of the chat window
 
   // Connect to WebSocket when component mounts
@@ -28,6 +30,10 @@ function App() {
     }
   }, [messages]);
 
+  // Several investigations can stream over the same socket, so their messages are labelled
+  const labelSender = (sender, investigationId) =>
+    investigationId ? `${sender} [${investigationId.slice(0, 8)}]` : sender;
+
   const connectWebSocket = () => {
     setConnecting(true);
     
@@ -37,13 +43,42 @@ function App() {
     ws.onopen = () => {
       console.log('WebSocket connected');
       setConnecting(false);
+
+      // Attach to a running investigation (?investigation=<id>) or catch up on what was missed while disconnected
+      const investigationId = new URLSearchParams(window.location.search).get('investigation');
+      if (investigationId) {
+        ws.send(JSON.stringify({ attach: investigationId, last_seq: lastSeqRef.current }));
+      } else if (lastSeqRef.current > 0) {
+        ws.send(JSON.stringify({ last_seq: lastSeqRef.current }));
+      }
     };
 
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
       console.log('WebSocket message received:', data);
       
-      const sender = data.sender || 'Problema que será resolvido'; // Default sender name
+      // Console output arrives in batched frames
+      if (data.type === 'batch') {
+        // Skip events already shown (replayed frames can overlap the live ones)
+        const fresh = data.messages.filter(msg => !msg.seq || !seenSeqsRef.current.has(msg.seq));
+        fresh.forEach(msg => {
+          if (msg.seq) {
+            seenSeqsRef.current.add(msg.seq);
+            lastSeqRef.current = Math.max(lastSeqRef.current, msg.seq);
+          }
+        });
+        const batch = fresh.map(msg => ({ sender: labelSender(msg.sender, msg.investigation_id), text: msg.text }));
+        if (data.truncated) {
+          batch.unshift({ sender: 'SYSTEM', text: 'Some earlier output is no longer available' });
+        }
+        if (data.dropped) {
+          batch.push({ sender: 'SYSTEM', text: `${data.dropped} console lines dropped` });
+        }
+        setMessages(prev => [...prev, ...batch]);
+        return;
+      }
+
+      const sender = labelSender(data.sender || 'Problema que será resolvido', data.investigation_id); // Default sender name
       if (data.text) {
         setMessages(prev => [...prev, { 
           sender: sender, 